@@ -0,0 +1,4 @@
+"""
+Benchmark scripts. They are not part of the test suite, run them from the
+project root with ``python -m benchmarks.<name>``.
+"""
@@ -0,0 +1,67 @@
+"""
+Benchmark of the response compression cost against the bandwidth it saves.
+
+Renders random coverage responses of `--sizes` dealers, as the coverage view
+does, and compresses them with gzip at every `--gzip-levels` and with brotli at
+every `--brotli-qualities` (if installed). Reports the compression ratio, the
+CPU time per response and the bytes saved per CPU millisecond, which tells how
+much bandwidth each level buys for the time it takes, plus the time to answer
+from the compressed bytes cache instead.
+
+    python -m benchmarks.compression --sizes 3 100 1000
+"""
+import argparse
+import json
+import random
+import time
+
+from benchmarks.prerendered import random_rows
+from leads_api.tweens import LRUCache, brotli, compress
+from leads_api.views.coverage import coverage_data
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--sizes', type=int, nargs='+', default=[3, 100, 1000])
+    ap.add_argument('--gzip-levels', type=int, nargs='+', default=[1, 6, 9])
+    ap.add_argument('--brotli-qualities', type=int, nargs='+', default=[1, 5, 11])
+    ap.add_argument('--responses', type=int, default=200)
+    ap.add_argument('--seed', type=int, default=0)
+    args = ap.parse_args()
+
+    encodings = [('gzip', level) for level in args.gzip_levels]
+    if brotli is not None:
+        encodings += [('br', quality) for quality in args.brotli_qualities]
+    else:
+        print('brotli is not installed, only gzip is measured')
+
+    rng = random.Random(args.seed)
+    for size in args.sizes:
+        bodies = [
+            json.dumps({'data': coverage_data(random_rows(rng, size))}, separators=(',', ':')).encode()
+            for _ in range(args.responses)
+        ]
+        raw = sum(len(body) for body in bodies)
+        print(f'{size} dealers, {raw / len(bodies):.0f} bytes per response')
+        for encoding, level in encodings:
+            cpu = time.process_time()
+            compressed = sum(len(compress(body, encoding, level)) for body in bodies)
+            cpu = time.process_time() - cpu
+            print(
+                f'  {encoding:<4} {level:>2}   ratio {raw / compressed:5.2f}   '
+                f'cpu per response {cpu / len(bodies) * 1e6:9.1f} us   '
+                f'saved {(raw - compressed) / max(cpu * 1e3, 1e-9) / 1024:8.1f} KiB per cpu ms'
+            )
+
+        cache = LRUCache(len(bodies))
+        for ix, body in enumerate(bodies):
+            cache.put(ix, compress(body, 'gzip', 6))
+        cpu = time.process_time()
+        for ix in range(len(bodies)):
+            cache.get(ix)
+        cpu = time.process_time() - cpu
+        print(f'  cached        cpu per response {cpu / len(bodies) * 1e6:9.1f} us')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Benchmark of the vectorised coverage distances computed by `generate_coverage.py`.
+
+Places random zipcodes and dealers over the continental US and measures the time
+to find every dealer x zipcode pair within the radius.
+
+    python -m benchmarks.coverage_distances --zipcodes 40000 --dealers 100000 --radius 50
+"""
+import argparse
+import time
+
+import numpy as np
+
+from generate_coverage import Zipcodes, haversine, pairs_within
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--zipcodes', type=int, default=40000)
+    ap.add_argument('--dealers', type=int, default=100000)
+    ap.add_argument('--radius', type=float, default=50)
+    ap.add_argument('--chunk-size', type=int, default=256)
+    ap.add_argument('--seed', type=int, default=0)
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    zipcodes = Zipcodes(
+        [f'{i:05d}' for i in range(args.zipcodes)],
+        rng.uniform(25, 49, args.zipcodes),
+        rng.uniform(-124, -67, args.zipcodes),
+    )
+    lat = rng.uniform(25, 49, args.dealers)
+    lon = rng.uniform(-124, -67, args.dealers)
+
+    start = time.perf_counter()
+    pairs = 0
+    for dealer_ixs, zip_ixs, distances in pairs_within(
+        lat, lon, zipcodes, args.radius, chunk_size=args.chunk_size
+    ):
+        pairs += len(distances)
+    elapsed = time.perf_counter() - start
+    print(
+        f'{args.dealers} dealers x {args.zipcodes} zipcodes, radius {args.radius:g} mi: '
+        f'{pairs} pairs in {elapsed:.2f}s'
+    )
+
+    # Check a sample of dealers against the brute force distances
+    sample = rng.choice(args.dealers, size=min(50, args.dealers), replace=False)
+    expected = sum(
+        int((haversine(lat[i], lon[i], zipcodes.lat, zipcodes.lon) <= args.radius).sum())
+        for i in sample
+    )
+    found = sum(
+        len(distances)
+        for _, _, distances in pairs_within(lat[sample], lon[sample], zipcodes, args.radius)
+    )
+    print(f'brute force check on {len(sample)} dealers: {found} / {expected} pairs')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""
+Benchmark of the coverage table storing integer ids against storing the slugs.
+
+Creates both layouts side by side in the database of the config file, filled
+with the same random rows, and reports the size of each table and its primary
+key. Then runs the same random (tier, zipcode) lookups on both, and reports their
+latency and the buffer cache hit ratio of the table and index blocks they read.
+
+    python -m benchmarks.coverage_encoding development.ini --rows 5000000
+
+The benchmark tables are dropped at the end.
+"""
+import argparse
+import random
+import time
+
+from pyramid.paster import get_appsettings
+from sqlalchemy import text
+
+from benchmarks.coverage_engines import report
+from leads_api.models import get_engine
+
+LAYOUTS = {
+    'slugs': {
+        'create': (
+            'CREATE TABLE bench_coverage_slugs ('
+            'buyer_tier_slug VARCHAR(50), dealer_code VARCHAR(50), zipcode VARCHAR(255), '
+            'distance INTEGER, PRIMARY KEY (buyer_tier_slug, dealer_code, zipcode))'
+        ),
+        'fill': (
+            'INSERT INTO bench_coverage_slugs '
+            "SELECT 'buyer-' || (t % :buyers) || '-tier-' || t, 'dealer-' || d, "
+            "lpad(z::text, 5, '0'), (random() * 100)::int "
+            'FROM ('
+            '  SELECT DISTINCT (random() * :tiers)::int AS t, (random() * :dealers)::int AS d, '
+            '  (random() * :zipcodes)::int AS z FROM generate_series(1, :rows)'
+            ') AS rows'
+        ),
+        'lookup': (
+            'SELECT dealer_code, distance FROM bench_coverage_slugs '
+            "WHERE buyer_tier_slug = 'buyer-' || (:tier % :buyers) || '-tier-' || :tier "
+            "AND zipcode = lpad(CAST(:zipcode AS text), 5, '0') ORDER BY distance LIMIT 3"
+        ),
+    },
+    'ids': {
+        'create': (
+            'CREATE TABLE bench_coverage_ids ('
+            'buyer_tier_id INTEGER, zipcode_id INTEGER, dealer_id INTEGER, '
+            'distance SMALLINT, PRIMARY KEY (buyer_tier_id, zipcode_id, dealer_id))'
+        ),
+        'fill': (
+            'INSERT INTO bench_coverage_ids '
+            'SELECT substring(buyer_tier_slug FROM \'-tier-(\\d+)$\')::int, zipcode::int, '
+            'substring(dealer_code FROM 8)::int, distance '
+            'FROM bench_coverage_slugs ORDER BY 1, 2, 3'
+        ),
+        'lookup': (
+            'SELECT dealer_id, distance FROM bench_coverage_ids '
+            'WHERE buyer_tier_id = :tier AND zipcode_id = :zipcode ORDER BY distance LIMIT 3'
+        ),
+    },
+}
+
+SIZES = """
+SELECT pg_relation_size(:table), pg_indexes_size(:table)
+"""
+
+CACHE_HITS = """
+SELECT heap_blks_read, heap_blks_hit, idx_blks_read, idx_blks_hit
+FROM pg_statio_user_tables WHERE relname = :table
+"""
+
+
+def hit_ratio(read, hit):
+    return hit / (read + hit) if read + hit else 1
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('config_uri')
+    ap.add_argument('--rows', type=int, default=1000000)
+    ap.add_argument('--buyers', type=int, default=50)
+    ap.add_argument('--tiers', type=int, default=200)
+    ap.add_argument('--dealers', type=int, default=20000)
+    ap.add_argument('--zipcodes', type=int, default=40000)
+    ap.add_argument('--lookups', type=int, default=5000)
+    ap.add_argument('--seed', type=int, default=0)
+    args = ap.parse_args()
+
+    engine = get_engine(get_appsettings(args.config_uri))
+    params = {
+        'rows': args.rows,
+        'buyers': args.buyers,
+        'tiers': args.tiers,
+        'dealers': args.dealers,
+        'zipcodes': args.zipcodes,
+    }
+    rng = random.Random(args.seed)
+    lookups = [
+        (rng.randrange(args.tiers), rng.randrange(args.zipcodes)) for _ in range(args.lookups)
+    ]
+
+    try:
+        with engine.begin() as connection:
+            for name, layout in LAYOUTS.items():
+                connection.execute(text(f'DROP TABLE IF EXISTS bench_coverage_{name}'))
+                connection.execute(text(layout['create']))
+                connection.execute(text(layout['fill']), params)
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            for name in LAYOUTS:
+                connection.execute(text(f'ANALYZE bench_coverage_{name}'))
+
+        # Each lookup commits on its own, so the statistics are reported as they go
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            for name, layout in LAYOUTS.items():
+                table = f'bench_coverage_{name}'
+                heap, index = connection.execute(text(SIZES), {'table': table}).one()
+                print(f'{name:<10} table {heap / 2 ** 20:8.1f} MiB   index {index / 2 ** 20:8.1f} MiB')
+
+                before = connection.execute(text(CACHE_HITS), {'table': table}).one()
+                latencies = []
+                for tier, zipcode in lookups:
+                    start = time.perf_counter()
+                    connection.execute(text(layout['lookup']), {
+                        'tier': tier, 'zipcode': zipcode, 'buyers': args.buyers,
+                    }).all()
+                    latencies.append(time.perf_counter() - start)
+                report(name, latencies)
+
+                # Statistics are flushed by the backend asynchronously
+                time.sleep(1)
+                connection.execute(text('SELECT pg_stat_clear_snapshot()'))
+                after = connection.execute(text(CACHE_HITS), {'table': table}).one()
+                heap_read, heap_hit, idx_read, idx_hit = [
+                    (a or 0) - (b or 0) for a, b in zip(after, before)
+                ]
+                print(
+                    f'{name:<10} cache hit ratio: table {hit_ratio(heap_read, heap_hit):.3f}   '
+                    f'index {hit_ratio(idx_read, idx_hit):.3f}'
+                )
+    finally:
+        with engine.begin() as connection:
+            for name in LAYOUTS:
+                connection.execute(text(f'DROP TABLE IF EXISTS bench_coverage_{name}'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+Benchmark of the spatial coverage engine against the precomputed coverage table.
+
+Builds the in-memory spatial index for random dealers and zipcodes over the
+continental US and measures its memory and lookup latency. For the same data,
+counts the dealer x zipcode pairs the precomputed table would need to store.
+
+With a config file, the SQL engine lookup latency and the real size of the
+`buyer_tier_dealer_coverage` table are also measured against that database.
+
+    python -m benchmarks.coverage_engines --dealers 100000 --zipcodes 40000
+    python -m benchmarks.coverage_engines --config-uri development.ini --tier t1 --make honda
+"""
+import argparse
+import statistics
+import time
+import tracemalloc
+
+import numpy as np
+
+from generate_coverage import Zipcodes, pairs_within
+from leads_api.engines.spatial import GridIndex, SpatialCoverage, TierInfo
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    return {
+        'p50': statistics.median(latencies),
+        'p99': latencies[int(len(latencies) * 0.99) - 1],
+    }
+
+
+def report(name, latencies):
+    values = percentiles(latencies)
+    print(
+        f"{name:<10} p50 {values['p50'] * 1e6:8.1f} us   p99 {values['p99'] * 1e6:8.1f} us"
+    )
+
+
+def benchmark_sql(args, zipcodes):
+    from pyramid.paster import bootstrap
+    from sqlalchemy import text
+
+    with bootstrap(args.config_uri) as env:
+        request = env['request']
+        engine = request.registry['coverage_engine']
+        latencies = []
+        for zipcode in zipcodes:
+            start = time.perf_counter()
+            engine.lookup(request, args.tier, args.make, zipcode, args.limit)
+            latencies.append(time.perf_counter() - start)
+        report('sql', latencies)
+
+        size = request.dbsession.execute(text(
+            "SELECT pg_total_relation_size('buyer_tier_dealer_coverage')"
+        )).scalar()
+        print(f'sql        table + indexes: {size / 2 ** 20:.1f} MiB')
+        request.tm.abort()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--zipcodes', type=int, default=40000)
+    ap.add_argument('--dealers', type=int, default=100000)
+    ap.add_argument('--radius', type=float, default=50)
+    ap.add_argument('--limit', type=int, default=3)
+    ap.add_argument('--lookups', type=int, default=10000)
+    ap.add_argument('--cell-size', type=float, default=0.5)
+    ap.add_argument('--seed', type=int, default=0)
+    ap.add_argument('--config-uri', help='Also benchmark the SQL engine on this database')
+    ap.add_argument('--tier', help='Buyer tier slug used for the SQL engine lookups')
+    ap.add_argument('--make', help='Make slug used for the SQL engine lookups')
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    zip_codes = [f'{i:05d}' for i in range(args.zipcodes)]
+    zip_lat = rng.uniform(25, 49, args.zipcodes)
+    zip_lon = rng.uniform(-124, -67, args.zipcodes)
+    dealer_lat = rng.uniform(25, 49, args.dealers)
+    dealer_lon = rng.uniform(-124, -67, args.dealers)
+
+    # Spatial engine: memory of the index and lookup latency
+    tracemalloc.start()
+    dealers = GridIndex(args.cell_size)
+    for ix, (lat, lon) in enumerate(zip(dealer_lat.tolist(), dealer_lon.tolist())):
+        dealers.add(lat, lon, {'dealer_code': f'dealer-{ix}'})
+    coverage = SpatialCoverage(
+        tiers={'t1': TierInfo('b1', 'Buyer 1', 'Tier 1', radius=args.radius)},
+        tier_makes={('t1', 'honda'): 'Honda'},
+        dealers={'b1': dealers},
+        zipcodes=dict(zip(zip_codes, zip(zip_lat.tolist(), zip_lon.tolist()))),
+    )
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'spatial    index memory: {memory / 2 ** 20:.1f} MiB')
+
+    lookups = rng.choice(zip_codes, size=args.lookups).tolist()
+    latencies = []
+    for zipcode in lookups:
+        start = time.perf_counter()
+        coverage.lookup('t1', 'honda', zipcode, args.limit)
+        latencies.append(time.perf_counter() - start)
+    report('spatial', latencies)
+
+    # Precomputed table: amount of rows it needs for the same data
+    pairs = sum(
+        len(distances)
+        for _, _, distances in pairs_within(
+            dealer_lat, dealer_lon, Zipcodes(zip_codes, zip_lat, zip_lon), args.radius
+        )
+    )
+    print(f'sql        precomputed rows for one tier: {pairs}')
+
+    if args.config_uri:
+        benchmark_sql(args, lookups[:1000])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Benchmark of the memory mapped coverage index.
+
+Writes an index for random coverage rows and measures the file size, how long
+it takes to open it (what a worker pays on startup or reload) and the lookup
+latency.
+
+    python -m benchmarks.coverage_index --dealers 10000 --zipcodes 40000 --per-zipcode 20
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.coverage_engines import report
+from leads_api.engines.index import CoverageIndex, write_index
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--zipcodes', type=int, default=40000)
+    ap.add_argument('--dealers', type=int, default=10000)
+    ap.add_argument('--per-zipcode', type=int, default=20)
+    ap.add_argument('--limit', type=int, default=3)
+    ap.add_argument('--lookups', type=int, default=10000)
+    ap.add_argument('--seed', type=int, default=0)
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    zipcodes = [f'{i:05d}' for i in range(args.zipcodes)]
+    dealers = [
+        ('b1', f'dealer-{i}', f'Dealer {i}', f'{i} Main St', 'City', 'ST', rng.choice(zipcodes), None)
+        for i in range(args.dealers)
+    ]
+    coverage = [
+        ('t1', f'dealer-{rng.randrange(args.dealers)}', zipcode, rng.randrange(100))
+        for zipcode in zipcodes
+        for _ in range(args.per_zipcode)
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'coverage.idx')
+        start = time.perf_counter()
+        entries = write_index(
+            path, [('t1', 'b1', 'Buyer 1', 'Tier 1')], [('t1', 'honda', 'Honda')], dealers, coverage,
+        )
+        print(f'build      {entries} entries in {time.perf_counter() - start:.2f} s, '
+              f'{os.path.getsize(path) / 2 ** 20:.1f} MiB')
+
+        start = time.perf_counter()
+        index = CoverageIndex(path)
+        print(f'open       {(time.perf_counter() - start) * 1e3:.2f} ms')
+
+        latencies = []
+        for zipcode in rng.choices(zipcodes, k=args.lookups):
+            start = time.perf_counter()
+            index.lookup('t1', 'honda', zipcode, args.limit)
+            latencies.append(time.perf_counter() - start)
+        report('index', latencies)
+
+
+if __name__ == '__main__':
+    main()
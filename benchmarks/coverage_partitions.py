@@ -0,0 +1,166 @@
+"""
+Benchmark of the coverage table partitioned by tier against a single table.
+
+Creates both layouts side by side in the database of the config file, filled
+with the same random rows in insertion order, except the partitions which are
+filled sorted by (zipcode, distance) like `reload_tables.py` does. Reports the
+buffers read by the same random (tier, zipcode) lookups on both, as given by
+EXPLAIN (ANALYZE, BUFFERS), their latency, and how long it takes to reload the
+rows of one tier: a DELETE and INSERT on the single table, against a new
+partition swapped with DETACH/ATTACH.
+
+    python -m benchmarks.coverage_partitions development.ini --rows 5000000
+
+The benchmark tables are dropped at the end.
+"""
+import argparse
+import random
+import statistics
+import time
+
+from pyramid.paster import get_appsettings
+from sqlalchemy import text
+
+from benchmarks.coverage_engines import report
+from leads_api.models import get_engine
+
+COLUMNS = (
+    'buyer_tier_id INTEGER, zipcode_id INTEGER, dealer_id INTEGER, distance SMALLINT, '
+    'PRIMARY KEY (buyer_tier_id, zipcode_id, dealer_id)'
+)
+
+ROWS = (
+    'SELECT DISTINCT (random() * :tiers)::int AS t, (random() * :zipcodes)::int AS z, '
+    '(random() * :dealers)::int AS d, (random() * 100)::int AS distance '
+    'FROM generate_series(1, :rows)'
+)
+
+LOOKUP = (
+    'SELECT dealer_id, distance FROM {table} '
+    'WHERE buyer_tier_id = :tier AND zipcode_id = :zipcode ORDER BY distance LIMIT 3'
+)
+
+
+def create(connection, tiers: int):
+    connection.execute(text(f'CREATE TABLE bench_coverage_single ({COLUMNS})'))
+    connection.execute(text(
+        f'CREATE TABLE bench_coverage_partitioned ({COLUMNS}) PARTITION BY LIST (buyer_tier_id)'
+    ))
+    for tier in range(tiers + 1):
+        connection.execute(text(
+            f'CREATE TABLE bench_coverage_partitioned_{tier} '
+            f'PARTITION OF bench_coverage_partitioned FOR VALUES IN ({tier})'
+        ))
+
+
+def drop(connection):
+    for table in ('bench_coverage_single', 'bench_coverage_partitioned', 'bench_coverage_reload'):
+        connection.execute(text(f'DROP TABLE IF EXISTS {table}'))
+
+
+def buffers(connection, table: str, tier: int, zipcode: int) -> int:
+    """Shared buffers hit or read by a lookup"""
+    plan = connection.execute(
+        text(f'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {LOOKUP.format(table=table)}'),
+        {'tier': tier, 'zipcode': zipcode},
+    ).scalar()[0]['Plan']
+    return plan.get('Shared Hit Blocks', 0) + plan.get('Shared Read Blocks', 0)
+
+
+def reload_single(connection, tier: int):
+    connection.execute(text('DELETE FROM bench_coverage_single WHERE buyer_tier_id = :tier'),
+                       {'tier': tier})
+    connection.execute(text(
+        'INSERT INTO bench_coverage_single SELECT * FROM bench_coverage_rows WHERE t = :tier'
+    ), {'tier': tier})
+
+
+def reload_partition(connection, tier: int):
+    connection.execute(text(f'CREATE TABLE bench_coverage_reload ({COLUMNS})'))
+    connection.execute(text(
+        'INSERT INTO bench_coverage_reload SELECT * FROM bench_coverage_rows '
+        'WHERE t = :tier ORDER BY z, distance'
+    ), {'tier': tier})
+    connection.execute(text(
+        f'ALTER TABLE bench_coverage_reload ADD CHECK (buyer_tier_id = {tier})'
+    ))
+    connection.execute(text(
+        f'ALTER TABLE bench_coverage_partitioned DETACH PARTITION bench_coverage_partitioned_{tier}'
+    ))
+    connection.execute(text(f'DROP TABLE bench_coverage_partitioned_{tier}'))
+    connection.execute(text(f'ALTER TABLE bench_coverage_reload RENAME TO bench_coverage_partitioned_{tier}'))
+    connection.execute(text(
+        f'ALTER TABLE bench_coverage_partitioned ATTACH PARTITION bench_coverage_partitioned_{tier} '
+        f'FOR VALUES IN ({tier})'
+    ))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('config_uri')
+    ap.add_argument('--rows', type=int, default=1000000)
+    ap.add_argument('--tiers', type=int, default=200)
+    ap.add_argument('--dealers', type=int, default=20000)
+    ap.add_argument('--zipcodes', type=int, default=40000)
+    ap.add_argument('--lookups', type=int, default=2000)
+    ap.add_argument('--seed', type=int, default=0)
+    args = ap.parse_args()
+
+    engine = get_engine(get_appsettings(args.config_uri))
+    params = {
+        'rows': args.rows,
+        'tiers': args.tiers,
+        'dealers': args.dealers,
+        'zipcodes': args.zipcodes,
+    }
+    rng = random.Random(args.seed)
+    lookups = [
+        (rng.randrange(args.tiers), rng.randrange(args.zipcodes)) for _ in range(args.lookups)
+    ]
+    tables = {
+        'single': 'bench_coverage_single',
+        'partitioned': 'bench_coverage_partitioned',
+    }
+
+    try:
+        with engine.begin() as connection:
+            drop(connection)
+            create(connection, args.tiers)
+            connection.execute(text(f'CREATE UNLOGGED TABLE bench_coverage_rows AS {ROWS}'), params)
+            connection.execute(text('INSERT INTO bench_coverage_single SELECT * FROM bench_coverage_rows'))
+            connection.execute(text(
+                'INSERT INTO bench_coverage_partitioned '
+                'SELECT * FROM bench_coverage_rows ORDER BY t, z, distance'
+            ))
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            for table in tables.values():
+                connection.execute(text(f'ANALYZE {table}'))
+
+        with engine.connect() as connection:
+            for name, table in tables.items():
+                blocks = [buffers(connection, table, tier, zipcode) for tier, zipcode in lookups]
+                print(f'{name:<12} buffers per lookup: mean {statistics.mean(blocks):.1f}   '
+                      f'max {max(blocks)}')
+                latencies = []
+                for tier, zipcode in lookups:
+                    start = time.perf_counter()
+                    connection.execute(text(LOOKUP.format(table=table)), {
+                        'tier': tier, 'zipcode': zipcode,
+                    }).all()
+                    latencies.append(time.perf_counter() - start)
+                report(name, latencies)
+
+        tier = rng.randrange(args.tiers)
+        for name, reload in (('single', reload_single), ('partitioned', reload_partition)):
+            start = time.perf_counter()
+            with engine.begin() as connection:
+                reload(connection, tier)
+            print(f'{name:<12} reload of one tier: {time.perf_counter() - start:.3f} s')
+    finally:
+        with engine.begin() as connection:
+            drop(connection)
+            connection.execute(text('DROP TABLE IF EXISTS bench_coverage_rows'))
+
+
+if __name__ == '__main__':
+    main()
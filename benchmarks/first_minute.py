@@ -0,0 +1,83 @@
+"""
+Benchmark of the latency during the first minute after a server (re)start.
+
+Starts the server command, waits until it accepts connections and requests the
+hot keys in a loop, reporting the latencies of every 10 seconds bucket. A cold
+worker is slow on its first requests, while it opens connections and fills its
+caches, a warmed up one should be as fast in the first bucket as in the last.
+
+    python -m benchmarks.first_minute hot_keys.txt -- gunicorn --paste development.ini -c gunicorn.conf.py
+
+The hot keys file has one `tier make zipcode` per line, as `warmup.keys_file`.
+"""
+import argparse
+import socket
+import subprocess
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+from urllib.parse import quote
+
+from benchmarks.coverage_engines import report
+from leads_api.warmup import COVERAGE_PATH, read_hot_keys
+
+
+def wait_for_port(host: str, port: int, timeout: float):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('keys_file', type=Path)
+    ap.add_argument('command', nargs='+', help='Server command, after --')
+    ap.add_argument('--url', default='http://127.0.0.1:6543')
+    ap.add_argument('--duration', type=float, default=60)
+    ap.add_argument('--bucket', type=float, default=10)
+    args = ap.parse_args()
+
+    keys = read_hot_keys(args.keys_file)
+    host, _, port = args.url.split('//')[1].partition(':')
+    urls = [
+        args.url + COVERAGE_PATH.format(tier=quote(tier), make=quote(make)) + f'?zipcode={zipcode}'
+        for tier, make, zipcode in keys
+    ]
+
+    server = subprocess.Popen(args.command)
+    try:
+        start = time.monotonic()
+        wait_for_port(host, int(port or 80), timeout=60)
+        print(f'accepting connections after {time.monotonic() - start:.2f}s')
+
+        start = time.monotonic()
+        buckets = []
+        ix = 0
+        while time.monotonic() - start < args.duration:
+            bucket = int((time.monotonic() - start) // args.bucket)
+            while len(buckets) <= bucket:
+                buckets.append([])
+            request_start = time.perf_counter()
+            try:
+                urllib.request.urlopen(urls[ix % len(urls)]).read()
+            except urllib.error.HTTPError as error:
+                error.read()
+            buckets[bucket].append(time.perf_counter() - request_start)
+            ix += 1
+        for bucket, latencies in enumerate(buckets):
+            if latencies:
+                report(f'{bucket * args.bucket:.0f}-{(bucket + 1) * args.bucket:.0f}s', latencies)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Scaling benchmark of `import_data.py` when processing buyers in parallel.
+
+Generates a synthetic catalogue and measures the SQL generation time with
+1, 2, 4 and 8 worker processes, checking the output is always the same.
+
+    python -m benchmarks.import_data_jobs --buyers 200 --dealers 500
+"""
+import argparse
+import hashlib
+import time
+
+from import_data import generate_sql
+
+
+def make_data(buyers: int, tiers: int, dealers: int, makes: int):
+    """Creates a synthetic yaml-like catalogue"""
+    make_slugs = [f'make-{m}' for m in range(makes)]
+    years = ['2021', '2022', '2023']
+    data = {
+        'years': {year: {'slug': year, 'name': year} for year in years},
+        'makes': {
+            make: {'slug': make, 'name': make.title(), 'years': years}
+            for make in make_slugs
+        },
+        'buyers': {},
+    }
+    for b in range(buyers):
+        buyer = f'buyer-{b}'
+        data['buyers'][buyer] = {
+            'slug': buyer,
+            'name': f'Buyer {b}',
+            'years': years,
+            'makes': {make: {'years': years} for make in make_slugs},
+            'tiers': {
+                f'{buyer}-tier-{t}': {
+                    'slug': f'{buyer}-tier-{t}',
+                    'name': f'Tier {t}',
+                    'years': years,
+                    'makes': {
+                        make: {'make_slug': make, 'years': years}
+                        for make in make_slugs
+                    },
+                }
+                for t in range(tiers)
+            },
+            'dealers': {
+                f'{buyer}-dealer-{d}': {
+                    'code': f'{buyer}-dealer-{d}',
+                    'name': f'Dealer {d}',
+                    'address': f'{d} Main St',
+                    'city': 'Springfield',
+                    'state': 'IL',
+                    'zipcode': f'{d % 100000:05d}',
+                    'phone': '555-0100',
+                    'years': years,
+                    'makes': {make: {'years': years} for make in make_slugs},
+                }
+                for d in range(dealers)
+            },
+        }
+    return data
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--buyers', type=int, default=200)
+    ap.add_argument('--tiers', type=int, default=3)
+    ap.add_argument('--dealers', type=int, default=500)
+    ap.add_argument('--makes', type=int, default=5)
+    ap.add_argument('--jobs', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = ap.parse_args()
+
+    data = make_data(args.buyers, args.tiers, args.dealers, args.makes)
+
+    baseline = None
+    print(f"{'jobs':>5} {'seconds':>9} {'speedup':>8}  sha1")
+    for jobs in args.jobs:
+        start = time.perf_counter()
+        sql = generate_sql(data, jobs=jobs)
+        elapsed = time.perf_counter() - start
+        if baseline is None:
+            baseline = elapsed
+        digest = hashlib.sha1(sql.encode()).hexdigest()[:12]
+        print(f'{jobs:>5} {elapsed:>9.3f} {baseline / elapsed:>7.2f}x  {digest}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""
+Benchmark of the pre-rendered coverage responses against the dynamic path.
+
+Without a config file, measures the rendering alone for random responses of
+`--limit` dealers: building the `data` dict from the rows, serializing it and
+wrapping it in the envelope (which parses and serializes it again), against
+splicing already rendered bytes into the envelope.
+
+With a config file, measures whole requests through the application for the
+(tier, make, zipcode) keys of the `coverage_response` view, with and without
+`coverage.prerendered`, which needs the views refreshed by an import.
+
+Both report the p50/p99 latency and the CPU time per request.
+
+    python -m benchmarks.prerendered
+    python -m benchmarks.prerendered --config-uri development.ini --requests 2000
+"""
+import argparse
+import json
+import random
+import time
+
+from pyramid.renderers import JSON
+from pyramid.request import Request
+from pyramid.response import Response
+
+from benchmarks.coverage_engines import report
+from leads_api.prerendered import PrerenderedResponse
+from leads_api.tweens import base_response_tween
+from leads_api.views.coverage import coverage_data
+
+
+def cpu_report(name, cpu, requests):
+    print(f'{name:<10} cpu per request {cpu / requests * 1e6:8.1f} us')
+
+
+def random_rows(rng, limit):
+    return [
+        {
+            'buyer': 'Buyer 1',
+            'buyer_tier': 'Blind',
+            'make': 'Honda',
+            'dealer_code': f'dealer-{rng.randrange(100000)}',
+            'dealer_name': f'Dealer {rng.randrange(100000)} Motors',
+            'dealer_address': f'{rng.randrange(10000)} Main Street',
+            'dealer_city': 'Springfield',
+            'dealer_state': 'IL',
+            'dealer_zipcode': f'{rng.randrange(100000):05d}',
+            'dealer_phone': f'555-{rng.randrange(10000):04d}',
+            'distance': distance,
+            'zipcode': '10010',
+        }
+        for distance in sorted(rng.randrange(100) for _ in range(limit))
+    ]
+
+
+def measure(name, call, items):
+    latencies = []
+    cpu = time.process_time()
+    for item in items:
+        start = time.perf_counter()
+        call(item)
+        latencies.append(time.perf_counter() - start)
+    cpu = time.process_time() - cpu
+    report(name, latencies)
+    cpu_report(name, cpu, len(items))
+
+
+def benchmark_rendering(args):
+    rng = random.Random(args.seed)
+    responses = [random_rows(rng, args.limit) for _ in range(args.requests)]
+    prerendered = [
+        json.dumps(coverage_data(rows), separators=(',', ':')).encode() for rows in responses
+    ]
+    request = Request.blank('/v1/buyers_tiers/t1/makes/honda/coverage?zipcode=10010')
+    renderer = JSON()(None)
+
+    # The tweens only see the request, the handlers take the item being measured
+    def dynamic(rows):
+        def handler(request):
+            body = renderer(coverage_data(rows), {'request': None})
+            return Response(body=body.encode(), content_type='application/json')
+        return base_response_tween(handler, None)(request)
+
+    def spliced(data):
+        return base_response_tween(lambda request: PrerenderedResponse(data), None)(request)
+
+    measure('dynamic', dynamic, responses)
+    measure('prerendered', spliced, prerendered)
+
+
+def benchmark_requests(args):
+    from pyramid.paster import get_appsettings
+    from sqlalchemy import select
+    from webtest import TestApp
+
+    from leads_api import main as make_app
+    from leads_api.models.tables import coverage_response
+
+    settings = get_appsettings(args.config_uri)
+    app = make_app({}, **settings)
+    registry = app.registry
+    dbsession = registry['dbsession_factory']()
+    try:
+        keys = dbsession.execute(
+            select(coverage_response.c.tier_slug, coverage_response.c.make_slug,
+                   coverage_response.c.zipcode).limit(args.requests)
+        ).all()
+    finally:
+        dbsession.close()
+    if not keys:
+        print('No pre-rendered responses, refresh the views with an import first')
+        return
+
+    testapp = TestApp(app)
+    paths = [
+        (f'/v1/buyers_tiers/{tier}/makes/{make}/coverage', {'zipcode': zipcode})
+        for tier, make, zipcode in keys
+    ]
+    for name, enabled in (('dynamic', False), ('prerendered', True)):
+        registry['prerendered'] = enabled
+        measure(name, lambda path: testapp.get(path[0], params=path[1]), paths)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--requests', type=int, default=20000)
+    ap.add_argument('--limit', type=int, default=3)
+    ap.add_argument('--seed', type=int, default=0)
+    ap.add_argument('--config-uri', help='Measure whole requests on this database')
+    args = ap.parse_args()
+
+    if args.config_uri:
+        benchmark_requests(args)
+    else:
+        benchmark_rendering(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Benchmark of the application startup time.
+
+Creates the application in fresh processes, as a worker boot does, with the
+previous startup (Jinja2, the explorer, scanning the views and parsing the
+spec every time) and with the current defaults and a spec cache. Reports the
+median and max time from the first import to the WSGI application.
+
+    python -m benchmarks.startup testing.ini --runs 20
+
+The database is not used, the application doesn't connect on startup.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+
+PROFILES = {
+    'previous': {
+        'jinja2.enabled': 'true',
+        'openapi.explorer': 'true',
+        'views.scan': 'true',
+    },
+    'current': {},
+}
+
+BOOT = """
+import json, sys, time
+start, cpu = time.perf_counter(), time.process_time()
+from pyramid.paster import get_appsettings
+from leads_api import main
+settings = get_appsettings(sys.argv[1])
+settings.update(json.loads(sys.argv[2]))
+main({}, **settings)
+print(time.perf_counter() - start, time.process_time() - cpu)
+"""
+
+
+def boot(config_uri: str, settings: dict):
+    """Wall and CPU seconds to create the application in a new process"""
+    output = subprocess.run(
+        [sys.executable, '-c', BOOT, config_uri, json.dumps(settings)],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    wall, cpu = output.strip().splitlines()[-1].split()
+    return float(wall), float(cpu)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('config_uri')
+    ap.add_argument('--runs', type=int, default=10)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        PROFILES['current']['openapi.spec_cache_dir'] = cache_dir
+        # The first boot of each profile warms the bytecode and spec caches, then
+        # the profiles are alternated so they see the same machine load
+        times = {name: [] for name in PROFILES}
+        for run in range(args.runs + 1):
+            for name, settings in PROFILES.items():
+                result = boot(args.config_uri, settings)
+                if run:
+                    times[name].append(result)
+
+    for name, results in times.items():
+        wall = [result[0] for result in results]
+        cpu = [result[1] for result in results]
+        print(
+            f'{name:<10} wall median {statistics.median(wall) * 1000:7.1f} ms   '
+            f'max {max(wall) * 1000:7.1f} ms   cpu median {statistics.median(cpu) * 1000:7.1f} ms'
+        )
+
+if __name__ == '__main__':
+    main()
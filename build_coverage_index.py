@@ -0,0 +1,150 @@
+"""
+Builds the coverage index file read by the `index` coverage engine.
+
+The index is built either from the database, or from the yaml file used by
+`import_data.py` plus the coverage rows generated by `generate_coverage.py`:
+
+    python build_coverage_index.py -o coverage.idx --config-uri development.ini
+    python build_coverage_index.py -o coverage.idx --source data.yaml --coverage coverage.tsv
+
+The new file replaces the previous one atomically, and the API workers reopen it
+on their next lookups.
+"""
+import re
+import sys
+import argparse
+import logging
+from pathlib import Path
+from typing import Iterator, List, Tuple
+
+import yaml
+from pyramid.paster import get_appsettings
+from sqlalchemy import select
+
+from import_data import collect_tables, extract_all
+from leads_api.engines.index import write_index
+from leads_api.models import get_engine
+from leads_api.models.tables import (
+    buyer,
+    buyer_dealer,
+    buyer_tier,
+    buyer_tier_dealer_coverage,
+    buyer_tier_make,
+    make,
+    zipcode,
+)
+
+logger = logging.getLogger(__name__)
+
+DEALER_COLUMNS = ('buyer_slug', 'code', 'name', 'address', 'city', 'state', 'zipcode', 'phone')
+
+COPY_ESCAPES = {'t': '\t', 'n': '\n', 'r': '\r', '\\': '\\'}
+
+
+def copy_unescape(value: str):
+    """Parses a value of the COPY text format"""
+    if value == '\\N':
+        return None
+    return re.sub(r'\\(.)', lambda match: COPY_ESCAPES.get(match.group(1), match.group(1)), value)
+
+
+def read_coverage(path: Path) -> Iterator[Tuple[str, str, str, int]]:
+    """Reads the coverage rows from a COPY text file"""
+    with open(path, 'r') as f:
+        for line in f:
+            tier_slug, dealer_code, zipcode, distance = (
+                copy_unescape(value) for value in line.rstrip('\n').split('\t')
+            )
+            yield tier_slug, dealer_code, zipcode, int(distance)
+
+
+def rows_from_source(source: Path) -> Tuple[List, List, List]:
+    """Extracts the tiers, tier makes and dealers rows from the yaml file"""
+    with open(source, 'r') as f:
+        data = yaml.safe_load(f)
+    collected = collect_tables(extract_all(data))
+
+    def dicts(name):
+        _, columns, rows = collected[name]
+        return [dict(zip(columns, row)) for row in rows]
+
+    buyers = {row['slug']: row['name'] for row in dicts('buyer')}
+    makes = {row['slug']: row['name'] for row in dicts('make')}
+    tiers = [
+        (row['slug'], row['buyer_slug'], buyers.get(row['buyer_slug']), row['name'])
+        for row in dicts('buyer_tier')
+    ]
+    tier_makes = [
+        (row['tier_slug'], row['make_slug'], makes.get(row['make_slug']))
+        for row in dicts('buyer_tier_make')
+    ]
+    dealers = [
+        tuple(None if row[column] is None else str(row[column]) for column in DEALER_COLUMNS)
+        for row in dicts('buyer_dealer')
+    ]
+    return tiers, tier_makes, dealers
+
+
+def write_from_database(output: Path, config_uri: str) -> int:
+    engine = get_engine(get_appsettings(config_uri))
+    with engine.connect() as connection:
+        tiers = connection.execute(
+            select(buyer_tier.c.slug, buyer_tier.c.buyer_slug, buyer.c.name, buyer_tier.c.name)
+            .where(buyer_tier.c.buyer_slug == buyer.c.slug)
+        ).all()
+        tier_makes = connection.execute(
+            select(buyer_tier_make.c.tier_slug, buyer_tier_make.c.make_slug, make.c.name)
+            .where(buyer_tier_make.c.make_slug == make.c.slug)
+        ).all()
+        dealers = connection.execute(
+            select(*[buyer_dealer.c[column] for column in DEALER_COLUMNS])
+        ).all()
+        # Stream the coverage from a server-side cursor, it can be much bigger
+        # than the rest. It's sorted in the code point order of the index
+        coverage = connection.execution_options(stream_results=True, yield_per=10000).execute(
+            select(
+                buyer_tier.c.slug,
+                buyer_dealer.c.code,
+                zipcode.c.code,
+                buyer_tier_dealer_coverage.c.distance,
+            )
+            .where(
+                buyer_tier_dealer_coverage.c.buyer_tier_id == buyer_tier.c.id,
+                buyer_tier_dealer_coverage.c.dealer_id == buyer_dealer.c.id,
+                buyer_tier_dealer_coverage.c.zipcode_id == zipcode.c.id,
+            )
+            .order_by(buyer_tier.c.slug.collate('C'), zipcode.c.code.collate('C'))
+        )
+        return write_index(output, tiers, tier_makes, dealers, coverage)
+
+
+def main(output: Path, config_uri: str = None, source: Path = None, coverage: Path = None) -> int:
+    """Builds the index from the database if `config_uri` is given, or from the
+    `source` yaml and the `coverage` file otherwise.
+
+    Returns:
+    --------
+    The amount of coverage entries in the index.
+    """
+    if config_uri is not None:
+        return write_from_database(output, config_uri)
+    tiers, tier_makes, dealers = rows_from_source(source)
+    # Coverage files are not sorted, unlike the rows streamed from the database
+    rows = sorted(read_coverage(coverage), key=lambda row: (row[0], row[2]))
+    return write_index(output, tiers, tier_makes, dealers, rows)
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument('-o', '--output', type=Path, required=True)
+    ap.add_argument('--config-uri', help='Build the index from this database')
+    ap.add_argument('--source', type=Path, help='yaml file with buyers, tiers and dealers')
+    ap.add_argument('--coverage', type=Path, help='Coverage rows in COPY text format')
+    args = ap.parse_args()
+    if args.config_uri is None and (args.source is None or args.coverage is None):
+        ap.error('Either --config-uri or both --source and --coverage are required')
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    entries = main(args.output, args.config_uri, args.source, args.coverage)
+    logger.info('Wrote %s coverage entries (%s bytes) to %s',
+                entries, args.output.stat().st_size, args.output)
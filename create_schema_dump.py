@@ -1,5 +1,6 @@
 from pathlib import Path
-from sqlalchemy.schema import CreateTable
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateIndex, CreateTable, ExecutableDDLElement
 from leads_api.models.tables import metadata
 
 base_path = Path('./docker-entrypoint-initdb.d/')
@@ -37,8 +38,23 @@ def main():
             comment(f, "Tables definitions")
             for table in metadata.sorted_tables:
                 comment(f, f"Create table `{table.name}`")
-                create_table = CreateTable(table)
+                create_table = CreateTable(table).compile(dialect=postgresql.dialect())
                 f.write(str(create_table).strip() + ';\n')
+                for index in sorted(table.indexes, key=lambda index: index.name):
+                    create_index = CreateIndex(index).compile(dialect=postgresql.dialect())
+                    f.write(str(create_index).strip() + ';\n')
+                # DDL run after creating the table, e.g. its partitions
+                for listener in table.dispatch.after_create:
+                    if isinstance(listener, ExecutableDDLElement):
+                        ddl = listener.against(table).compile(dialect=postgresql.dialect())
+                        f.write(str(ddl).strip() + ';\n')
+
+            # DDL run after creating all the tables, e.g. the materialized views
+            comment(f, "Views definitions")
+            for listener in metadata.dispatch.after_create:
+                if isinstance(listener, ExecutableDDLElement):
+                    ddl = listener.against(metadata).compile(dialect=postgresql.dialect())
+                    f.write(str(ddl).strip() + ';\n')
 
 
 if __name__ == '__main__':
@@ -17,12 +17,15 @@ CREATE TABLE public.buyer (
 
 -- Create table `buyer_tier_dealer_coverage`
 CREATE TABLE public.buyer_tier_dealer_coverage (
-	buyer_tier_slug VARCHAR(50) NOT NULL, 
-	dealer_code VARCHAR(50) NOT NULL, 
-	zipcode VARCHAR(255) NOT NULL, 
-	distance INTEGER, 
-	PRIMARY KEY (buyer_tier_slug, dealer_code, zipcode)
-);
+	buyer_tier_id INTEGER NOT NULL, 
+	zipcode_id INTEGER NOT NULL, 
+	dealer_id INTEGER NOT NULL, 
+	distance SMALLINT, 
+	PRIMARY KEY (buyer_tier_id, zipcode_id, dealer_id)
+)
+ PARTITION BY LIST (buyer_tier_id);
+CREATE INDEX buyer_tier_dealer_coverage_zipcode_distance_idx ON public.buyer_tier_dealer_coverage (zipcode_id, distance);
+CREATE TABLE public.buyer_tier_dealer_coverage_default PARTITION OF public.buyer_tier_dealer_coverage DEFAULT;
 
 -- Create table `country`
 CREATE TABLE public.country (
@@ -34,6 +37,14 @@ CREATE TABLE public.country (
 	UNIQUE (abbr)
 );
 
+-- Create table `data_version`
+CREATE TABLE public.data_version (
+	id INTEGER NOT NULL, 
+	version BIGINT NOT NULL, 
+	updated_at TIMESTAMP WITH TIME ZONE NOT NULL, 
+	PRIMARY KEY (id)
+);
+
 -- Create table `make`
 CREATE TABLE public.make (
 	slug VARCHAR(50) NOT NULL, 
@@ -50,6 +61,14 @@ CREATE TABLE public.year (
 	UNIQUE (name)
 );
 
+-- Create table `zipcode`
+CREATE TABLE public.zipcode (
+	id INTEGER GENERATED BY DEFAULT AS IDENTITY, 
+	code VARCHAR(255) NOT NULL, 
+	PRIMARY KEY (id), 
+	UNIQUE (code)
+);
+
 -- Create table `buyer_make`
 CREATE TABLE public.buyer_make (
 	buyer_slug VARCHAR(50) NOT NULL, 
@@ -64,8 +83,10 @@ CREATE TABLE public.buyer_tier (
 	buyer_slug VARCHAR(50) NOT NULL, 
 	slug VARCHAR(50) NOT NULL, 
 	name VARCHAR(50) NOT NULL, 
+	id INTEGER GENERATED BY DEFAULT AS IDENTITY, 
 	PRIMARY KEY (buyer_slug, slug), 
 	UNIQUE (buyer_slug, name), 
+	UNIQUE (id), 
 	FOREIGN KEY(buyer_slug) REFERENCES public.buyer (slug)
 );
 
@@ -120,8 +141,10 @@ CREATE TABLE public.buyer_dealer (
 	zipcode VARCHAR(255), 
 	country_slug VARCHAR(50), 
 	phone VARCHAR(255), 
+	id INTEGER GENERATED BY DEFAULT AS IDENTITY, 
 	PRIMARY KEY (buyer_slug, code), 
 	UNIQUE (buyer_slug, name, address, city, state, zipcode), 
+	UNIQUE (id), 
 	FOREIGN KEY(country_slug, state) REFERENCES public.country_state (country_slug, abbr), 
 	FOREIGN KEY(buyer_slug) REFERENCES public.buyer (slug)
 );
@@ -287,3 +310,15 @@ CREATE TABLE public.buyer_dealer_make_model_year (
 	FOREIGN KEY(buyer_slug, dealer_code, make_slug, model_slug) REFERENCES public.buyer_dealer_make_model (buyer_slug, dealer_code, make_slug, model_slug), 
 	FOREIGN KEY(buyer_slug, dealer_code, make_slug, year_slug) REFERENCES public.buyer_dealer_make_year (buyer_slug, dealer_code, make_slug, year_slug)
 );
+
+-- Views definitions
+CREATE MATERIALIZED VIEW public.coverage_lookup AS SELECT public.buyer_tier.slug AS tier_slug, public.buyer_tier_make.make_slug, public.zipcode.code AS zipcode, public.buyer_tier_dealer_coverage.distance, public.buyer_dealer.id AS dealer_id, public.buyer.name AS buyer, public.buyer_tier.name AS buyer_tier, public.make.name AS make, public.buyer_dealer.code AS dealer_code, public.buyer_dealer.name AS dealer_name, public.buyer_dealer.address AS dealer_address, public.buyer_dealer.city AS dealer_city, public.buyer_dealer.state AS dealer_state, public.buyer_dealer.zipcode AS dealer_zipcode, public.buyer_dealer.phone AS dealer_phone 
+FROM public.buyer_tier, public.buyer_tier_make, public.zipcode, public.buyer_tier_dealer_coverage, public.buyer_dealer, public.buyer, public.make 
+WHERE public.buyer_tier_dealer_coverage.buyer_tier_id = public.buyer_tier.id AND public.buyer_tier_dealer_coverage.zipcode_id = public.zipcode.id AND public.buyer_tier_dealer_coverage.dealer_id = public.buyer_dealer.id AND public.buyer_tier_make.buyer_slug = public.buyer_tier.buyer_slug AND public.buyer_tier_make.tier_slug = public.buyer_tier.slug AND public.buyer_tier_make.make_slug = public.make.slug AND public.buyer.slug = public.buyer_tier.buyer_slug;
+CREATE UNIQUE INDEX coverage_lookup_key ON public.coverage_lookup (tier_slug, make_slug, zipcode, distance, dealer_code);
+CREATE MATERIALIZED VIEW public.coverage_response AS SELECT ranked.tier_slug, ranked.make_slug, ranked.zipcode, convert_to(CAST(json_build_object('has_coverage', true, 'buyer', ranked.buyer, 'buyer_tier', ranked.buyer_tier, 'coverage', json_agg(json_build_object('dealer_code', ranked.dealer_code, 'dealer_name', ranked.dealer_name, 'dealer_address', ranked.dealer_address, 'dealer_city', ranked.dealer_city, 'dealer_state', ranked.dealer_state, 'dealer_zipcode', ranked.dealer_zipcode, 'dealer_phone', ranked.dealer_phone, 'distance', ranked.distance, 'zipcode', ranked.zipcode, 'make', ranked.make) ORDER BY ranked.rank), 'next_cursor', max(CASE WHEN (ranked.rank = 3 AND ranked.total > 3) THEN rtrim(translate(encode(convert_to(CAST(json_build_array(ranked.distance, ranked.dealer_code) AS TEXT), 'UTF8'), 'base64'), E'+/\n', '-_'), '=') END)) AS TEXT), 'UTF8') AS data 
+FROM (SELECT public.buyer_tier.slug AS tier_slug, public.buyer_tier_make.make_slug AS make_slug, public.zipcode.code AS zipcode, public.buyer.name AS buyer, public.buyer_tier.name AS buyer_tier, public.make.name AS make, public.buyer_dealer.code AS dealer_code, public.buyer_dealer.name AS dealer_name, public.buyer_dealer.address AS dealer_address, public.buyer_dealer.city AS dealer_city, public.buyer_dealer.state AS dealer_state, public.buyer_dealer.zipcode AS dealer_zipcode, public.buyer_dealer.phone AS dealer_phone, public.buyer_tier_dealer_coverage.distance AS distance, row_number() OVER (PARTITION BY public.buyer_tier.id, public.buyer_tier_make.make_slug, public.zipcode.id ORDER BY public.buyer_tier_dealer_coverage.distance, public.buyer_dealer.code) AS rank, count(*) OVER (PARTITION BY public.buyer_tier.id, public.buyer_tier_make.make_slug, public.zipcode.id) AS total 
+FROM public.buyer_tier, public.buyer_tier_make, public.zipcode, public.buyer, public.make, public.buyer_dealer, public.buyer_tier_dealer_coverage, public.buyer_dealer_make 
+WHERE public.buyer_tier_dealer_coverage.buyer_tier_id = public.buyer_tier.id AND public.buyer_tier_dealer_coverage.zipcode_id = public.zipcode.id AND public.buyer_tier_dealer_coverage.dealer_id = public.buyer_dealer.id AND public.buyer_tier_make.buyer_slug = public.buyer_tier.buyer_slug AND public.buyer_tier_make.tier_slug = public.buyer_tier.slug AND public.buyer_tier_make.make_slug = public.make.slug AND public.buyer.slug = public.buyer_tier.buyer_slug AND public.buyer_dealer_make.buyer_slug = public.buyer_dealer.buyer_slug AND public.buyer_dealer_make.dealer_code = public.buyer_dealer.code AND public.buyer_dealer_make.make_slug = public.buyer_tier_make.make_slug) AS ranked 
+WHERE ranked.rank <= 3 GROUP BY ranked.tier_slug, ranked.make_slug, ranked.zipcode, ranked.buyer, ranked.buyer_tier;
+CREATE UNIQUE INDEX coverage_response_key ON public.coverage_response (tier_slug, make_slug, zipcode);
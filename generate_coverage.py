@@ -0,0 +1,318 @@
+"""
+Generates the `buyer_tier_dealer_coverage` rows from coordinates.
+
+Every dealer of a buyer covers the zipcodes within the radius of each of the
+buyer tiers. Dealers and tiers are taken from the same yaml file used by
+`import_data.py`, zipcodes centroids from a CSV file with `zipcode`, `latitude`
+and `longitude` columns. Dealers are located on the centroid of their zipcode,
+unless their coordinates are given in a dealers CSV file with `buyer_slug`,
+`dealer_code`, `latitude` and `longitude` columns.
+
+    python generate_coverage.py data.yaml zipcodes.csv --default-radius 50 \\
+        --radius buyer-1-blind=100 -o coverage.tsv
+
+The output uses the PostgreSQL COPY text format, ready to be loaded with
+`reload_tables.py`. NumPy is required, install it with the `generate` extra:
+
+    pip install -e ".[generate]"
+
+Distances are computed with NumPy in chunks of dealers. Dealers and zipcodes are
+sorted by latitude, so each chunk only compares against the band of zipcodes that
+can be within the radius, and pairs outside of the bounding box are discarded
+before computing the haversine distance.
+"""
+import sys
+import csv
+import argparse
+import logging
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+import yaml
+
+from import_data import collect_tables, extract_all
+
+logger = logging.getLogger(__name__)
+
+# Distances are stored in miles
+EARTH_RADIUS = 3958.8
+MILES_PER_DEGREE = 69.17
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Vectorised great circle distance, in miles, between coordinates in degrees"""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1)))
+
+
+class Zipcodes:
+    """Zipcodes centroids sorted by latitude, to quickly find the ones close
+    to a latitude band."""
+
+    def __init__(self, codes: List[str], latitudes, longitudes):
+        order = np.argsort(latitudes, kind='stable')
+        self.codes = np.asarray(codes, dtype=object)[order]
+        self.lat = np.asarray(latitudes, dtype=np.float64)[order]
+        self.lon = np.asarray(longitudes, dtype=np.float64)[order]
+        self.index = {code: ix for ix, code in enumerate(self.codes)}
+
+    @classmethod
+    def from_csv(cls, path: Path) -> 'Zipcodes':
+        codes, latitudes, longitudes = [], [], []
+        with open(path, 'r', newline='') as f:
+            for row in csv.DictReader(f):
+                codes.append(row['zipcode'])
+                latitudes.append(float(row['latitude']))
+                longitudes.append(float(row['longitude']))
+        return cls(codes, latitudes, longitudes)
+
+    def coordinates(self, code: str):
+        """Returns the centroid of a zipcode, or None if it's unknown"""
+        ix = self.index.get(code)
+        if ix is None:
+            return None
+        return self.lat[ix], self.lon[ix]
+
+
+def pairs_within(
+    lat,
+    lon,
+    zipcodes: Zipcodes,
+    radius: float,
+    chunk_size: int = 256,
+) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """Finds all the (point, zipcode) pairs within the radius.
+
+    Args:
+    -----
+    * lat, lon (array): Coordinates of the points, e.g. dealers.
+    * zipcodes (Zipcodes): The zipcodes centroids.
+    * radius (float): Max distance in miles.
+    * chunk_size (int): Amount of points compared at once. Memory used is roughly
+        chunk_size * zipcodes in the latitude band.
+
+    Yields:
+    -------
+    Chunks of (point indexes, zipcode indexes, distances) arrays.
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    dlat = radius / MILES_PER_DEGREE
+
+    # Points sorted by latitude make each chunk cover a narrow band
+    order = np.argsort(lat, kind='stable')
+    for start in range(0, len(order), chunk_size):
+        points = order[start:start + chunk_size]
+        plat, plon = lat[points], lon[points]
+
+        # Band of zipcodes that can be within the radius of any point in the chunk
+        lo = np.searchsorted(zipcodes.lat, plat.min() - dlat, side='left')
+        hi = np.searchsorted(zipcodes.lat, plat.max() + dlat, side='right')
+        if lo == hi:
+            continue
+        zlat, zlon = zipcodes.lat[lo:hi], zipcodes.lon[lo:hi]
+
+        # Bounding box of each point. Longitude degrees shrink with the latitude
+        dlon = dlat / np.maximum(np.cos(np.radians(np.abs(plat) + dlat)), 0.01)
+        box = (
+            (np.abs(zlat[None, :] - plat[:, None]) <= dlat)
+            & (np.abs(zlon[None, :] - plon[:, None]) <= dlon[:, None])
+        )
+        point_ixs, zip_ixs = np.nonzero(box)
+        if len(point_ixs) == 0:
+            continue
+
+        # Exact distance only for the pairs inside the bounding box
+        distances = haversine(plat[point_ixs], plon[point_ixs], zlat[zip_ixs], zlon[zip_ixs])
+        within = distances <= radius
+        yield points[point_ixs[within]], zip_ixs[within] + lo, distances[within]
+
+
+def load_dealers_coordinates(path: Path) -> Dict[Tuple[str, str], Tuple[float, float]]:
+    """Loads the dealers coordinates by (buyer_slug, dealer_code)"""
+    with open(path, 'r', newline='') as f:
+        return {
+            (row['buyer_slug'], row['dealer_code']): (
+                float(row['latitude']), float(row['longitude'])
+            )
+            for row in csv.DictReader(f)
+        }
+
+
+def locate_dealers(
+    dealers: List[Dict],
+    zipcodes: Zipcodes,
+    coordinates: Dict[Tuple[str, str], Tuple[float, float]],
+) -> Dict[str, Tuple[List[str], np.ndarray, np.ndarray]]:
+    """Groups the dealers by buyer with their coordinates.
+
+    Returns:
+    --------
+    A dictionary of buyer_slug -> (dealer codes, latitudes, longitudes). Dealers
+    that can't be located are skipped.
+    """
+    located = {}
+    for dealer in dealers:
+        key = (dealer['buyer_slug'], dealer['code'])
+        position = coordinates.get(key)
+        if position is None and dealer['zipcode'] is not None:
+            position = zipcodes.coordinates(str(dealer['zipcode']))
+        if position is None:
+            logger.warning('Cannot locate dealer `%s` of buyer `%s`', key[1], key[0])
+            continue
+        codes, lats, lons = located.setdefault(dealer['buyer_slug'], ([], [], []))
+        codes.append(dealer['code'])
+        lats.append(position[0])
+        lons.append(position[1])
+    return {
+        buyer: (codes, np.asarray(lats), np.asarray(lons))
+        for buyer, (codes, lats, lons) in located.items()
+    }
+
+
+def generate_coverage(
+    tiers: List[Dict],
+    dealers: List[Dict],
+    zipcodes: Zipcodes,
+    radii: Dict[str, float],
+    default_radius: float = None,
+    coordinates: Dict = None,
+    chunk_size: int = 256,
+) -> Iterator[Tuple[str, str, str, int]]:
+    """Generates the coverage rows of every tier.
+
+    Args:
+    -----
+    * tiers (list): `buyer_tier` rows as dicts.
+    * dealers (list): `buyer_dealer` rows as dicts.
+    * zipcodes (Zipcodes): The zipcodes centroids.
+    * radii (dict): Radius in miles by tier slug.
+    * default_radius (float): Radius for tiers not in `radii`. Tiers without
+        radius are skipped.
+    * coordinates (dict): Dealers coordinates by (buyer_slug, dealer_code), for
+        dealers that shouldn't be located on their zipcode centroid.
+    * chunk_size (int): Amount of dealers compared at once.
+
+    Yields:
+    -------
+    (buyer_tier_slug, dealer_code, zipcode, distance) rows.
+    """
+    located = locate_dealers(dealers, zipcodes, coordinates or {})
+
+    for tier in tiers:
+        radius = radii.get(tier['slug'], default_radius)
+        if radius is None:
+            logger.warning('No radius for tier `%s`, skipping', tier['slug'])
+            continue
+        if tier['buyer_slug'] not in located:
+            continue
+        codes, lats, lons = located[tier['buyer_slug']]
+        for dealer_ixs, zip_ixs, distances in pairs_within(
+            lats, lons, zipcodes, radius, chunk_size=chunk_size
+        ):
+            distances = np.rint(distances).astype(np.int64)
+            for dealer_ix, zip_ix, distance in zip(dealer_ixs, zip_ixs, distances):
+                yield tier['slug'], codes[dealer_ix], zipcodes.codes[zip_ix], int(distance)
+
+
+def copy_escape(value) -> str:
+    """Formats a value for the COPY text format"""
+    if value is None:
+        return '\\N'
+    return (
+        str(value)
+        .replace('\\', '\\\\')
+        .replace('\t', '\\t')
+        .replace('\n', '\\n')
+        .replace('\r', '\\r')
+    )
+
+
+def table_dicts(collected: Dict, name: str) -> List[Dict]:
+    """Returns the rows of a table, extracted by the import generators, as dicts"""
+    _, columns, rows = collected[name]
+    return [dict(zip(columns, row)) for row in rows]
+
+
+def parse_radius(value: str) -> Tuple[str, float]:
+    tier, _, radius = value.partition('=')
+    if not radius:
+        raise argparse.ArgumentTypeError('Expected TIER=MILES')
+    return tier, float(radius)
+
+
+def main(
+    source: Path,
+    zipcodes_path: Path,
+    output,
+    radii: Dict[str, float],
+    default_radius: float = None,
+    dealers_path: Path = None,
+    chunk_size: int = 256,
+):
+    """Loads the yaml file and the zipcodes, and dumps the coverage rows.
+
+    Args:
+    -----
+    * source (Path): The yaml source file with buyers, tiers and dealers
+    * zipcodes_path (Path): CSV file with the zipcodes centroids
+    * output (file): Where the COPY text rows will be dumped
+    * radii (dict): Radius in miles by tier slug
+    * default_radius (float): Radius for tiers not in `radii`
+    * dealers_path (Path): CSV file with dealers coordinates
+    * chunk_size (int): Amount of dealers compared at once
+    """
+    with open(source, 'r') as f:
+        data = yaml.safe_load(f)
+    collected = collect_tables(extract_all(data))
+    zipcodes = Zipcodes.from_csv(zipcodes_path)
+    coordinates = load_dealers_coordinates(dealers_path) if dealers_path else None
+
+    rows = generate_coverage(
+        table_dicts(collected, 'buyer_tier'),
+        table_dicts(collected, 'buyer_dealer'),
+        zipcodes,
+        radii,
+        default_radius=default_radius,
+        coordinates=coordinates,
+        chunk_size=chunk_size,
+    )
+    for row in rows:
+        output.write('\t'.join(copy_escape(value) for value in row) + '\n')
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument('source', type=Path)
+    ap.add_argument('zipcodes', type=Path)
+    ap.add_argument('-o', '--output', type=Path)
+    ap.add_argument('--dealers', type=Path, help='CSV file with dealers coordinates')
+    ap.add_argument(
+        '--radius', type=parse_radius, action='append', default=[], metavar='TIER=MILES',
+    )
+    ap.add_argument('--default-radius', type=float)
+    ap.add_argument('--chunk-size', type=int, default=256)
+    args = ap.parse_args()
+    try:
+        # By default dump the results to stdout
+        if args.output is None:
+            args.output = sys.stdout
+        else:
+            args.output = open(args.output, 'w')
+
+        main(
+            args.source,
+            args.zipcodes,
+            args.output,
+            dict(args.radius),
+            default_radius=args.default_radius,
+            dealers_path=args.dealers,
+            chunk_size=args.chunk_size,
+        )
+    finally:
+        args.output.close()
@@ -0,0 +1,22 @@
+"""
+Pre-fork server profile: the application is created once in the master process,
+with the catalogue and the OpenAPI spec loaded, and the workers are forked from
+it, sharing those pages copy-on-write. Every worker is warmed up before it
+accepts requests, see `leads_api.warmup`.
+
+    gunicorn --paste development.ini -c gunicorn.conf.py
+
+Requires the ``prefork`` extra: ``pip install -e ".[prefork]"``.
+"""
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:6543')
+workers = int(os.environ.get('WEB_CONCURRENCY', os.cpu_count() or 1))
+preload_app = True
+# Tells `leads_api.main` to defer the per process hooks to `post_worker_init`
+raw_paste_global_conf = ['prefork=true']
+
+
+def post_worker_init(worker):
+    from leads_api.prefork import post_fork
+    post_fork(worker.wsgi)
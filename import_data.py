@@ -1,13 +1,19 @@
 import sys
+import json
 import yaml
+import hashlib
 import argparse
 import logging
+import multiprocessing
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Iterable, List, Tuple
 
-from sqlalchemy import String, Integer, Table
+from sqlalchemy import String, Integer, Table, create_engine, select
 
+from leads_api.data_version import bump_sql
 from leads_api.models import tables
+from leads_api.models.meta import metadata
+from leads_api.models.tables import coverage_keys, orphan_check_sql, refresh_views_sql
 
 logger = logging.getLogger(__name__)
 
@@ -147,6 +153,42 @@ class BaseSQLGenerator:
         used on subgenerators"""
         return data_values.get('slug') or data_key
 
+    def _set_columns(self):
+        """Builds the column lookups used to place values into positional rows"""
+        # Create a map of column -> type used for converting values into the expected type.
+        # Avoid subgenerators which are not columns, and surrogate keys generated
+        # by the database
+        self.column_types = {
+            column.name: column.type
+            for column in self.table.columns
+            if column not in self.subgenerators and column.identity is None
+        }
+        # Keep a list of columns to use as an index to create the rows
+        # with positional values
+        self.columns = list(self.column_types.keys())
+
+    def merge_rows(self, rows: List):
+        """Appends rows that were extracted by an equivalent generator, usually
+        in a worker process, as if they were extracted by this generator.
+
+        Args:
+        -----
+        * rows (list): Positional rows, in the same column order as `self.columns`.
+        """
+        self._set_columns()
+        self.rows.extend(rows)
+
+    def iter_generators(self, path: Tuple = ()):
+        """Walks the generators tree, yielding each generator together with its path.
+
+        The path is the tuple of `column_key` values from the main generator down to
+        the yielded generator, e.g. ('buyers', 'tiers', 'makes'), and it identifies the
+        same generator across different trees.
+        """
+        yield path, self
+        for key, generator in self.subgenerators.items():
+            yield from generator.iter_generators(path + (key,))
+
     def extract_rows(self, data: Dict, foreign_data: Dict = None):
         """Process the data that comes from the whole yaml file, or just specific
         parts of this data taken from a parent generator.
@@ -179,16 +221,7 @@ class BaseSQLGenerator:
         if foreign_data is None:
             foreign_data = {}
 
-        # Create a map of column -> type used for converting values into the expected type.
-        # Avoid subgenerators which are not columns
-        self.column_types = {
-            column.name: column.type
-            for column in self.table.columns
-            if column not in self.subgenerators
-        }
-        # Keep a list of columns to use as an index to create the rows
-        # with positional values
-        self.columns = list(self.column_types.keys())
+        self._set_columns()
 
         # Depending on the generator some rows will need to be transformed
         # from a list into a dictionary, or add other missing data
@@ -571,36 +604,416 @@ generators_map = {
 }
 
 
-def main(source: Path, output: Path):
+# Key of the yaml data processed in parallel. Each buyer is an independent subtree
+# of the data, so its rows can be extracted in a separate process.
+PARALLEL_KEY = 'buyers'
+
+
+def extract_buyer_rows(item: Tuple) -> Dict[Tuple, List]:
+    """Extracts the rows of a single buyer with a fresh generators tree.
+    It's used as the `multiprocessing` worker, so it must live at module level.
+
+    Args:
+    -----
+    * item (tuple): The (data_key, data_values) pair of the buyer taken from the yaml.
+
+    Returns:
+    --------
+    A dictionary of generator path -> extracted rows, only for generators with rows.
+    """
+    data_key, data_values = item
+    generator = BaseSQLGenerator(generators_map)
+    generator.process({PARALLEL_KEY: {data_key: data_values}})
+    return {
+        path: subgenerator.rows
+        for path, subgenerator in generator.iter_generators()
+        if subgenerator.rows
+    }
+
+
+def extract_all(data: Dict, jobs: int = 1) -> BaseSQLGenerator:
+    """Process the data and extract the rows for all the tables.
+
+    With `jobs` greater than one, buyers are processed in a pool of worker processes.
+    Results are merged back in the same order buyers appear in the data, so the rows
+    are exactly the same as the ones extracted serially.
+
+    Args:
+    -----
+    * data (dict): The data taken from the yaml file.
+    * jobs (int): Number of worker processes used to extract buyers rows.
+
+    Returns:
+    --------
+    The main generator, with the rows extracted by the whole generators tree.
+    """
+    # Create the Main generator as the entrypoint of the whole process
+    main_generator = BaseSQLGenerator(generators_map)
+
+    if jobs <= 1 or PARALLEL_KEY not in data:
+        # Extract all rows from the data
+        main_generator.process(data)
+        return main_generator
+
+    # Extract the rows of everything but buyers in the current process
+    main_generator.process({
+        key: _data for key, _data in data.items() if key != PARALLEL_KEY
+    })
+
+    # Map the main generators by path so the workers rows can be merged into them
+    generators_by_path = dict(main_generator.iter_generators())
+
+    # `imap` returns results in the same order as the input, which keeps the output
+    # deterministic regardless of which worker finishes first
+    buyers = list(data[PARALLEL_KEY].items())
+    chunksize = max(1, len(buyers) // (jobs * 4))
+    with multiprocessing.Pool(jobs) as pool:
+        for rows_by_path in pool.imap(extract_buyer_rows, buyers, chunksize=chunksize):
+            for path, rows in rows_by_path.items():
+                generators_by_path[path].merge_rows(rows)
+
+    return main_generator
+
+
+def generate_sql(data: Dict, jobs: int = 1) -> str:
+    """Process the data and generate the SQL COPY statements for all the tables.
+
+    Args:
+    -----
+    * data (dict): The data taken from the yaml file.
+    * jobs (int): Number of worker processes used to extract buyers rows.
+
+    Returns:
+    --------
+    A string with all the SQL COPY statements.
+    """
+    return extract_all(data, jobs=jobs).get_all_sql()
+
+
+# ========= Differential import ============
+# Instead of reloading every table, the rows extracted from the yaml are compared
+# by primary key against a previous state, taken from the database or from the
+# manifest written by a previous import. Each row is reduced to a fingerprint so
+# the previous state is cheap to store and compare.
+
+# Separator used to join values before hashing, and primary key values in manifests
+KEY_SEPARATOR = '\x1f'
+NULL_VALUE = '\\N'
+
+
+def fingerprint(values: Iterable) -> str:
+    """Returns a short hash that identifies the content of a row"""
+    text = KEY_SEPARATOR.join(NULL_VALUE if v is None else str(v) for v in values)
+    return hashlib.blake2b(text.encode(), digest_size=8).hexdigest()
+
+
+def primary_key_columns(table: Table) -> List[str]:
+    return [column.name for column in table.primary_key.columns]
+
+
+def table_fingerprints(table: Table, columns: List[str], rows: Iterable) -> Dict[str, str]:
+    """Fingerprints rows of a table by primary key.
+
+    Args:
+    -----
+    * table (Table): The table the rows belong to.
+    * columns (list): The column names, in the same order as the row values.
+    * rows (iterable): Positional rows.
+
+    Returns:
+    --------
+    A dictionary with the joined primary key values -> row fingerprint.
+    """
+    pk_ixs = [columns.index(name) for name in primary_key_columns(table)]
+    return {
+        KEY_SEPARATOR.join(str(row[ix]) for ix in pk_ixs): fingerprint(row)
+        for row in rows
+    }
+
+
+def collect_tables(main_generator: BaseSQLGenerator) -> Dict[str, Tuple]:
+    """Groups the rows extracted by the generators tree by table.
+
+    Returns:
+    --------
+    A dictionary of table name -> (table, columns, rows) for every table the
+    generators can produce, even if no rows were extracted for it.
+    """
+    collected = {}
+    for _, generator in main_generator.iter_generators():
+        if generator.table is None:
+            continue
+        generator._set_columns()
+        table = generator.table
+        _, _, rows = collected.setdefault(table.name, (table, generator.columns, []))
+        rows.extend(generator.rows)
+    return collected
+
+
+def load_manifest(path: Path) -> Dict[str, Dict[str, str]]:
+    """Loads the fingerprints of a previous import from a manifest file"""
+    with open(path, 'r') as f:
+        return json.load(f)['tables']
+
+
+def dump_manifest(path: Path, fingerprints: Dict[str, Dict[str, str]]):
+    """Writes the fingerprints of the current import, to be used by the next one"""
+    with open(path, 'w') as f:
+        json.dump({'version': 1, 'tables': fingerprints}, f, sort_keys=True)
+
+
+def database_fingerprints(connection, table: Table, columns: List[str]) -> Dict[str, str]:
+    """Fingerprints the rows currently stored in the database for a table"""
+    query = select(*[table.c[name] for name in columns])
+    result = connection.execution_options(stream_results=True, yield_per=10000).execute(query)
+    return table_fingerprints(table, columns, result)
+
+
+def sql_literal(value, column_type) -> str:
+    """Formats a value as an SQL literal"""
+    if value is None:
+        return 'NULL'
+    elif isinstance(column_type, (Integer,)):
+        return str(int(value))
+    else:
+        return "'" + str(value).replace("'", "''") + "'"
+
+
+def diff_sql(
+    table: Table,
+    columns: List[str],
+    rows: List,
+    previous: Dict[str, str],
+    batch_size: int = 1000,
+) -> Tuple[str, str, Dict[str, int]]:
+    """Generates the SQL statements needed to turn the previous state of a table
+    into the extracted rows.
+
+    Args:
+    -----
+    * table (Table): The table to compare.
+    * columns (list): The column names, in the same order as the row values.
+    * rows (list): The extracted rows.
+    * previous (dict): The previous fingerprints of the table by primary key.
+    * batch_size (int): Max amount of rows per statement.
+
+    Returns:
+    --------
+    A tuple with the DELETE statements, the upsert statements, and a dict with
+    the amount of inserted, updated and deleted rows.
+    """
+    pk_columns = primary_key_columns(table)
+    pk_ixs = [columns.index(name) for name in pk_columns]
+    column_types = {column.name: column.type for column in table.columns}
+
+    # Classify the rows comparing the fingerprints by primary key
+    upserts = []
+    stats = {'insert': 0, 'update': 0, 'delete': 0}
+    current_keys = set()
+    for row in rows:
+        key = KEY_SEPARATOR.join(str(row[ix]) for ix in pk_ixs)
+        current_keys.add(key)
+        previous_fingerprint = previous.get(key)
+        if previous_fingerprint is None:
+            stats['insert'] += 1
+        elif previous_fingerprint != fingerprint(row):
+            stats['update'] += 1
+        else:
+            continue
+        upserts.append(row)
+    deleted_keys = [key for key in previous if key not in current_keys]
+    stats['delete'] = len(deleted_keys)
+
+    # Rows to delete are only known by primary key
+    delete_sql = ''
+    pk_str = ', '.join(pk_columns)
+    coverage_key = coverage_keys.get(table)
+    for start in range(0, len(deleted_keys), batch_size):
+        values = ',\n'.join(
+            '(' + ', '.join(
+                sql_literal(value, column_types[name])
+                for name, value in zip(pk_columns, key.split(KEY_SEPARATOR))
+            ) + ')'
+            for key in deleted_keys[start:start + batch_size]
+        )
+        where = f"({pk_str}) IN (\n{values}\n)"
+        # The coverage rows reference the surrogate ids without foreign keys, they
+        # are deleted first so they're not left dangling
+        if coverage_key is not None:
+            delete_sql += (
+                f"DELETE FROM {coverage_key.table.name} WHERE {coverage_key.name} IN "
+                f"(SELECT id FROM {table.name} WHERE {where});\n"
+            )
+        delete_sql += f"DELETE FROM {table.name} WHERE {where};\n"
+
+    # New and changed rows are upserted on their natural primary key. Surrogate
+    # ids are generated by the database and never part of `columns`, so changed
+    # rows keep theirs and the coverage rows referencing them stay valid. Tables
+    # where all the columns are part of the primary key can't have changed rows,
+    # only new ones.
+    upsert_sql = ''
+    update_columns = [name for name in columns if name not in pk_columns]
+    if update_columns:
+        on_conflict = 'DO UPDATE SET ' + ', '.join(
+            f'{name} = EXCLUDED.{name}' for name in update_columns
+        )
+    else:
+        on_conflict = 'DO NOTHING'
+    for start in range(0, len(upserts), batch_size):
+        values = ',\n'.join(
+            '(' + ', '.join(
+                sql_literal(value, column_types[name])
+                for name, value in zip(columns, row)
+            ) + ')'
+            for row in upserts[start:start + batch_size]
+        )
+        upsert_sql += (
+            f"INSERT INTO {table.name} ({', '.join(columns)}) VALUES\n{values}\n"
+            f"ON CONFLICT ({pk_str}) {on_conflict};\n"
+        )
+
+    return delete_sql, upsert_sql, stats
+
+
+def generate_diff_sql(
+    main_generator: BaseSQLGenerator,
+    previous: Dict[str, Dict[str, str]],
+    batch_size: int = 1000,
+) -> Tuple[str, Dict[str, Dict[str, str]]]:
+    """Generates a single transaction with the changes between the previous state
+    and the rows extracted by the generators.
+
+    Deletes are applied from the child tables up to the parents, and upserts from
+    the parents down, so foreign keys hold on every statement.
+
+    Args:
+    -----
+    * main_generator (BaseSQLGenerator): The generator with all rows extracted.
+    * previous (dict): Table name -> previous fingerprints by primary key.
+    * batch_size (int): Max amount of rows per statement.
+
+    Returns:
+    --------
+    A tuple with the SQL and the current fingerprints by table, to be stored as the
+    next manifest.
+    """
+    collected = collect_tables(main_generator)
+    ordered = [table for table in metadata.sorted_tables if table.name in collected]
+
+    deletes, upserts, fingerprints = {}, {}, {}
+    for table in ordered:
+        _, columns, rows = collected[table.name]
+        deletes[table.name], upserts[table.name], stats = diff_sql(
+            table, columns, rows, previous.get(table.name, {}), batch_size=batch_size,
+        )
+        fingerprints[table.name] = table_fingerprints(table, columns, rows)
+        logger.info('Table `%s`: %s', table.name, stats)
+
+    sql = 'BEGIN;\n'
+    for table in reversed(ordered):
+        if deletes[table.name]:
+            sql += f"\n-- Deleted rows from table `{table.name}`\n{deletes[table.name]}"
+    for table in ordered:
+        if upserts[table.name]:
+            sql += f"\n-- Upserted rows into table `{table.name}`\n{upserts[table.name]}"
+    # The API workers only need to refresh their caches if something changed
+    if any(deletes.values()) or any(upserts.values()):
+        sql += f"\n-- Check the coverage rows still reference existing rows\n{orphan_check_sql()}"
+        sql += f"\n-- Refresh the materialized views\n{refresh_views_sql()}"
+        sql += f"\n-- Bump the data version\n{bump_sql()}"
+    sql += '\nCOMMIT;\n'
+    return sql, fingerprints
+
+
+def main(
+    source: Path,
+    output: Path,
+    jobs: int = 1,
+    manifest: Path = None,
+    database_url: str = None,
+    write_manifest: Path = None,
+    batch_size: int = 1000,
+):
     """Loads the yaml file, create the SQL generators, process the rows and dumps
     the final output.
 
+    When a previous state is given, either with a `manifest` or a `database_url`,
+    only the differences against it are dumped as DELETE and upsert statements.
+    Otherwise all the rows are dumped as COPY statements.
+
     Args:
     -----
     * source (Path): The yaml source file with the data that needs to be processed
     * output (Path): The path where the output SQL statements will be dumped
+    * jobs (int): Number of worker processes used to process buyers
+    * manifest (Path): Manifest written by a previous import to compare against
+    * database_url (str): Database to compare against
+    * write_manifest (Path): Where to write the manifest of the current import
+    * batch_size (int): Max amount of rows per differential statement
     """
     # Parse the yaml file into a dictionary of data
     with open(source, 'r') as f:
         data = yaml.safe_load(f)
 
-    # Create the Main generator as the entrypoint of the whole process
-    main_generator = BaseSQLGenerator(generators_map)
-
     # Extract all rows from the data
-    main_generator.process(data)
-
-    # Create final SQL statement
-    sql = main_generator.get_all_sql()
+    main_generator = extract_all(data, jobs=jobs)
+
+    if manifest is None and database_url is None:
+        # Create final SQL statement, and let the API workers know about it
+        sql = main_generator.get_all_sql()
+        sql += f"-- Check the coverage rows reference existing rows\n{orphan_check_sql()}"
+        sql += f"-- Refresh the materialized views\n{refresh_views_sql()}"
+        sql += f"-- Bump the data version\n{bump_sql()}"
+        fingerprints = None
+    else:
+        if manifest is not None:
+            previous = load_manifest(manifest)
+        else:
+            engine = create_engine(database_url)
+            with engine.connect() as connection:
+                previous = {
+                    table.name: database_fingerprints(connection, table, columns)
+                    for table, columns, _ in collect_tables(main_generator).values()
+                }
+        sql, fingerprints = generate_diff_sql(main_generator, previous, batch_size=batch_size)
 
     # Dump the results to the output
     output.write(sql)
 
+    if write_manifest is not None:
+        if fingerprints is None:
+            fingerprints = {
+                table.name: table_fingerprints(table, columns, rows)
+                for table, columns, rows in collect_tables(main_generator).values()
+            }
+        dump_manifest(write_manifest, fingerprints)
+
 
 if __name__ == '__main__':
     ap = argparse.ArgumentParser()
     ap.add_argument('source', type=Path)
     ap.add_argument('-o', '--output', type=Path)
+    ap.add_argument(
+        '-j', '--jobs', type=int, default=1,
+        help='Number of worker processes used to process buyers in parallel',
+    )
+    previous = ap.add_mutually_exclusive_group()
+    previous.add_argument(
+        '--diff-manifest', type=Path,
+        help='Only dump the changes against the manifest of a previous import',
+    )
+    previous.add_argument(
+        '--diff-database',
+        help='Only dump the changes against the database with this SQLAlchemy URL',
+    )
+    ap.add_argument(
+        '--write-manifest', type=Path,
+        help='Write the manifest of this import, to diff the next one against it',
+    )
+    ap.add_argument(
+        '--batch-size', type=int, default=1000,
+        help='Max amount of rows per statement on differential imports',
+    )
     args = ap.parse_args()
     try:
         # By default dump the results to stdout
@@ -610,7 +1023,15 @@ if __name__ == '__main__':
             args.output = open(args.output, 'w')
 
         # Start process
-        main(args.source, args.output)
+        main(
+            args.source,
+            args.output,
+            jobs=args.jobs,
+            manifest=args.diff_manifest,
+            database_url=args.diff_database,
+            write_manifest=args.write_manifest,
+            batch_size=args.batch_size,
+        )
     finally:
         # Given we might use stdout, close manually instead of
         # using `with` statement
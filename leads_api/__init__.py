@@ -1,16 +1,35 @@
 from pyramid.config import Configurator
+from pyramid.settings import asbool
 
 
 def main(global_config, **settings):
     """ This function returns a Pyramid WSGI application.
     """
+    # Set by the pre-fork server profile, see `gunicorn.conf.py`
+    if asbool((global_config or {}).get('prefork', False)):
+        settings['prefork'] = 'true'
     with Configurator(settings=settings) as config:
-        config.include('pyramid_jinja2')
-        config.include('pyramid_openapi3')
-        config.pyramid_openapi3_spec('openapi.yaml', route='/v1/openapi.yaml')
-        config.pyramid_openapi3_add_explorer()
+        # Nothing renders templates yet, Jinja2 is only loaded if enabled
+        if asbool(settings.get('jinja2.enabled', False)):
+            config.include('pyramid_jinja2')
+        config.include('.openapi')
         config.include('.routes')
         config.include('.models')
+        config.include('.metrics')
+        config.include('.data_version')
+        config.include('.catalogue')
+        config.include('.bloom')
+        config.include('.engines')
+        config.include('.prerendered')
         config.include('.tweens')
-        config.scan(".views")
+        config.include('.timeouts')
+        config.include('.warmup')
+        config.include('.health')
+        config.include('.resilience')
+        # Scanning imports every module of the package, the explicit registration
+        # in `leads_api.views` is faster and registers the same views
+        if asbool(settings.get('views.scan', False)):
+            config.scan(".views")
+        else:
+            config.include('.views')
     return config.make_wsgi_app()
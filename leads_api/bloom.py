@@ -0,0 +1,181 @@
+import hashlib
+import logging
+import math
+import threading
+import time
+from typing import Optional
+
+from pyramid.exceptions import ConfigurationError
+from pyramid.registry import Registry
+from pyramid.request import Request
+from pyramid.settings import asbool
+from sqlalchemy import func, select
+
+from leads_api.metrics import get_metrics
+from leads_api.models.tables import buyer_tier, buyer_tier_dealer_coverage, zipcode
+from leads_api.prefork import add_worker_hook
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """Compact probabilistic set. It can return false positives, with a rate
+    depending on its size, but never false negatives.
+
+    The bits are sized for `capacity` keys and the target false positive rate,
+    unless that needs more than `max_bytes`, in which case the rate is higher.
+    """
+
+    def __init__(self, capacity: int, false_positive_rate: float = 0.01, max_bytes: int = None):
+        capacity = max(capacity, 1)
+        bits = math.ceil(-capacity * math.log(false_positive_rate) / math.log(2) ** 2)
+        if max_bytes is not None and bits > max_bytes * 8:
+            logger.warning(
+                'Bloom filter for %s keys needs %s bytes, limited to %s',
+                capacity, bits // 8, max_bytes,
+            )
+            bits = max_bytes * 8
+        self.size = max(bits, 8)
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.capacity = capacity
+        self.bits = bytearray(math.ceil(self.size / 8))
+
+    def _indexes(self, key: str):
+        # Double hashing: k indexes derived from two 64 bits hashes
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key: str):
+        for ix in self._indexes(key):
+            self.bits[ix >> 3] |= 1 << (ix & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[ix >> 3] & (1 << (ix & 7)) for ix in self._indexes(key))
+
+    @property
+    def false_positive_rate(self) -> float:
+        """Expected false positive rate once it holds `capacity` keys"""
+        return (1 - math.exp(-self.hashes * self.capacity / self.size)) ** self.hashes
+
+
+def coverage_key(buyer_tier: str, zipcode: str) -> str:
+    return f'{buyer_tier}\x1f{zipcode}'
+
+
+def build_coverage_filter(dbsession, false_positive_rate: float, max_bytes: int) -> BloomFilter:
+    """Builds the filter over the distinct (buyer_tier_slug, zipcode) pairs with coverage"""
+    table = buyer_tier_dealer_coverage
+    pairs = select(buyer_tier.c.slug, zipcode.c.code).distinct().where(
+        table.c.buyer_tier_id == buyer_tier.c.id,
+        table.c.zipcode_id == zipcode.c.id,
+    )
+    capacity = dbsession.execute(select(func.count()).select_from(pairs.subquery())).scalar()
+
+    bloom = BloomFilter(capacity, false_positive_rate, max_bytes)
+    result = dbsession.execute(pairs, execution_options={'yield_per': 10000})
+    for tier_slug, zipcode_code in result:
+        bloom.add(coverage_key(tier_slug, zipcode_code))
+    return bloom
+
+
+# Coverage engines reading the precomputed coverage table the filter is built from
+FILTERED_ENGINES = ('sql', 'view')
+
+_lock = threading.Lock()
+
+
+def load_coverage_filter(registry: Registry, reset: bool = False):
+    """Builds a new filter with its own session and replaces the current one.
+    Builds don't overlap, so the last one always reflects the latest data.
+
+    With `reset` the current filter is dropped first: built from older data, it
+    would answer that pairs covered since have no coverage. The requests go to
+    the database until the new one is built.
+    """
+    if reset:
+        registry['coverage_filter'] = None
+    with _lock:
+        if reset:
+            # A build running meanwhile may have set a filter of older data
+            registry['coverage_filter'] = None
+        _load_coverage_filter(registry)
+
+
+def _load_coverage_filter(registry: Registry):
+    settings = registry.settings
+    start = time.perf_counter()
+    dbsession = registry['dbsession_factory']()
+    try:
+        bloom = build_coverage_filter(
+            dbsession,
+            float(settings.get('bloom.false_positive_rate', 0.01)),
+            int(settings.get('bloom.max_bytes', 64 * 2 ** 20)),
+        )
+    finally:
+        dbsession.close()
+    registry['coverage_filter'] = bloom
+
+    metrics = registry['metrics']
+    metrics.set('bloom.keys', bloom.capacity)
+    metrics.set('bloom.bytes', len(bloom.bits))
+    metrics.set('bloom.false_positive_rate', bloom.false_positive_rate)
+    metrics.set('bloom.build_seconds', time.perf_counter() - start)
+    logger.info(
+        'Coverage filter built: %s keys, %s bytes, %.4f expected false positives',
+        bloom.capacity, len(bloom.bits), bloom.false_positive_rate,
+    )
+
+
+def might_have_coverage(request: Request, buyer_tier: str, zipcode: str) -> bool:
+    """Checks the coverage filter. False means there's certainly no coverage for
+    the tier in the zipcode, so the database call can be avoided."""
+    bloom: Optional[BloomFilter] = request.registry.get('coverage_filter')
+    if bloom is None:
+        return True
+    metrics = get_metrics(request)
+    if coverage_key(buyer_tier, zipcode) in bloom:
+        metrics.incr('bloom.passed')
+        return True
+    metrics.incr('bloom.avoided')
+    return False
+
+
+def includeme(config):
+    """
+    Check a Bloom filter of the (tier, zipcode) pairs with coverage before looking
+    the coverage up, enabled with ``bloom.enabled = true``.
+
+    The filter is built in the background when a worker process starts, and
+    rebuilt on every data version change, before the new version is published.
+    Until it's built, every request goes to the database.
+
+    It's built from the precomputed coverage table, so it can only be enabled
+    with the ``sql`` and ``view`` coverage engines, which read it.
+
+    Activate this setup using ``config.include('leads_api.bloom')``.
+
+    """
+    settings = config.get_settings()
+    if not asbool(settings.get('bloom.enabled', False)):
+        return
+    engine = settings.get('coverage.engine', 'sql')
+    if engine not in FILTERED_ENGINES:
+        raise ConfigurationError(
+            f'bloom.enabled requires coverage.engine `sql` or `view`, not `{engine}`'
+        )
+    registry = config.registry
+
+    def build_in_background(app):
+        threading.Thread(
+            target=load_coverage_filter,
+            args=(registry,),
+            name='bloom-build',
+            daemon=True,
+        ).start()
+
+    registry['data_version'].subscribe(
+        lambda version: load_coverage_filter(registry, reset=True)
+    )
+    add_worker_hook(config, build_in_background)
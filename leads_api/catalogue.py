@@ -0,0 +1,266 @@
+import logging
+import threading
+from collections import defaultdict
+from typing import Dict, FrozenSet, Optional
+
+from pyramid.events import ApplicationCreated
+from pyramid.registry import Registry
+from pyramid.request import Request
+from pyramid.router import Router
+from pyramid.settings import asbool
+from sqlalchemy import select
+
+from leads_api.data_version import read_version
+from leads_api.models.tables import (
+    buyer_dealer_make,
+    buyer_dealer_make_model,
+    buyer_dealer_make_model_year,
+    buyer_dealer_make_year,
+    buyer_tier,
+    buyer_tier_make,
+    buyer_tier_make_model,
+    buyer_tier_make_model_year,
+    buyer_tier_make_year,
+    legacy_buyer_tier,
+    year,
+)
+from leads_api.prefork import add_worker_hook
+
+logger = logging.getLogger(__name__)
+
+
+class Catalogue:
+    """In-memory snapshot of the buyers configuration, used to resolve which
+    dealers are eligible for a coverage request without joining the
+    configuration tables on every query.
+
+    Years are stored as bitsets (python ints with one bit per year), and dealers
+    are grouped in sets by (buyer, make) and (buyer, make, model), so resolving a
+    request only takes a few dictionary lookups, whatever filters it uses.
+
+    The configuration isn't modified once loaded. The resolved dealers are
+    memoized for the requests the configuration accepts only, so the memo is
+    bounded by the configured combinations whatever the clients send.
+    """
+
+    def __init__(self):
+        # Data version the catalogue was loaded from
+        self.version: Optional[str] = None
+        # year_slug -> bit
+        self.year_bits: Dict[str, int] = {}
+        # tier_slug -> buyer_slug
+        self.tier_buyer: Dict[str, str] = {}
+        # legacy_id -> tier_slug, of the tiers of the older integrations
+        self.legacy_tiers: Dict[int, str] = {}
+        # (tier_slug, make_slug) configured in `buyer_tier_make`
+        self.tier_makes = set()
+        # (tier_slug, make_slug) -> years bitset
+        self.tier_make_years: Dict[tuple, int] = defaultdict(int)
+        # (tier_slug, make_slug, model_slug) configured in `buyer_tier_make_model`
+        self.tier_make_models = set()
+        # (tier_slug, make_slug, model_slug) -> years bitset
+        self.tier_make_model_years: Dict[tuple, int] = defaultdict(int)
+        # (buyer_slug, make_slug) -> dealers selling the make
+        self.make_dealers: Dict[tuple, set] = defaultdict(set)
+        # (buyer_slug, make_slug) -> dealer_code -> years bitset
+        self.make_dealer_years: Dict[tuple, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        # (buyer_slug, make_slug, model_slug) -> dealers selling the model
+        self.model_dealers: Dict[tuple, set] = defaultdict(set)
+        # (buyer_slug, make_slug, model_slug) -> dealer_code -> years bitset
+        self.model_dealer_years: Dict[tuple, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        # Resolved eligible dealers by request filters, of the accepted requests
+        self._eligible: Dict[tuple, FrozenSet[str]] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, dbsession) -> 'Catalogue':
+        """Loads the configuration tables from the database"""
+        catalogue = cls()
+        # Read first, the tables are at least as recent as this version
+        catalogue.version = read_version(dbsession)
+
+        def rows(table, *columns):
+            return dbsession.execute(select(*[table.c[column] for column in columns]))
+
+        for bit, (year_slug,) in enumerate(rows(year, 'slug')):
+            catalogue.year_bits[year_slug] = 1 << bit
+        bits = catalogue.year_bits
+
+        for buyer_slug, tier_slug in rows(buyer_tier, 'buyer_slug', 'slug'):
+            catalogue.tier_buyer[tier_slug] = buyer_slug
+        for legacy_id, tier_slug in rows(legacy_buyer_tier, 'legacy_id', 'buyer_tier_slug'):
+            catalogue.legacy_tiers[legacy_id] = tier_slug
+        for tier_slug, make_slug in rows(buyer_tier_make, 'tier_slug', 'make_slug'):
+            catalogue.tier_makes.add((tier_slug, make_slug))
+        for tier_slug, make_slug, year_slug in rows(
+            buyer_tier_make_year, 'tier_slug', 'make_slug', 'year_slug'
+        ):
+            catalogue.tier_make_years[tier_slug, make_slug] |= bits.get(year_slug, 0)
+        for tier_slug, make_slug, model_slug in rows(
+            buyer_tier_make_model, 'tier_slug', 'make_slug', 'model_slug'
+        ):
+            catalogue.tier_make_models.add((tier_slug, make_slug, model_slug))
+        for tier_slug, make_slug, model_slug, year_slug in rows(
+            buyer_tier_make_model_year, 'tier_slug', 'make_slug', 'model_slug', 'year_slug'
+        ):
+            catalogue.tier_make_model_years[tier_slug, make_slug, model_slug] |= (
+                bits.get(year_slug, 0)
+            )
+
+        for buyer_slug, dealer_code, make_slug in rows(
+            buyer_dealer_make, 'buyer_slug', 'dealer_code', 'make_slug'
+        ):
+            catalogue.make_dealers[buyer_slug, make_slug].add(dealer_code)
+        for buyer_slug, dealer_code, make_slug, year_slug in rows(
+            buyer_dealer_make_year, 'buyer_slug', 'dealer_code', 'make_slug', 'year_slug'
+        ):
+            catalogue.make_dealer_years[buyer_slug, make_slug][dealer_code] |= (
+                bits.get(year_slug, 0)
+            )
+        for buyer_slug, dealer_code, make_slug, model_slug in rows(
+            buyer_dealer_make_model, 'buyer_slug', 'dealer_code', 'make_slug', 'model_slug'
+        ):
+            catalogue.model_dealers[buyer_slug, make_slug, model_slug].add(dealer_code)
+        for buyer_slug, dealer_code, make_slug, model_slug, year_slug in rows(
+            buyer_dealer_make_model_year,
+            'buyer_slug', 'dealer_code', 'make_slug', 'model_slug', 'year_slug',
+        ):
+            catalogue.model_dealer_years[buyer_slug, make_slug, model_slug][dealer_code] |= (
+                bits.get(year_slug, 0)
+            )
+        return catalogue
+
+    def tier_accepts(self, tier: str, make: str, year: str = None, model: str = None) -> bool:
+        """Whether the tier is configured for the make, and for the year and model if given"""
+        if (tier, make) not in self.tier_makes:
+            return False
+        year_bit = None
+        if year is not None:
+            year_bit = self.year_bits.get(year)
+            if year_bit is None:
+                return False
+        if model is not None:
+            if (tier, make, model) not in self.tier_make_models:
+                return False
+            if year_bit is not None:
+                return bool(self.tier_make_model_years.get((tier, make, model), 0) & year_bit)
+        elif year_bit is not None:
+            return bool(self.tier_make_years.get((tier, make), 0) & year_bit)
+        return True
+
+    def eligible_dealers(
+        self,
+        tier: str,
+        make: str,
+        year: str = None,
+        model: str = None,
+    ) -> Optional[FrozenSet[str]]:
+        """Resolves the dealers of the tier that can cover a request.
+
+        Returns:
+        --------
+        The set of dealers codes selling the make, and the year and model if given,
+        or None if the tier itself doesn't accept the request.
+        """
+        key = (tier, make, year, model)
+        try:
+            return self._eligible[key]
+        except KeyError:
+            pass
+
+        # Rejections, e.g. of unknown slugs, only take a few lookups and aren't
+        # memoized, they would let clients grow the memo without bound
+        if not self.tier_accepts(tier, make, year=year, model=model):
+            return None
+
+        buyer = self.tier_buyer.get(tier)
+        year_bit = self.year_bits.get(year, 0)
+        if model is not None:
+            dealers = self.model_dealers.get((buyer, make, model), set())
+            dealer_years = self.model_dealer_years.get((buyer, make, model), {})
+        else:
+            dealers = self.make_dealers.get((buyer, make), set())
+            dealer_years = self.make_dealer_years.get((buyer, make), {})
+        if year is not None:
+            dealers = {
+                dealer for dealer in dealers
+                if dealer_years.get(dealer, 0) & year_bit
+            }
+        dealers = frozenset(dealers)
+
+        with self._lock:
+            self._eligible[key] = dealers
+        return dealers
+
+
+_lock = threading.Lock()
+
+
+def load_catalogue(registry: Registry) -> Catalogue:
+    """Loads a new catalogue with its own session and replaces the current one.
+    Requests already using the previous catalogue keep using it until they finish."""
+    dbsession = registry['dbsession_factory']()
+    try:
+        catalogue = Catalogue.load(dbsession)
+    finally:
+        dbsession.close()
+    registry['catalogue'] = catalogue
+    logger.info('Catalogue loaded: %s tiers', len(catalogue.tier_buyer))
+    return catalogue
+
+
+def get_catalogue(request: Request) -> Catalogue:
+    """Returns the catalogue stored in the registry, loading it on first use"""
+    catalogue = request.registry.get('catalogue')
+    if catalogue is None:
+        with _lock:
+            catalogue = request.registry.get('catalogue')
+            if catalogue is None:
+                catalogue = Catalogue.load(request.dbsession)
+                request.registry['catalogue'] = catalogue
+    return catalogue
+
+
+def includeme(config):
+    """
+    Keep the catalogue in ``registry['catalogue']`` up to date with the data version.
+
+    With ``catalogue.load_on_startup = true`` the catalogue is loaded when the
+    application is created, otherwise it's loaded by the first request. With a
+    pre-fork server it's loaded once in the master process, before forking the
+    workers, and reloaded by the workers forked after the data changed.
+
+    Activate this setup using ``config.include('leads_api.catalogue')``.
+
+    """
+    settings = config.get_settings()
+    registry = config.registry
+
+    def refresh(version):
+        load_catalogue(registry)
+    registry['data_version'].subscribe(refresh)
+
+    if asbool(settings.get('catalogue.load_on_startup', False)):
+        def load_on_startup(event):
+            load_catalogue(event.app.registry)
+        config.add_subscriber(load_on_startup, ApplicationCreated)
+        add_worker_hook(config, reload_outdated)
+
+
+def reload_outdated(app: Router):
+    """Reloads the catalogue if the data changed since it was loaded, e.g. in a
+    worker forked long after the master process loaded it"""
+    registry = app.registry
+    catalogue = registry.get('catalogue')
+    if catalogue is None:
+        return
+    dbsession = registry['dbsession_factory']()
+    try:
+        version = read_version(dbsession)
+    finally:
+        dbsession.close()
+    if version != catalogue.version:
+        logger.info(
+            'Catalogue loaded from data version %s, reloading %s', catalogue.version, version,
+        )
+        load_catalogue(registry)
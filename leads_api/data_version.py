@@ -0,0 +1,259 @@
+import logging
+import select
+import threading
+from datetime import datetime, timezone
+from typing import Callable, Optional, Tuple
+
+from pyramid.settings import asbool
+
+from leads_api.metrics import Metrics
+from leads_api.models.tables import data_version as data_version_table
+from leads_api.prefork import add_worker_hook
+
+logger = logging.getLogger(__name__)
+
+# Channel notified by the imports when they bump the data version
+CHANNEL = 'data_version'
+
+
+def bump_sql(channel: str = CHANNEL) -> str:
+    """SQL statements that increase the data version and notify the API workers.
+
+    They should run in the same transaction as the import, the notification is
+    only delivered when it commits. The payload is the new version and the time
+    it was bumped, so the workers can measure how long it took them to notice.
+    """
+    table = data_version_table.fullname
+    return (
+        f"INSERT INTO {table} (id, version, updated_at) VALUES (1, 1, clock_timestamp())\n"
+        f"ON CONFLICT (id) DO UPDATE\n"
+        f"SET version = {data_version_table.name}.version + 1, updated_at = clock_timestamp();\n"
+        f"SELECT pg_notify('{channel}', version || ' ' || extract(epoch FROM updated_at))\n"
+        f"FROM {table} WHERE id = 1;\n"
+    )
+
+
+def parse_notification(payload: str) -> Tuple[str, datetime]:
+    """Parses the payload sent by `bump_sql` into (version, updated_at)"""
+    version, timestamp = payload.split()
+    return version, datetime.fromtimestamp(float(timestamp), timezone.utc)
+
+
+def read_version(dbsession) -> Optional[str]:
+    """Reads the current version from the database, None before the first import"""
+    table = data_version_table
+    statement = table.select().with_only_columns(table.c.version).where(table.c.id == 1)
+    for (version,) in dbsession.execute(statement):
+        return str(version)
+    return None
+
+
+class DataVersion:
+    """Tracks the version of the data loaded in the database.
+
+    In-process caches subscribe to it, and they are notified to refresh
+    whenever the version changes, e.g. after an import. The new `version` is
+    only published once they all refreshed, so what's derived from it, such as
+    the HTTP cache ETags, never describes the data of older caches.
+    """
+
+    def __init__(self, version: Optional[str] = None):
+        self.version = version
+        # When the current version was bumped, or seen for the first time
+        self.updated_at = datetime.now(timezone.utc)
+        self.subscribers = []
+        # Latest version being refreshed or published, and counters ordering the
+        # updates so an older one never replaces a newer one
+        self.latest = version
+        self.updates = 0
+        self.published = 0
+        self.lock = threading.Lock()
+
+    def subscribe(self, callback: Callable[[str], None]):
+        """Calls `callback(version)` every time the version changes"""
+        self.subscribers.append(callback)
+
+    def update(self, version: str, updated_at: datetime = None, notify: bool = True) -> bool:
+        """Notifies the subscribers if the version changed, and sets it as the
+        current version once they refreshed.
+
+        The subscribers run without holding the lock, so a slow refresh doesn't
+        block a concurrent update. If a newer version is published meanwhile,
+        this one is not.
+
+        Returns:
+        --------
+        True if the version changed.
+        """
+        with self.lock:
+            if version == self.latest:
+                return False
+            self.latest = version
+            self.updates += 1
+            update = self.updates
+            subscribers = list(self.subscribers) if notify else []
+        for callback in subscribers:
+            # A failing subscriber shouldn't prevent the others to refresh
+            try:
+                callback(version)
+            except Exception:
+                logger.exception('Error refreshing %r to data version %s', callback, version)
+        with self.lock:
+            if update > self.published:
+                self.published = update
+                self.version = version
+                self.updated_at = updated_at or datetime.now(timezone.utc)
+        return True
+
+
+class DataVersionWatcher(threading.Thread):
+    """Background thread keeping a `DataVersion` in sync with the database.
+
+    It LISTENs to the notifications sent by the imports, so caches are rebuilt
+    right after the import commits. The table is also polled every
+    `poll_interval` seconds, which catches notifications lost while reconnecting
+    and is the only mechanism when `listen` is disabled, e.g. behind a pooler
+    that doesn't support LISTEN.
+    """
+
+    def __init__(
+        self,
+        data_version: DataVersion,
+        engine,
+        metrics: Metrics = None,
+        listen: bool = True,
+        poll_interval: float = 5,
+        channel: str = CHANNEL,
+    ):
+        super().__init__(name='data-version-watcher', daemon=True)
+        self.data_version = data_version
+        self.engine = engine
+        self.metrics = metrics
+        self.listen = listen
+        self.poll_interval = poll_interval
+        self.channel = channel
+        self.stopped = threading.Event()
+
+    def stop(self):
+        self.stopped.set()
+
+    def received(self, version: str, updated_at: datetime):
+        """Updates the data version, and measures the time since the import
+        committed until the subscribers finished refreshing and the version was
+        published"""
+        if not self.data_version.update(version, updated_at):
+            return
+        delay = (datetime.now(timezone.utc) - updated_at).total_seconds()
+        logger.info('Data version %s propagated in %.3fs', version, delay)
+        if self.metrics is not None:
+            self.metrics.incr('data_version.updates')
+            self.metrics.set('data_version.version', int(version))
+            self.metrics.set('data_version.propagation_seconds', delay)
+
+    def current(self, connection) -> Optional[Tuple[str, datetime]]:
+        """Reads the (version, updated_at) from the database"""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT version, updated_at FROM {data_version_table.fullname} WHERE id = 1'
+            )
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        return str(row[0]), row[1]
+
+    def poll(self, connection):
+        current = self.current(connection)
+        if current is not None:
+            self.received(*current)
+
+    def connect(self):
+        """Opens a dedicated connection, kept out of the pool since it's left in
+        autocommit mode and listening"""
+        connection = self.engine.raw_connection()
+        connection.detach()
+        connection.driver_connection.autocommit = True
+        return connection
+
+    def initialize(self):
+        """Sets the current version without notifying the subscribers, the
+        caches loaded at startup are already up to date"""
+        connection = self.connect()
+        try:
+            current = self.current(connection.driver_connection)
+        finally:
+            connection.close()
+        if current is not None:
+            self.data_version.update(*current, notify=False)
+
+    def watch(self):
+        connection = self.connect()
+        try:
+            driver_connection = connection.driver_connection
+            if self.listen:
+                with driver_connection.cursor() as cursor:
+                    cursor.execute(f'LISTEN {self.channel}')
+            # Catch up with anything bumped while not listening
+            self.poll(driver_connection)
+
+            while not self.stopped.is_set():
+                if not self.listen:
+                    self.stopped.wait(self.poll_interval)
+                    self.poll(driver_connection)
+                    continue
+
+                readable, _, _ = select.select([driver_connection], [], [], self.poll_interval)
+                if not readable:
+                    self.poll(driver_connection)
+                    continue
+                driver_connection.poll()
+                notifies = list(driver_connection.notifies)
+                del driver_connection.notifies[:]
+                # Only the latest version matters
+                for notify in notifies[-1:]:
+                    self.received(*parse_notification(notify.payload))
+        finally:
+            connection.close()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.watch()
+            except Exception:
+                logger.exception(
+                    'Error watching the data version, retrying in %ss', self.poll_interval
+                )
+                self.stopped.wait(self.poll_interval)
+
+
+def includeme(config):
+    """
+    Track the data version in ``registry['data_version']``.
+
+    With ``data_version.watch = true`` a background thread keeps it in sync with
+    the database in every worker process, using LISTEN/NOTIFY unless
+    ``data_version.listen = false``, and polling every
+    ``data_version.poll_interval`` seconds.
+
+    Activate this setup using ``config.include('leads_api.data_version')``.
+
+    """
+    settings = config.get_settings()
+    registry = config.registry
+    registry['data_version'] = DataVersion()
+
+    if asbool(settings.get('data_version.watch', False)):
+        def start_watcher(app):
+            watcher = DataVersionWatcher(
+                registry['data_version'],
+                registry['dbengine'],
+                metrics=registry.get('metrics'),
+                listen=asbool(settings.get('data_version.listen', True)),
+                poll_interval=float(settings.get('data_version.poll_interval', 5)),
+            )
+            try:
+                watcher.initialize()
+            except Exception:
+                logger.exception('Cannot read the data version, the watcher will retry')
+            watcher.start()
+            registry['data_version_watcher'] = watcher
+        add_worker_hook(config, start_watcher)
@@ -0,0 +1,66 @@
+from pyramid.exceptions import ConfigurationError
+from pyramid.settings import asbool
+
+
+class EngineRequest:
+    """The parts of a request the coverage engines use, to look up the coverage
+    outside of a request with a session of its own"""
+
+    def __init__(self, registry, dbsession):
+        self.registry = registry
+        self.dbsession = dbsession
+        self.environ = {}
+
+
+def includeme(config):
+    """
+    Select the engine used to look up the coverage.
+
+    - ``sql`` (default) reads the precomputed ``buyer_tier_dealer_coverage`` table.
+    - ``spatial`` finds the nearest dealers from their coordinates in memory.
+    - ``index`` reads a memory mapped coverage index file.
+    - ``view`` reads the pre-joined ``coverage_lookup`` materialized view.
+
+    With ``coverage.single_flight = true`` identical lookups running at the same
+    time in a process are coalesced into one.
+
+    With ``coverage.faults.enabled = true`` lookups are slowed down by
+    ``coverage.faults.latency`` seconds and fail with a probability of
+    ``coverage.faults.error_rate``, to test the circuit breaker locally.
+
+    Activate this setup using ``config.include('leads_api.engines')``.
+
+    """
+    settings = config.get_settings()
+    name = settings.get('coverage.engine', 'sql')
+    # Only the module of the selected engine is imported
+    if name == 'sql':
+        from .sql import SQLCoverageEngine
+        engine = SQLCoverageEngine()
+    elif name == 'spatial':
+        from .spatial import SpatialCoverageEngine
+        engine = SpatialCoverageEngine.from_settings(settings)
+    elif name == 'index':
+        from .index import IndexCoverageEngine
+        engine = IndexCoverageEngine.from_settings(settings)
+    elif name == 'view':
+        from .view import ViewCoverageEngine
+        engine = ViewCoverageEngine()
+    else:
+        raise ConfigurationError(f'Unknown coverage.engine `{name}`')
+
+    # Engines keeping data in memory are rebuilt when the data changes
+    registry = config.registry
+    if hasattr(engine, 'refresh'):
+        refresh = engine.refresh
+        registry['data_version'].subscribe(lambda version: refresh(registry))
+
+    # Stand-in of a struggling database, never enable it in production
+    if asbool(settings.get('coverage.faults.enabled', False)):
+        from .faults import FaultInjectingCoverageEngine
+        engine = FaultInjectingCoverageEngine.from_settings(engine, settings)
+
+    if asbool(settings.get('coverage.single_flight', False)):
+        from .single_flight import SingleFlightCoverageEngine
+        engine = SingleFlightCoverageEngine(engine)
+    registry['coverage_engine'] = engine
@@ -0,0 +1,47 @@
+import random
+import time
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from pyramid.request import Request
+from sqlalchemy.exc import OperationalError
+
+
+class FaultInjectingCoverageEngine:
+    """Wraps a coverage engine to make its lookups slow or fail like a struggling
+    database would, to exercise the circuit breaker without one.
+
+    Every lookup waits `latency` seconds, then fails with an `OperationalError`
+    with a probability of `error_rate`. Both can be changed while it runs.
+    """
+
+    def __init__(self, engine, error_rate: float = 0.0, latency: float = 0.0, seed: int = None):
+        self.engine = engine
+        self.error_rate = error_rate
+        self.latency = latency
+        self.random = random.Random(seed)
+
+    @classmethod
+    def from_settings(cls, engine, settings) -> 'FaultInjectingCoverageEngine':
+        return cls(
+            engine,
+            error_rate=float(settings.get('coverage.faults.error_rate', 0)),
+            latency=float(settings.get('coverage.faults.latency', 0)),
+        )
+
+    def lookup(
+        self,
+        request: Request,
+        buyer_tier: str,
+        make: str,
+        zipcode: str,
+        limit: int,
+        dealers: Optional[FrozenSet[str]] = None,
+        after: Optional[Tuple[int, str]] = None,
+    ) -> List[Dict]:
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and self.random.random() < self.error_rate:
+            raise OperationalError('coverage lookup', {}, Exception('Injected fault'))
+        return self.engine.lookup(
+            request, buyer_tier, make, zipcode, limit, dealers=dealers, after=after,
+        )
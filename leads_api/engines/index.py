@@ -0,0 +1,384 @@
+import bisect
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from pyramid.request import Request
+
+# File layout, all integers are little endian:
+#
+# * Header: magic, format version, and the (offset, count) of every section.
+# * strings: Every slug, name and zipcode, once, sorted. `string_offsets` has
+#   count + 1 offsets into `string_data`, so other sections refer to strings by
+#   their position (string id) and strings are found with a binary search.
+# * tiers: Tier slug ids, sorted, and `tier_info` with 3 string ids per tier:
+#   buyer slug, buyer name and tier name.
+# * tier_makes: (tier << 32 | make slug id) keys, sorted, with the make names.
+# * dealers: 7 string ids per dealer: code, name, address, city, state, zipcode
+#   and phone.
+# * keys: (tier << 32 | zipcode id) keys, sorted, with `key_starts` offsets into
+#   `entries`, which hold (dealer, distance) pairs sorted by distance and dealer
+#   code.
+MAGIC = b'LCVI'
+FORMAT_VERSION = 2
+SECTIONS = (
+    ('string_offsets', 'I'),
+    ('string_data', 'B'),
+    ('tier_slugs', 'I'),
+    ('tier_info', 'I'),
+    ('tier_make_keys', 'Q'),
+    ('tier_make_names', 'I'),
+    ('dealers', 'I'),
+    ('keys', 'Q'),
+    ('key_starts', 'I'),
+    ('entries', 'I'),
+)
+HEADER = struct.Struct('<4sI' + 'QQ' * len(SECTIONS))
+ALIGNMENT = 8
+
+# String id of NULL values
+NULL = 0xFFFFFFFF
+
+DEALER_FIELDS = (
+    'dealer_code',
+    'dealer_name',
+    'dealer_address',
+    'dealer_city',
+    'dealer_state',
+    'dealer_zipcode',
+    'dealer_phone',
+)
+
+
+def write_index(
+    path: str,
+    tiers: Iterable[Tuple[str, str, str, str]],
+    tier_makes: Iterable[Tuple[str, str, str]],
+    dealers: Iterable[Tuple],
+    coverage: Iterable[Tuple[str, str, str, int]],
+):
+    """Writes a coverage index file.
+
+    The file is written next to `path` and renamed over it once complete, so
+    workers reading the previous file never see a partial one.
+
+    Args:
+    -----
+    * tiers (iterable): (tier slug, buyer slug, buyer name, tier name) rows.
+    * tier_makes (iterable): (tier slug, make slug, make name) rows.
+    * dealers (iterable): (buyer slug, code, name, address, city, state, zipcode,
+        phone) rows.
+    * coverage (iterable): (tier slug, dealer code, zipcode, distance) rows,
+        sorted by tier slug and zipcode in code point order, i.e. `COLLATE "C"`.
+        Each (tier, zipcode) group is packed as soon as the next one starts, so
+        the rows can be streamed. Rows of dealers unknown for the buyer of the
+        tier are skipped.
+
+    Returns:
+    --------
+    The amount of coverage entries written.
+
+    Raises:
+    -------
+    ValueError: If the coverage rows are not sorted.
+    """
+    tiers = sorted(tiers)
+    tier_makes = list(tier_makes)
+    dealers = list(dealers)
+    tier_ixs = {tier[0]: ix for ix, tier in enumerate(tiers)}
+    tier_buyer = {tier[0]: tier[1] for tier in tiers}
+    dealer_ixs = {(dealer[0], dealer[1]): ix for ix, dealer in enumerate(dealers)}
+
+    # The coverage is packed in compact arrays group by group: the tier and
+    # zipcode of every key, and the (dealer, distance) entries of all the keys
+    key_tiers, key_zipcodes = array('Q'), []
+    starts, flat = array('I', [0]), array('I')
+
+    def pack(group, entries):
+        if not entries:
+            return
+        # Dealers at the same distance are sorted by code, the order of the pages
+        entries.sort(key=lambda entry: (entry[0], dealers[entry[1]][1]))
+        for distance, dealer_ix in entries:
+            flat.extend((dealer_ix, distance))
+        key_tiers.append(tier_ixs[group[0]])
+        key_zipcodes.append(group[1])
+        starts.append(len(flat) // 2)
+
+    group, entries = None, []
+    for tier_slug, dealer_code, zipcode, distance in coverage:
+        if (tier_slug, zipcode) != group:
+            if group is not None and (tier_slug, zipcode) < group:
+                raise ValueError(
+                    f'Coverage rows are not sorted by tier and zipcode: {(tier_slug, zipcode)} '
+                    f'after {group}'
+                )
+            pack(group, entries)
+            group, entries = (tier_slug, zipcode), []
+        dealer_ix = dealer_ixs.get((tier_buyer.get(tier_slug), dealer_code))
+        if dealer_ix is not None:
+            entries.append((int(distance), dealer_ix))
+    pack(group, entries)
+
+    # Dictionary of every string
+    strings = set()
+    for tier in tiers:
+        strings.update(tier)
+    for tier_make in tier_makes:
+        strings.update(tier_make[1:])
+    for dealer in dealers:
+        strings.update(dealer[1:])
+    strings.update(key_zipcodes)
+    strings.discard(None)
+    strings = sorted(strings)
+    string_ids = {string: ix for ix, string in enumerate(strings)}
+
+    def sid(value):
+        return NULL if value is None else string_ids[value]
+
+    sections = {}
+    encoded = [string.encode() for string in strings]
+    offsets = [0]
+    for value in encoded:
+        offsets.append(offsets[-1] + len(value))
+    sections['string_offsets'] = offsets
+    sections['string_data'] = b''.join(encoded)
+
+    sections['tier_slugs'] = [sid(tier[0]) for tier in tiers]
+    sections['tier_info'] = [sid(value) for tier in tiers for value in tier[1:]]
+
+    makes = sorted(
+        ((tier_ixs[tier_slug] << 32) | sid(make_slug), sid(make_name))
+        for tier_slug, make_slug, make_name in tier_makes
+        if tier_slug in tier_ixs
+    )
+    sections['tier_make_keys'] = [key for key, _ in makes]
+    sections['tier_make_names'] = [name for _, name in makes]
+
+    sections['dealers'] = [sid(value) for dealer in dealers for value in dealer[1:]]
+
+    # Both tier and zipcode ids follow the code point order of their strings, so
+    # the keys are already sorted
+    for ix, zipcode in enumerate(key_zipcodes):
+        key_tiers[ix] = (key_tiers[ix] << 32) | sid(zipcode)
+    sections['keys'] = key_tiers
+    sections['key_starts'] = starts
+    sections['entries'] = flat
+
+    # Sections are aligned after the header, in order
+    header, body, position = [], [], HEADER.size
+    for name, fmt in SECTIONS:
+        values = sections[name]
+        if fmt == 'B':
+            data = values
+        elif isinstance(values, array):
+            if sys.byteorder != 'little':
+                values = array(fmt, values)
+                values.byteswap()
+            data = values.tobytes()
+        else:
+            data = struct.pack(f'<{len(values)}{fmt}', *values)
+        padding = -position % ALIGNMENT
+        body += [b'\0' * padding, data]
+        position += padding
+        header += [position, len(values)]
+        position += len(data)
+
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, *header))
+        for data in body:
+            f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return len(flat) // 2
+
+
+class Strings:
+    """Sequence of the strings in the index, as bytes, for binary searches"""
+
+    def __init__(self, offsets: memoryview, data: memoryview):
+        self.offsets = offsets
+        self.data = data
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, ix: int) -> bytes:
+        return bytes(self.data[self.offsets[ix]:self.offsets[ix + 1]])
+
+
+class CoverageIndex:
+    """Read only view of a coverage index file.
+
+    The file is memory mapped and the sections are accessed in place, so opening
+    it is almost instant and every worker process shares the same pages through
+    the OS page cache. Only the strings of the returned rows are decoded.
+    """
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            self.stat = os.fstat(f.fileno())
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self.mmap)
+
+        magic, version, *header = HEADER.unpack_from(view)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f'{path} is not a coverage index version {FORMAT_VERSION}')
+        for ix, (name, fmt) in enumerate(SECTIONS):
+            offset, count = header[ix * 2], header[ix * 2 + 1]
+            size = struct.calcsize(fmt)
+            setattr(self, name, view[offset:offset + count * size].cast(fmt))
+        self.strings = Strings(self.string_offsets, self.string_data)
+
+    def string(self, ix: int) -> Optional[str]:
+        if ix == NULL:
+            return None
+        return self.strings[ix].decode()
+
+    def string_id(self, value: str) -> Optional[int]:
+        encoded = value.encode()
+        ix = bisect.bisect_left(self.strings, encoded)
+        if ix < len(self.strings) and self.strings[ix] == encoded:
+            return ix
+        return None
+
+    @staticmethod
+    def find(keys: memoryview, key: int) -> Optional[int]:
+        ix = bisect.bisect_left(keys, key)
+        if ix < len(keys) and keys[ix] == key:
+            return ix
+        return None
+
+    def entry_key(self, entry: int) -> Tuple[int, bytes]:
+        dealer_ix = self.entries[entry * 2]
+        return self.entries[entry * 2 + 1], self.strings[self.dealers[dealer_ix * 7]]
+
+    def first_after(self, start: int, end: int, after: Tuple[int, str]) -> int:
+        """Binary search of the first entry of a key after the (distance,
+        dealer code) of the last row of the previous page.
+
+        Dealer codes are compared in code point order, the order of the file,
+        while the database engines use the collation of the database, so a
+        cursor only continues the pages of the engine that issued it.
+        """
+        key = (after[0], after[1].encode())
+        while start < end:
+            middle = (start + end) // 2
+            if self.entry_key(middle) <= key:
+                start = middle + 1
+            else:
+                end = middle
+        return start
+
+    def lookup(
+        self,
+        buyer_tier: str,
+        make: str,
+        zipcode: str,
+        limit: int,
+        dealers: Optional[FrozenSet[str]] = None,
+        after: Optional[Tuple[int, str]] = None,
+    ) -> List[Dict]:
+        tier_sid = self.string_id(buyer_tier)
+        make_sid = self.string_id(make)
+        zipcode_sid = self.string_id(zipcode)
+        if tier_sid is None or make_sid is None or zipcode_sid is None:
+            return []
+        tier_ix = self.find(self.tier_slugs, tier_sid)
+        if tier_ix is None:
+            return []
+        make_ix = self.find(self.tier_make_keys, (tier_ix << 32) | make_sid)
+        key_ix = self.find(self.keys, (tier_ix << 32) | zipcode_sid)
+        if make_ix is None or key_ix is None:
+            return []
+
+        base = {
+            'buyer': self.string(self.tier_info[tier_ix * 3 + 1]),
+            'buyer_tier': self.string(self.tier_info[tier_ix * 3 + 2]),
+            'make': self.string(self.tier_make_names[make_ix]),
+        }
+        start, end = self.key_starts[key_ix], self.key_starts[key_ix + 1]
+        if after is not None:
+            start = self.first_after(start, end, after)
+        rows = []
+        for entry in range(start, end):
+            dealer_ix, distance = self.entries[entry * 2], self.entries[entry * 2 + 1]
+            fields = self.dealers[dealer_ix * 7:dealer_ix * 7 + 7]
+            code = self.string(fields[0])
+            if dealers is not None and code not in dealers:
+                continue
+            rows.append({
+                **base,
+                'dealer_code': code,
+                **{name: self.string(ix) for name, ix in zip(DEALER_FIELDS[1:], fields[1:])},
+                'distance': distance,
+                'zipcode': zipcode,
+            })
+            if len(rows) >= limit:
+                break
+        return rows
+
+
+class IndexCoverageEngine:
+    """Looks up the coverage on a memory mapped index file built with
+    `build_coverage_index.py`.
+
+    The file is reopened when it's replaced, which is checked at most every
+    `check_interval` seconds and whenever the data version changes. Lookups
+    running on the previous file keep it mapped until they finish.
+    """
+
+    def __init__(self, path: str, check_interval: float = 1):
+        self.path = path
+        self.check_interval = check_interval
+        self.index = CoverageIndex(path)
+        self.checked_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, settings: Dict) -> 'IndexCoverageEngine':
+        return cls(
+            settings['coverage.index_file'],
+            check_interval=float(settings.get('coverage.index_check_interval', 1)),
+        )
+
+    def reopen(self) -> CoverageIndex:
+        """Opens the file again if it was replaced"""
+        with self.lock:
+            self.checked_at = time.monotonic()
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                # Keep serving the current file until a new one is in place
+                return self.index
+            current = self.index.stat
+            if (stat.st_dev, stat.st_ino, stat.st_mtime_ns) != (
+                current.st_dev, current.st_ino, current.st_mtime_ns
+            ):
+                self.index = CoverageIndex(self.path)
+        return self.index
+
+    def refresh(self, registry):
+        self.reopen()
+
+    def lookup(
+        self,
+        request: Request,
+        buyer_tier: str,
+        make: str,
+        zipcode: str,
+        limit: int,
+        dealers: Optional[FrozenSet[str]] = None,
+        after: Optional[Tuple[int, str]] = None,
+    ) -> List[Dict]:
+        index = self.index
+        if time.monotonic() - self.checked_at > self.check_interval:
+            index = self.reopen()
+        return index.lookup(buyer_tier, make, zipcode, limit, dealers=dealers, after=after)
@@ -0,0 +1,108 @@
+import copy
+import threading
+from typing import Callable, Dict, FrozenSet, Hashable, List, Optional, Tuple
+
+from pyramid.request import Request
+
+from leads_api.metrics import get_metrics
+from leads_api.timeouts import deadline_shortened
+
+
+class Call:
+    """A call in flight, and its outcome once it's done"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        # Callers waiting for this call instead of making their own
+        self.waiters = 0
+
+
+def copy_error(error: BaseException) -> BaseException:
+    """Copy of an exception, of the same type, to raise it in another thread.
+    Raising the same instance in every thread would mix up its traceback and
+    context. The original is returned if it can't be copied."""
+    try:
+        return copy.copy(error)
+    except Exception:
+        return error
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key: the first caller runs the
+    function, the callers arriving while it runs wait for it and share its
+    result, or a copy of its exception caused by it. Calls arriving after it
+    finishes run it again, nothing is cached.
+    """
+
+    def __init__(self):
+        self.calls: Dict[Hashable, Call] = {}
+        self.lock = threading.Lock()
+
+    def do(self, key: Hashable, function: Callable[[], object]) -> Tuple[object, bool]:
+        """Returns (result, shared), `shared` being True if the result comes
+        from the call of another caller"""
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Call()
+            else:
+                call.waiters += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise copy_error(call.error) from call.error
+            return call.result, True
+
+        try:
+            call.result = function()
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result, False
+
+
+class SingleFlightCoverageEngine:
+    """Wraps a coverage engine so identical lookups running at the same time,
+    e.g. a burst of requests for the same tier and zipcode, make a single query.
+
+    Every caller gets its own copy of the rows list, the rows themselves are
+    shared and must not be modified. Requests whose statement timeout is
+    shortened by the deadline of their client look up on their own, so their
+    cancelled queries don't fail the requests sharing them.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.flight = SingleFlight()
+
+    def lookup(
+        self,
+        request: Request,
+        buyer_tier: str,
+        make: str,
+        zipcode: str,
+        limit: int,
+        dealers: Optional[FrozenSet[str]] = None,
+        after: Optional[Tuple[int, str]] = None,
+    ) -> List[Dict]:
+        def lookup():
+            return self.engine.lookup(
+                request, buyer_tier, make, zipcode, limit, dealers=dealers, after=after,
+            )
+
+        metrics = get_metrics(request)
+        if deadline_shortened(request):
+            metrics.incr('single_flight.deadline')
+            return lookup()
+        key = (buyer_tier, make, zipcode, limit, dealers, after)
+        rows, shared = self.flight.do(key, lookup)
+        metrics.incr('single_flight.coalesced' if shared else 'single_flight.lookups')
+        return list(rows)
@@ -0,0 +1,309 @@
+import csv
+import heapq
+import math
+import threading
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Callable, Dict, FrozenSet, List, Optional, Tuple
+
+from pyramid.request import Request
+from pyramid.settings import aslist
+
+from leads_api.models.leads import (
+    Buyer,
+    BuyerDealer,
+    BuyerTier,
+    BuyerTierMake,
+    Make,
+)
+
+# Distances are in miles, the same unit used by `buyer_tier_dealer_coverage`
+EARTH_RADIUS = 3958.8
+MILES_PER_DEGREE = 69.17
+
+
+def haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great circle distance, in miles, between two coordinates in degrees"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(min(a, 1)))
+
+
+def load_coordinates(path: str, key_columns: Tuple[str, ...]) -> Dict[Tuple, Tuple[float, float]]:
+    """Loads a CSV file with `latitude` and `longitude` columns, keyed by `key_columns`"""
+    with open(path, 'r', newline='') as f:
+        return {
+            tuple(row[column] for column in key_columns): (
+                float(row['latitude']), float(row['longitude'])
+            )
+            for row in csv.DictReader(f)
+        }
+
+
+class GridIndex:
+    """Points bucketed in a regular latitude/longitude grid.
+
+    A nearest search only visits the cells overlapping the bounding box of the
+    radius, and computes the exact distance for the points inside them.
+    """
+
+    def __init__(self, cell_size: float = 0.5):
+        self.cell_size = cell_size
+        self.cells = defaultdict(list)
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return int(math.floor(lat / self.cell_size)), int(math.floor(lon / self.cell_size))
+
+    def add(self, lat: float, lon: float, item):
+        self.cells[self._cell(lat, lon)].append((lat, lon, item))
+
+    def nearest(
+        self,
+        lat: float,
+        lon: float,
+        radius: float,
+        k: int,
+        accept: Callable = None,
+        key: Callable = None,
+        after=None,
+    ) -> List[Tuple[float, object]]:
+        """Finds the `k` nearest items within the radius, only considering the
+        items `accept` returns True for, if given.
+
+        Items are sorted by `key(distance, item)` if given, and only the ones
+        sorted after `after` are considered, to find the next page of a search.
+
+        Returns:
+        --------
+        A list of (distance, item) sorted by distance, or by `key`.
+        """
+        if key is None:
+            def key(distance, item):
+                return distance
+
+        dlat = radius / MILES_PER_DEGREE
+        dlon = dlat / max(math.cos(math.radians(min(abs(lat) + dlat, 89.9))), 0.01)
+        min_i, min_j = self._cell(lat - dlat, lon - dlon)
+        max_i, max_j = self._cell(lat + dlat, lon + dlon)
+
+        candidates = []
+        for i in range(min_i, max_i + 1):
+            for j in range(min_j, max_j + 1):
+                for item_lat, item_lon, item in self.cells.get((i, j), ()):
+                    if accept is not None and not accept(item):
+                        continue
+                    distance = haversine(lat, lon, item_lat, item_lon)
+                    if distance > radius:
+                        continue
+                    if after is not None and key(distance, item) <= after:
+                        continue
+                    candidates.append((distance, item))
+        return heapq.nsmallest(k, candidates, key=lambda candidate: key(*candidate))
+
+
+@dataclass(frozen=True)
+class TierInfo:
+    buyer_slug: str
+    buyer: str
+    buyer_tier: str
+    radius: float
+
+
+class SpatialCoverage:
+    """Immutable snapshot of everything needed to answer coverage lookups
+    without the precomputed coverage table."""
+
+    def __init__(
+        self,
+        tiers: Dict[str, TierInfo],
+        tier_makes: Dict[Tuple[str, str], str],
+        dealers: Dict[str, GridIndex],
+        zipcodes: Dict[str, Tuple[float, float]],
+    ):
+        # buyer_tier_slug -> TierInfo
+        self.tiers = tiers
+        # (buyer_tier_slug, make_slug) -> make name
+        self.tier_makes = tier_makes
+        # buyer_slug -> dealers index
+        self.dealers = dealers
+        # zipcode -> centroid
+        self.zipcodes = zipcodes
+
+    @classmethod
+    def load(
+        cls,
+        dbsession,
+        zipcodes: Dict[str, Tuple[float, float]],
+        dealers_coordinates: Dict[Tuple[str, str], Tuple[float, float]],
+        default_radius: float,
+        tier_radius: Dict[str, float],
+        cell_size: float,
+    ) -> 'SpatialCoverage':
+        tiers = {
+            row.slug: TierInfo(
+                buyer_slug=row.buyer_slug,
+                buyer=row.buyer,
+                buyer_tier=row.name,
+                radius=tier_radius.get(row.slug, default_radius),
+            )
+            for row in dbsession.query(
+                BuyerTier.slug,
+                BuyerTier.name,
+                BuyerTier.buyer_slug,
+                Buyer.name.label('buyer'),
+            ).filter(BuyerTier.buyer_slug == Buyer.slug)
+        }
+        tier_makes = {
+            (row.tier_slug, row.make_slug): row.make
+            for row in dbsession.query(
+                BuyerTierMake.tier_slug,
+                BuyerTierMake.make_slug,
+                Make.name.label('make'),
+            ).filter(BuyerTierMake.make_slug == Make.slug)
+        }
+
+        # Dealers are located on their zipcode centroid unless their
+        # coordinates are explicitly given
+        dealers = defaultdict(lambda: GridIndex(cell_size))
+        for dealer in dbsession.query(BuyerDealer):
+            position = dealers_coordinates.get((dealer.buyer_slug, dealer.code))
+            if position is None:
+                position = zipcodes.get(dealer.zipcode)
+            if position is None:
+                continue
+            dealers[dealer.buyer_slug].add(position[0], position[1], {
+                'dealer_code': dealer.code,
+                'dealer_name': dealer.name,
+                'dealer_address': dealer.address,
+                'dealer_city': dealer.city,
+                'dealer_state': dealer.state,
+                'dealer_zipcode': dealer.zipcode,
+                'dealer_phone': dealer.phone,
+            })
+        return cls(tiers, tier_makes, dict(dealers), zipcodes)
+
+    def lookup(
+        self,
+        buyer_tier: str,
+        make: str,
+        zipcode: str,
+        limit: int,
+        dealers: Optional[FrozenSet[str]] = None,
+        after: Optional[Tuple[int, str]] = None,
+    ) -> List[Dict]:
+        tier = self.tiers.get(buyer_tier)
+        make_name = self.tier_makes.get((buyer_tier, make))
+        position = self.zipcodes.get(zipcode)
+        index = self.dealers.get(tier.buyer_slug) if tier else None
+        if make_name is None or position is None or index is None:
+            return []
+
+        accept = None
+        if dealers is not None:
+            def accept(dealer):
+                return dealer['dealer_code'] in dealers
+
+        # Same order as the coverage table, by the reported distance and then code
+        def page_key(distance, dealer):
+            return int(round(distance)), dealer['dealer_code']
+
+        return [
+            {
+                'buyer': tier.buyer,
+                'buyer_tier': tier.buyer_tier,
+                'make': make_name,
+                **dealer,
+                'distance': int(round(distance)),
+                'zipcode': zipcode,
+            }
+            for distance, dealer in index.nearest(
+                position[0], position[1], tier.radius, limit,
+                accept=accept, key=page_key, after=after,
+            )
+        ]
+
+
+class SpatialCoverageEngine:
+    """Looks up the coverage with a nearest search over the dealers coordinates,
+    so the dealer -> zipcode pairs don't need to be precomputed.
+
+    The buyers configuration is loaded from the database on the first lookup and
+    kept in memory, zipcodes centroids and dealers coordinates come from CSV files.
+    """
+
+    def __init__(
+        self,
+        zipcodes_file: str,
+        dealers_file: Optional[str] = None,
+        default_radius: float = 50,
+        tier_radius: Dict[str, float] = None,
+        cell_size: float = 0.5,
+    ):
+        self.zipcodes = {
+            zipcode: position
+            for (zipcode,), position in load_coordinates(zipcodes_file, ('zipcode',)).items()
+        }
+        self.dealers_coordinates = (
+            load_coordinates(dealers_file, ('buyer_slug', 'dealer_code'))
+            if dealers_file else {}
+        )
+        self.default_radius = default_radius
+        self.tier_radius = tier_radius or {}
+        self.cell_size = cell_size
+        self.coverage = None
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, settings: Dict) -> 'SpatialCoverageEngine':
+        tier_radius = {}
+        for value in aslist(settings.get('coverage.tier_radius', '')):
+            tier, _, radius = value.partition('=')
+            tier_radius[tier] = float(radius)
+        return cls(
+            settings['coverage.zipcodes_file'],
+            dealers_file=settings.get('coverage.dealers_file'),
+            default_radius=float(settings.get('coverage.radius', 50)),
+            tier_radius=tier_radius,
+            cell_size=float(settings.get('coverage.grid_cell_size', 0.5)),
+        )
+
+    def load(self, dbsession) -> SpatialCoverage:
+        """(Re)builds the in-memory coverage and makes it visible for new lookups"""
+        coverage = SpatialCoverage.load(
+            dbsession,
+            self.zipcodes,
+            self.dealers_coordinates,
+            self.default_radius,
+            self.tier_radius,
+            self.cell_size,
+        )
+        self.coverage = coverage
+        return coverage
+
+    def refresh(self, registry):
+        """Rebuilds the in-memory coverage with its own session, e.g. when the
+        data version changes"""
+        dbsession = registry['dbsession_factory']()
+        try:
+            self.load(dbsession)
+        finally:
+            dbsession.close()
+
+    def lookup(
+        self,
+        request: Request,
+        buyer_tier: str,
+        make: str,
+        zipcode: str,
+        limit: int,
+        dealers: Optional[FrozenSet[str]] = None,
+        after: Optional[Tuple[int, str]] = None,
+    ) -> List[Dict]:
+        coverage = self.coverage
+        if coverage is None:
+            with self.lock:
+                coverage = self.coverage or self.load(request.dbsession)
+        return coverage.lookup(buyer_tier, make, zipcode, limit, dealers=dealers, after=after)
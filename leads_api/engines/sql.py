@@ -0,0 +1,90 @@
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from pyramid.request import Request
+from sqlalchemy import String, any_, bindparam, tuple_
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from leads_api.models.leads import (
+    Buyer,
+    BuyerDealer,
+    BuyerTier,
+    BuyerTierMake,
+    #BuyerTierMakeYear,
+    BuyerTierDealerCoverage,
+    Make,
+    Zipcode,
+    #Year,
+)
+
+
+class SQLCoverageEngine:
+    """Looks up the coverage on the precomputed `buyer_tier_dealer_coverage` table"""
+
+    def lookup(
+        self,
+        request: Request,
+        buyer_tier: str,
+        make: str,
+        zipcode: str,
+        limit: int,
+        dealers: Optional[FrozenSet[str]] = None,
+        after: Optional[Tuple[int, str]] = None,
+    ) -> List[Dict]:
+        # Only dealers eligible for the request, if they were resolved. They are sent
+        # as a single array parameter, so the query is the same whatever the amount
+        filters = []
+        if dealers is not None:
+            filters.append(BuyerDealer.code == any_(
+                bindparam('dealers', sorted(dealers), type_=ARRAY(String))
+            ))
+        # Next page, after the (distance, dealer code) of the last row of the previous one
+        if after is not None:
+            filters.append(
+                tuple_(BuyerTierDealerCoverage.distance, BuyerDealer.code) > tuple_(*after)
+            )
+
+        # Prepare the query
+        query = (
+            request.dbsession.query(
+                Buyer.name.label('buyer'),
+                BuyerTier.name.label('buyer_tier'),
+                Make.name.label('make'),
+                #Year.name.label('year'),
+                BuyerDealer.code.label('dealer_code'),
+                BuyerDealer.name.label('dealer_name'),
+                BuyerDealer.address.label('dealer_address'),
+                BuyerDealer.city.label('dealer_city'),
+                BuyerDealer.state.label('dealer_state'),
+                BuyerDealer.zipcode.label('dealer_zipcode'),
+                BuyerDealer.phone.label('dealer_phone'),
+                BuyerTierDealerCoverage.distance.label('distance'),
+                Zipcode.code.label('zipcode'),
+            )
+            .filter(
+                # Joins
+                BuyerTier.slug == BuyerTierMake.tier_slug,
+                BuyerTier.buyer_slug == Buyer.slug,
+                BuyerDealer.buyer_slug == Buyer.slug,
+                BuyerDealer.id == BuyerTierDealerCoverage.dealer_id,
+                BuyerTierMake.make_slug == Make.slug,
+                #BuyerTierMakeYear.make_slug == Make.slug, # Enable this to add year filtering
+                #BuyerTierMakeYear.year_slug == Year.slug, # Enable this to add year filtering
+                BuyerTierDealerCoverage.buyer_tier_id == BuyerTier.id,
+                BuyerTierDealerCoverage.zipcode_id == Zipcode.id,
+                # Filters
+                BuyerTierMake.make_slug == make,
+                BuyerTierMake.tier_slug == buyer_tier,
+                Zipcode.code == zipcode,
+                *filters,
+            )
+            # Order result by distance ascending (we want the closer dealers), and by
+            # dealer code between dealers at the same distance, so pages are stable
+            .order_by(BuyerTierDealerCoverage.distance, BuyerDealer.code)
+            # Return only a limited amount of dealers. Initially, this number will be provided
+            # by the client but later we could handle all the buyers configurations
+            # and store this number in the database
+            .limit(limit)
+        )
+
+        # Fetch all rows
+        return [row._asdict() for row in query.all()]
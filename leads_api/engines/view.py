@@ -0,0 +1,67 @@
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from pyramid.request import Request
+from sqlalchemy import String, any_, bindparam, select, tuple_
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from leads_api.models.tables import coverage_lookup
+
+
+class ViewCoverageEngine:
+    """Looks up the coverage on the `coverage_lookup` materialized view, which has
+    the coverage rows already joined with the tier, make and dealer details.
+
+    A lookup is a range scan of the view key, (tier, make, zipcode) rows sorted
+    by distance and dealer code, so it reads the first `limit` rows and stops.
+    Next pages start the scan after the last row of the previous one. The view
+    is only as fresh as its last refresh, which is done at the end of every
+    import.
+    """
+
+    columns = [
+        coverage_lookup.c[name] for name in (
+            'buyer',
+            'buyer_tier',
+            'make',
+            'dealer_code',
+            'dealer_name',
+            'dealer_address',
+            'dealer_city',
+            'dealer_state',
+            'dealer_zipcode',
+            'dealer_phone',
+            'distance',
+            'zipcode',
+        )
+    ]
+
+    def lookup(
+        self,
+        request: Request,
+        buyer_tier: str,
+        make: str,
+        zipcode: str,
+        limit: int,
+        dealers: Optional[FrozenSet[str]] = None,
+        after: Optional[Tuple[int, str]] = None,
+    ) -> List[Dict]:
+        query = (
+            select(*self.columns)
+            .where(
+                coverage_lookup.c.tier_slug == buyer_tier,
+                coverage_lookup.c.make_slug == make,
+                coverage_lookup.c.zipcode == zipcode,
+            )
+            .order_by(coverage_lookup.c.distance, coverage_lookup.c.dealer_code)
+            .limit(limit)
+        )
+        # Same as the `sql` engine, a single array parameter whatever the amount
+        if dealers is not None:
+            query = query.where(coverage_lookup.c.dealer_code == any_(
+                bindparam('dealers', sorted(dealers), type_=ARRAY(String))
+            ))
+        if after is not None:
+            query = query.where(
+                tuple_(coverage_lookup.c.distance, coverage_lookup.c.dealer_code) > tuple_(*after)
+            )
+        return [row._asdict() for row in request.dbsession.execute(query)]
@@ -0,0 +1,151 @@
+import json
+import logging
+import threading
+import time
+from typing import Callable, Dict
+
+from pyramid.registry import Registry
+from pyramid.request import Request
+from pyramid.response import Response
+from pyramid.settings import asbool
+from pyramid.tweens import INGRESS
+
+logger = logging.getLogger(__name__)
+
+HEALTH_PATH = '/healthz'
+READY_PATH = '/readyz'
+
+
+class CachedProbe:
+    """Runs a probe at most once every `ttl` seconds, whatever the amount of
+    requests asking for it.
+
+    While a probe runs, concurrent callers get the previous result instead of
+    waiting or probing too, so a burst of health checks costs a single probe.
+    """
+
+    def __init__(self, probe: Callable[[], Dict], ttl: float = 5):
+        self.probe = probe
+        self.ttl = ttl
+        self.result = None
+        self.checked_at = None
+        self.lock = threading.Lock()
+
+    def __call__(self) -> Dict:
+        result, checked_at = self.result, self.checked_at
+        if checked_at is not None and time.monotonic() - checked_at < self.ttl:
+            return result
+        if not self.lock.acquire(blocking=result is None):
+            return result
+        try:
+            # Another caller may have probed while this one waited
+            if self.checked_at is not None and time.monotonic() - self.checked_at < self.ttl:
+                return self.result
+            self.result = self.probe()
+            self.checked_at = time.monotonic()
+            return self.result
+        finally:
+            self.lock.release()
+
+
+def database_probe(engine) -> Callable[[], Dict]:
+    """Probe checking a connection can be checked out and used, with the pool usage"""
+    def probe():
+        result = {'ok': True}
+        start = time.perf_counter()
+        try:
+            with engine.connect() as connection:
+                connection.exec_driver_sql('SELECT 1')
+        except Exception as error:
+            logger.warning('Readiness database probe failed: %s', error)
+            result = {'ok': False, 'error': error.__class__.__name__}
+        result['seconds'] = round(time.perf_counter() - start, 6)
+        pool = engine.pool
+        if hasattr(pool, 'checkedout'):
+            result['pool'] = {
+                'size': pool.size(),
+                'checked_out': pool.checkedout(),
+                'overflow': pool.overflow(),
+            }
+        return result
+    return probe
+
+
+def readiness(registry: Registry) -> Dict:
+    """Readiness of the process to serve coverage requests.
+
+    The database probe is cached, the other checks only read the registry.
+    """
+    settings = registry.settings
+    database = registry['health_database_probe']()
+    checks = {'database': database['ok']}
+    if asbool(settings.get('catalogue.load_on_startup', False)):
+        checks['catalogue'] = registry.get('catalogue') is not None
+    if asbool(settings.get('bloom.enabled', False)):
+        checks['coverage_filter'] = registry.get('coverage_filter') is not None
+    if asbool(settings.get('warmup.enabled', False)):
+        checks['warmup'] = bool(registry.get('warmed_up'))
+
+    data_version = registry['data_version']
+    return {
+        'ready': all(checks.values()),
+        'checks': checks,
+        'database': database,
+        'data_version': data_version.version,
+        'data_version_updated_at': data_version.updated_at.isoformat(),
+    }
+
+
+def probe_response(status: int, body: Dict) -> Response:
+    return Response(
+        body=json.dumps(body, separators=(',', ':')).encode(),
+        status=status,
+        content_type='application/json',
+        charset='utf-8',
+        cache_control='no-store',
+    )
+
+
+def health_tween(handler, registry):
+    """Tween wrapper answering the liveness and readiness probes before anything
+    else runs: no routing, OpenAPI validation, response envelope or transaction.
+
+    `/healthz` only tells the process is up. `/readyz` answers 503 until the
+    database is reachable and the caches configured to load on startup are
+    loaded, see `readiness`.
+    """
+    metrics = registry['metrics']
+
+    def wrapper(request: Request):
+        if request.path_info == HEALTH_PATH:
+            return probe_response(200, {'status': 'ok'})
+        if request.path_info == READY_PATH:
+            metrics.incr('health.readiness_checks')
+            result = readiness(registry)
+            return probe_response(200 if result['ready'] else 503, result)
+        return handler(request)
+    return wrapper
+
+
+def includeme(config):
+    """
+    Answer the load balancer's health checks on ``/healthz`` and ``/readyz``.
+
+    The database is probed at most every ``health.probe_ttl`` seconds (5 by
+    default), whatever the amount of checks.
+
+    Activate this setup using ``config.include('leads_api.health')``.
+
+    """
+    settings = config.get_settings()
+    registry = config.registry
+    registry['health_database_probe'] = CachedProbe(
+        database_probe(registry['dbengine']),
+        ttl=float(settings.get('health.probe_ttl', 5)),
+    )
+    # Over every other tween, the probes skip all of them
+    config.add_tween(
+        'leads_api.health.health_tween',
+        under=INGRESS,
+        over='leads_api.tweens.compression_tween',
+    )
@@ -0,0 +1,40 @@
+import threading
+from collections import defaultdict
+from typing import Dict
+
+from pyramid.request import Request
+
+
+class Metrics:
+    """Thread-safe counters and gauges of the running process"""
+
+    def __init__(self):
+        self.counters = defaultdict(int)
+        self.gauges = {}
+        self.lock = threading.Lock()
+
+    def incr(self, name: str, value: int = 1):
+        with self.lock:
+            self.counters[name] += value
+
+    def set(self, name: str, value: float):
+        with self.lock:
+            self.gauges[name] = value
+
+    def snapshot(self) -> Dict[str, float]:
+        with self.lock:
+            return {**self.counters, **self.gauges}
+
+
+def get_metrics(request: Request) -> Metrics:
+    return request.registry['metrics']
+
+
+def includeme(config):
+    """
+    Keep the process metrics in ``registry['metrics']``.
+
+    Activate this setup using ``config.include('leads_api.metrics')``.
+
+    """
+    config.registry['metrics'] = Metrics()
@@ -101,6 +101,8 @@ def includeme(config):
     if not dbengine:
         dbengine = get_engine(settings)
 
+    config.registry['dbengine'] = dbengine
+
     session_factory = get_session_factory(dbengine)
     config.registry['dbsession_factory'] = session_factory
 
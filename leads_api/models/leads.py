@@ -42,6 +42,7 @@ from .tables import (
     buyer_dealer_make_year,
     buyer_dealer_make_model,
     buyer_dealer_make_model_year,
+    zipcode,
     buyer_tier_dealer_coverage,
 )
 
@@ -105,6 +106,7 @@ class BuyerTier:
     slug: Text
     name: Text
     makes: List[Make] = field(default_factory=list)
+    id: int = None
 
 
 @dataclass
@@ -126,13 +128,20 @@ class BuyerDealer:
     zipcode: Text
     phone: Text
     makes: List['Make'] = field(default_factory=list)
+    id: int = None
+
+
+@dataclass
+class Zipcode:
+    code: Text
+    id: int = None
 
 
 @dataclass
 class BuyerTierDealerCoverage:
-    buyer_tier_slug: Text
-    dealer_code: Text
-    zipcode: Text
+    buyer_tier_id: int
+    zipcode_id: int
+    dealer_id: int
     distance: int
 
 
@@ -149,6 +158,13 @@ class BuyerTierMake:
     make_slug: Text
 
 
+@dataclass
+class BuyerDealerMake:
+    buyer_slug: Text
+    dealer_code: Text
+    make_slug: Text
+
+
 @dataclass
 class BuyerTierMakeYear:
     buyer_slug: Text
@@ -156,20 +172,6 @@ class BuyerTierMakeYear:
     make_slug: Text
     year_slug: Text
 
-buyer_dealer = Table(
-    'buyer_dealer',
-    metadata,
-    Column(
-        'buyer_slug', String(50), ForeignKey('buyer.slug'), primary_key=True
-    ),
-    Column('code', String(15), primary_key=True),
-    Column('name', String(255)),
-    Column('address', String(255)),
-    Column('city', String(255)),
-    Column('state', String(255)),
-    Column('zipcode', String(255)),
-    Column('phone', String(255)),
-)
 
 # ========= Mappings ============
 # Mappings should be done after declaring the Tables so
@@ -240,6 +242,11 @@ mapper_registry.map_imperatively(
     #properties={'makes': relationship(Make, secondary=buyer_dealer_make)},
 )
 
+mapper_registry.map_imperatively(
+    Zipcode,
+    zipcode,
+)
+
 mapper_registry.map_imperatively(
     BuyerTierDealerCoverage,
     buyer_tier_dealer_coverage,
@@ -272,3 +279,8 @@ mapper_registry.map_imperatively(
     #    'year': relationship(Year),
     #}
 )
+
+mapper_registry.map_imperatively(
+    BuyerDealerMake,
+    buyer_dealer_make,
+)
@@ -1,12 +1,31 @@
 from sqlalchemy import (
+    DDL,
+    case,
+    cast,
+    event,
+    func,
+    select,
+    true,
+    Text,
+    LargeBinary,
+    Index,
+    MetaData,
     Table,
     Column,
     Integer,
+    BigInteger,
+    SmallInteger,
     String,
+    DateTime,
+    Identity,
+    literal_column,
     ForeignKey,
     UniqueConstraint,
     ForeignKeyConstraint,
 )
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.schema import CreateIndex, ExecutableDDLElement
 
 from .meta import metadata
 
@@ -38,7 +57,16 @@ __all__ = [
     'buyer_dealer_make_year',
     'buyer_dealer_make_model',
     'buyer_dealer_make_model_year',
+    'zipcode',
     'buyer_tier_dealer_coverage',
+    'coverage_keys',
+    'orphan_check_sql',
+    'data_version',
+    'coverage_lookup',
+    'coverage_response',
+    'materialized_views',
+    'refresh_views_sql',
+    'cursor_sql',
 ]
 
 year = Table(
@@ -186,7 +214,10 @@ buyer_tier = Table(
     ),
     Column('slug', String(50), primary_key=True),
     Column('name', String(50), nullable=False),
+    # Compact surrogate key used by the coverage table
+    Column('id', Integer, Identity(), nullable=False),
     UniqueConstraint('buyer_slug', 'name'),
+    UniqueConstraint('id'),
 )
 
 legacy_buyer_tier = Table(
@@ -325,7 +356,10 @@ buyer_dealer = Table(
     Column('zipcode', String(255)),
     Column('country_slug', String(50)),
     Column('phone', String(255)),
+    # Compact surrogate key used by the coverage table
+    Column('id', Integer, Identity(), nullable=False),
     UniqueConstraint('buyer_slug', 'name', 'address', 'city', 'state', 'zipcode'),
+    UniqueConstraint('id'),
     ForeignKeyConstraint(
         ['country_slug', 'state'],
         ['country_state.country_slug', 'country_state.abbr']
@@ -424,12 +458,267 @@ buyer_dealer_make_model_year = Table(
     ),
 )
 
+zipcode = Table(
+    'zipcode',
+    metadata,
+    Column('id', Integer, Identity(), primary_key=True),
+    Column('code', String(255), nullable=False),
+    UniqueConstraint('code'),
+)
+
+# Tiers, dealers and zipcodes are referenced by their integer ids, so the rows and
+# the primary key stay small. The key starts with (tier, zipcode) as every lookup
+# filters by both.
+# The table is partitioned by tier, so a tier can be reloaded by replacing its
+# partition (see `reload_tables.py`), which is then clustered on (zipcode, distance).
+# Tiers without their own partition are kept in the default one
 buyer_tier_dealer_coverage = Table(
     'buyer_tier_dealer_coverage',
     metadata,
-    Column('buyer_tier_slug', String(50), primary_key=True),
-    Column('dealer_code', String(50), primary_key=True),
-    Column('zipcode', String(255), primary_key=True),
-    Column('distance', Integer),
-    # TODO: Add foreign key constraints
+    Column('buyer_tier_id', Integer, primary_key=True),
+    Column('zipcode_id', Integer, primary_key=True),
+    Column('dealer_id', Integer, primary_key=True),
+    Column('distance', SmallInteger),
+    # No foreign keys on purpose: ATTACH PARTITION would validate them scanning
+    # the whole partition under the exclusive lock of the swap, and a referenced
+    # zipcode table couldn't be reloaded anymore. The imports check there are no
+    # orphan rows instead, see `orphan_check_sql`
+    # Built on every partition before it's attached, the rows are loaded in
+    # this order so each partition is clustered on it
+    Index('buyer_tier_dealer_coverage_zipcode_distance_idx', 'zipcode_id', 'distance'),
+    postgresql_partition_by='LIST (buyer_tier_id)',
+)
+event.listen(
+    buyer_tier_dealer_coverage,
+    'after_create',
+    DDL('CREATE TABLE %(fullname)s_default PARTITION OF %(fullname)s DEFAULT'),
+)
+
+# Coverage columns holding the surrogate `id` of each table. Imports keep these
+# ids stable, and delete the coverage rows of the deleted tiers and dealers
+coverage_keys = {
+    buyer_tier: buyer_tier_dealer_coverage.c.buyer_tier_id,
+    buyer_dealer: buyer_tier_dealer_coverage.c.dealer_id,
+    zipcode: buyer_tier_dealer_coverage.c.zipcode_id,
+}
+
+
+def orphan_check_sql() -> str:
+    """Statement failing the transaction if a coverage row references a missing
+    tier, dealer or zipcode, in place of the foreign keys of the coverage table"""
+    checks = ''.join(
+        f"  IF EXISTS (SELECT FROM {key.table.fullname} c WHERE NOT EXISTS "
+        f"(SELECT FROM {table.fullname} r WHERE r.id = c.{key.name})) THEN\n"
+        f"    RAISE EXCEPTION 'Coverage rows reference missing `{table.name}` rows';\n"
+        f"  END IF;\n"
+        for table, key in coverage_keys.items()
+    )
+    return f'DO $$\nBEGIN\n{checks}END\n$$;\n'
+
+# Single row table with the version of the data, bumped by every import so the
+# API workers know when their in-memory caches are stale
+data_version = Table(
+    'data_version',
+    metadata,
+    Column('id', Integer, primary_key=True, autoincrement=False),
+    Column('version', BigInteger, nullable=False),
+    Column('updated_at', DateTime(timezone=True), nullable=False),
+)
+
+
+class CreateMaterializedView(ExecutableDDLElement):
+    def __init__(self, view: Table, query):
+        self.view = view
+        self.query = query
+
+
+class DropMaterializedView(ExecutableDDLElement):
+    def __init__(self, view: Table):
+        self.view = view
+
+
+@compiles(CreateMaterializedView)
+def _create_materialized_view(element, compiler, **kw):
+    query = compiler.sql_compiler.process(element.query, literal_binds=True)
+    return f'CREATE MATERIALIZED VIEW {compiler.preparer.format_table(element.view)} AS {query}'
+
+
+@compiles(DropMaterializedView)
+def _drop_materialized_view(element, compiler, **kw):
+    return f'DROP MATERIALIZED VIEW IF EXISTS {compiler.preparer.format_table(element.view)}'
+
+
+def materialized_view(name: str, query, key) -> Table:
+    """Declares a materialized view of `query`, created and dropped with the
+    tables of `metadata`, with a unique index on the `key` columns, as required
+    to refresh it concurrently.
+
+    The returned table has the columns of the query and is only used to query the
+    view, it belongs to its own metadata so it's never created as a table.
+    """
+    view = Table(
+        name,
+        MetaData(schema=metadata.schema),
+        *[Column(column.name, column.type) for column in query.selected_columns],
+    )
+    view.info['query'] = query
+    index = Index(f'{name}_key', *[view.c[column] for column in key], unique=True)
+    event.listen(metadata, 'after_create', CreateMaterializedView(view, query))
+    event.listen(metadata, 'after_create', CreateIndex(index))
+    event.listen(metadata, 'before_drop', DropMaterializedView(view))
+    return view
+
+
+def refresh_views_sql(concurrently: bool = True) -> str:
+    """Statements refreshing every materialized view. Concurrent refreshes don't
+    block the readers of the views, but they need the views to be populated."""
+    option = ' CONCURRENTLY' if concurrently else ''
+    return ''.join(
+        f'REFRESH MATERIALIZED VIEW{option} {view.fullname};\n' for view in materialized_views
+    )
+
+
+def cursor_sql(distance, dealer_code):
+    """SQL expression of the cursor of a row, decoded the same as the ones of
+    `leads_api.pagination.encode_cursor`. Postgres wraps base64 lines and pads
+    them, which is undone here."""
+    data = func.convert_to(cast(func.json_build_array(distance, dealer_code), Text), 'UTF8')
+    return func.rtrim(
+        func.translate(func.encode(data, 'base64'), literal_column("E'+/\\n'"), '-_'),
+        '=',
+        type_=Text,
+    )
+
+
+# Coverage rows joined with the tier, make and dealer details, so a lookup is a
+# range scan of a single index: (tier, make, zipcode) rows sorted by distance
+# and dealer code, which is also the order of the pages of the coverage endpoint.
+# It's refreshed after every import, see `import_data.py` and `reload_tables.py`
+coverage_lookup = materialized_view(
+    'coverage_lookup',
+    select(
+        buyer_tier.c.slug.label('tier_slug'),
+        buyer_tier_make.c.make_slug,
+        zipcode.c.code.label('zipcode'),
+        buyer_tier_dealer_coverage.c.distance,
+        buyer_dealer.c.id.label('dealer_id'),
+        buyer.c.name.label('buyer'),
+        buyer_tier.c.name.label('buyer_tier'),
+        make.c.name.label('make'),
+        buyer_dealer.c.code.label('dealer_code'),
+        buyer_dealer.c.name.label('dealer_name'),
+        buyer_dealer.c.address.label('dealer_address'),
+        buyer_dealer.c.city.label('dealer_city'),
+        buyer_dealer.c.state.label('dealer_state'),
+        buyer_dealer.c.zipcode.label('dealer_zipcode'),
+        buyer_dealer.c.phone.label('dealer_phone'),
+    )
+    .where(
+        buyer_tier_dealer_coverage.c.buyer_tier_id == buyer_tier.c.id,
+        buyer_tier_dealer_coverage.c.zipcode_id == zipcode.c.id,
+        buyer_tier_dealer_coverage.c.dealer_id == buyer_dealer.c.id,
+        buyer_tier_make.c.buyer_slug == buyer_tier.c.buyer_slug,
+        buyer_tier_make.c.tier_slug == buyer_tier.c.slug,
+        buyer_tier_make.c.make_slug == make.c.slug,
+        buyer.c.slug == buyer_tier.c.buyer_slug,
+    ),
+    ('tier_slug', 'make_slug', 'zipcode', 'distance', 'dealer_code'),
 )
+
+# Amount of dealers in the pre-rendered responses, the default `limit` of the
+# coverage endpoint
+COVERAGE_RESPONSE_LIMIT = 3
+
+_ranked = (
+    select(
+        buyer_tier.c.slug.label('tier_slug'),
+        buyer_tier_make.c.make_slug,
+        zipcode.c.code.label('zipcode'),
+        buyer.c.name.label('buyer'),
+        buyer_tier.c.name.label('buyer_tier'),
+        make.c.name.label('make'),
+        buyer_dealer.c.code.label('dealer_code'),
+        buyer_dealer.c.name.label('dealer_name'),
+        buyer_dealer.c.address.label('dealer_address'),
+        buyer_dealer.c.city.label('dealer_city'),
+        buyer_dealer.c.state.label('dealer_state'),
+        buyer_dealer.c.zipcode.label('dealer_zipcode'),
+        buyer_dealer.c.phone.label('dealer_phone'),
+        buyer_tier_dealer_coverage.c.distance,
+        func.row_number().over(
+            partition_by=(buyer_tier.c.id, buyer_tier_make.c.make_slug, zipcode.c.id),
+            order_by=(buyer_tier_dealer_coverage.c.distance, buyer_dealer.c.code),
+        ).label('rank'),
+        func.count().over(
+            partition_by=(buyer_tier.c.id, buyer_tier_make.c.make_slug, zipcode.c.id),
+        ).label('total'),
+    )
+    .where(
+        buyer_tier_dealer_coverage.c.buyer_tier_id == buyer_tier.c.id,
+        buyer_tier_dealer_coverage.c.zipcode_id == zipcode.c.id,
+        buyer_tier_dealer_coverage.c.dealer_id == buyer_dealer.c.id,
+        buyer_tier_make.c.buyer_slug == buyer_tier.c.buyer_slug,
+        buyer_tier_make.c.tier_slug == buyer_tier.c.slug,
+        buyer_tier_make.c.make_slug == make.c.slug,
+        buyer.c.slug == buyer_tier.c.buyer_slug,
+        # Only the dealers selling the make, as the catalogue resolves them
+        buyer_dealer_make.c.buyer_slug == buyer_dealer.c.buyer_slug,
+        buyer_dealer_make.c.dealer_code == buyer_dealer.c.code,
+        buyer_dealer_make.c.make_slug == buyer_tier_make.c.make_slug,
+    )
+    .subquery('ranked')
+)
+
+# The `data` of the coverage responses without filters, already serialized, for
+# every (tier, make, zipcode) with coverage. The coverage endpoint sends these
+# bytes as they are, see `leads_api.prerendered`. The objects keys are in the
+# same order as the responses built by the view
+coverage_response = materialized_view(
+    'coverage_response',
+    select(
+        _ranked.c.tier_slug,
+        _ranked.c.make_slug,
+        _ranked.c.zipcode,
+        func.convert_to(
+            cast(func.json_build_object(
+                'has_coverage', true(),
+                'buyer', _ranked.c.buyer,
+                'buyer_tier', _ranked.c.buyer_tier,
+                'coverage', func.json_agg(aggregate_order_by(
+                    func.json_build_object(
+                        'dealer_code', _ranked.c.dealer_code,
+                        'dealer_name', _ranked.c.dealer_name,
+                        'dealer_address', _ranked.c.dealer_address,
+                        'dealer_city', _ranked.c.dealer_city,
+                        'dealer_state', _ranked.c.dealer_state,
+                        'dealer_zipcode', _ranked.c.dealer_zipcode,
+                        'dealer_phone', _ranked.c.dealer_phone,
+                        'distance', _ranked.c.distance,
+                        'zipcode', _ranked.c.zipcode,
+                        'make', _ranked.c.make,
+                    ),
+                    _ranked.c.rank,
+                )),
+                # Cursor of the next page, if there are more dealers
+                'next_cursor', func.max(case((
+                    (_ranked.c.rank == COVERAGE_RESPONSE_LIMIT)
+                    & (_ranked.c.total > COVERAGE_RESPONSE_LIMIT),
+                    cursor_sql(_ranked.c.distance, _ranked.c.dealer_code),
+                ))),
+            ), Text),
+            'UTF8',
+            type_=LargeBinary,
+        ).label('data'),
+    )
+    .where(_ranked.c.rank <= COVERAGE_RESPONSE_LIMIT)
+    .group_by(
+        _ranked.c.tier_slug,
+        _ranked.c.make_slug,
+        _ranked.c.zipcode,
+        _ranked.c.buyer,
+        _ranked.c.buyer_tier,
+    ),
+    ('tier_slug', 'make_slug', 'zipcode'),
+)
+
+materialized_views = [coverage_lookup, coverage_response]
@@ -0,0 +1,119 @@
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Dict, Optional
+
+import hupper
+from pyramid.config import PHASE0_CONFIG
+from pyramid.exceptions import ConfigurationError
+from pyramid.response import FileResponse
+from pyramid.security import NO_PERMISSION_REQUIRED
+from pyramid.settings import asbool
+# `_create_api_settings` is private, pyramid_openapi3 is pinned in setup.py
+from pyramid_openapi3 import Spec, _create_api_settings, read_from_filename, validate_spec
+
+logger = logging.getLogger(__name__)
+
+
+def spec_cache_path(cache_dir: str, content: bytes) -> Path:
+    """Path of the cached spec, keyed by the hash of the spec file, so a changed
+    spec is never read from a stale cache"""
+    digest = hashlib.sha256(content).hexdigest()[:32]
+    return Path(cache_dir) / f'openapi-{digest}.json'
+
+
+def load_spec_dict(filepath: str, cache_dir: Optional[str] = None) -> Dict:
+    """Reads and validates the spec file, or reads it from the cache, which only
+    holds specs that were already validated.
+
+    The cache is a plain JSON file written next to the others, and replaced
+    atomically so concurrent workers never read a partial file.
+    """
+    with open(filepath, 'rb') as f:
+        content = f.read()
+    cache_path = spec_cache_path(cache_dir, content) if cache_dir else None
+    if cache_path is not None:
+        try:
+            with open(cache_path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            pass
+
+    spec_dict, _ = read_from_filename(filepath)
+    validate_spec(spec_dict)
+
+    if cache_path is not None:
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = cache_path.with_name(f'{cache_path.name}.{os.getpid()}.tmp')
+            with open(tmp_path, 'w') as f:
+                json.dump(spec_dict, f)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            # The spec is valid, it just won't be faster next time
+            logger.warning('Could not cache the spec in %s: %s', cache_dir, e)
+    return spec_dict
+
+
+def add_cached_spec_view(
+    config,
+    filepath: str,
+    route: str,
+    cache_dir: Optional[str] = None,
+    route_name: str = 'pyramid_openapi3.spec',
+    apiname: str = 'pyramid_openapi3',
+):
+    """Same as ``config.pyramid_openapi3_spec``, reading the spec with
+    `load_spec_dict` so it's only parsed and validated when it changes.
+
+    It builds the same API settings as pyramid_openapi3, pinned to the version
+    this mirrors, and uses the same action discriminator, so it can't be
+    combined with ``pyramid_openapi3_spec``. The spec file is watched by the
+    reloader of ``pserve --reload`` too.
+    """
+
+    def register():
+        settings = config.registry.settings.get(apiname)
+        if settings and settings.get('spec') is not None:
+            raise ConfigurationError('Spec has already been configured')
+        if hupper.is_active():
+            hupper.get_reloader().watch_files([filepath])
+        spec = Spec.create(load_spec_dict(filepath, cache_dir))
+
+        def spec_view(request):
+            return FileResponse(filepath, request=request, content_type='text/yaml')
+
+        config.add_route(route_name, route)
+        config.add_view(route_name=route_name, permission=NO_PERMISSION_REQUIRED, view=spec_view)
+        config.registry.settings[apiname] = _create_api_settings(
+            config, filepath, route_name, spec
+        )
+        config.registry.settings.setdefault('pyramid_openapi3_apinames', []).append(apiname)
+
+    config.action((f'{apiname}_spec',), register, order=PHASE0_CONFIG)
+
+
+def includeme(config):
+    """
+    Load the OpenAPI spec of the API, and its explorer if enabled.
+
+    - ``openapi.spec_cache_dir``: Directory where the validated spec is cached, so
+      it's only parsed and validated once per spec file version. It must only be
+      writable by the application user.
+    - ``openapi.explorer = true`` serves the Swagger UI explorer at ``/docs/``.
+
+    Activate this setup using ``config.include('leads_api.openapi')``.
+
+    """
+    settings = config.get_settings()
+    config.include('pyramid_openapi3')
+    add_cached_spec_view(
+        config,
+        'openapi.yaml',
+        route='/v1/openapi.yaml',
+        cache_dir=settings.get('openapi.spec_cache_dir') or None,
+    )
+    if asbool(settings.get('openapi.explorer', False)):
+        config.pyramid_openapi3_add_explorer()
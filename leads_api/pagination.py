@@ -0,0 +1,44 @@
+import base64
+import binascii
+import json
+from typing import Tuple
+
+# Cursors built by the `coverage_response` view, next to the tables
+from leads_api.models.tables import cursor_sql  # noqa: F401
+
+# Coverage rows are sorted by (distance, dealer_code), which is unique within a
+# (tier, make, zipcode) lookup. A page is the rows after the (distance,
+# dealer_code) of the last row of the previous one, so every page is a range
+# scan from its start, whatever its depth.
+#
+# Cursors are the JSON array of that key in unpadded URL safe base64. Clients
+# should treat them as opaque, they're only meant to be sent back.
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(distance: int, dealer_code: str) -> str:
+    data = json.dumps([distance, dealer_code], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[int, str]:
+    """Parses a cursor into the (distance, dealer_code) key of the last row of
+    the previous page.
+
+    Raises:
+    -------
+    InvalidCursor: If it's not a cursor sent by `encode_cursor` or by the
+        `coverage_response` view.
+    """
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        distance, dealer_code = json.loads(data)
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError) as error:
+        raise InvalidCursor(f'Invalid cursor {cursor!r}') from error
+    if not isinstance(distance, int) or not isinstance(dealer_code, str):
+        raise InvalidCursor(f'Invalid cursor {cursor!r}')
+    return distance, dealer_code
+
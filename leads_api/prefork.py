@@ -0,0 +1,34 @@
+import logging
+from typing import Callable
+
+from pyramid.events import ApplicationCreated
+from pyramid.router import Router
+from pyramid.settings import asbool
+
+logger = logging.getLogger(__name__)
+
+
+def add_worker_hook(config, hook: Callable[[Router], None]):
+    """Runs `hook(app)` once in every process serving requests.
+
+    That's when the application is created, unless it's preloaded by a pre-fork
+    server (``prefork = true``). The master process then only configures it,
+    and the hooks run in every worker after the fork, see `post_fork`. Hooks
+    starting threads or opening connections need to be registered this way, as
+    neither survive a fork.
+    """
+    if asbool(config.get_settings().get('prefork', False)):
+        config.registry.setdefault('worker_hooks', []).append(hook)
+    else:
+        config.add_subscriber(lambda event: hook(event.app), ApplicationCreated)
+
+
+def post_fork(app: Router):
+    """Prepares a worker forked from a master process with a preloaded app,
+    before it accepts requests"""
+    registry = app.registry
+    # The pooled connections opened by the master are shared with every worker,
+    # they are left to the master and each worker opens its own
+    registry['dbengine'].dispose(close=False)
+    for hook in registry.get('worker_hooks', []):
+        hook(app)
@@ -0,0 +1,66 @@
+import json
+from typing import Dict, Optional
+
+from pyramid.request import Request
+from pyramid.response import Response
+from pyramid.settings import asbool
+from sqlalchemy import select
+
+from leads_api.metrics import get_metrics
+from leads_api.models.tables import COVERAGE_RESPONSE_LIMIT, coverage_response
+
+
+class PrerenderedResponse(Response):
+    """JSON response with the already serialized `data` of a coverage response.
+    `base_response_tween` splices the body into the envelope as it is."""
+
+    def __init__(self, data: bytes):
+        super().__init__(body=data, content_type='application/json')
+
+    def envelope(self, metadata: Dict):
+        """Wraps the data in the envelope with the `metadata` of the request"""
+        metadata = json.dumps(metadata, separators=(',', ':'))
+        self.body = b''.join([b'{"metadata":', metadata.encode(), b',"data":', self.body, b'}'])
+
+
+def is_prerendered(limit: int, year: str = None, model: str = None) -> bool:
+    """Whether the responses of a request are pre-rendered: only the requests
+    without filters and with the default limit are"""
+    return year is None and model is None and limit == COVERAGE_RESPONSE_LIMIT
+
+
+def get_prerendered(request: Request, buyer_tier: str, make: str, zipcode: str) -> Optional[bytes]:
+    """Looks up the pre-rendered `data` of a request in the `coverage_response`
+    view. None if they are disabled, or if there's none for the request, which
+    then needs to be answered by the coverage engine."""
+    if not request.registry.get('prerendered'):
+        return None
+    data = request.dbsession.execute(
+        select(coverage_response.c.data).where(
+            coverage_response.c.tier_slug == buyer_tier,
+            coverage_response.c.make_slug == make,
+            coverage_response.c.zipcode == zipcode,
+        )
+    ).scalar()
+    metrics = get_metrics(request)
+    if data is None:
+        metrics.incr('prerendered.misses')
+        return None
+    metrics.incr('prerendered.hits')
+    return bytes(data)
+
+
+def includeme(config):
+    """
+    Serve the coverage requests without filters from the pre-rendered responses
+    of the ``coverage_response`` view, enabled with ``coverage.prerendered = true``.
+
+    The view is refreshed after every import, like ``coverage_lookup``. Requests
+    with filters, another limit, or without a pre-rendered response (e.g. with no
+    coverage) are answered by the coverage engine.
+
+    Activate this setup using ``config.include('leads_api.prerendered')``.
+
+    """
+    settings = config.get_settings()
+    config.registry['prerendered'] = asbool(settings.get('coverage.prerendered', False))
@@ -0,0 +1,489 @@
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Dict, FrozenSet, Hashable, List, Optional, Tuple
+
+from pyramid.httpexceptions import exception_response
+from pyramid.registry import Registry
+from pyramid.request import Request
+from pyramid.settings import asbool
+from pyramid_retry import is_error_retryable
+from sqlalchemy.exc import DBAPIError, TimeoutError
+
+from leads_api.engines import EngineRequest
+from leads_api.engines.single_flight import SingleFlightCoverageEngine
+from leads_api.metrics import get_metrics
+from leads_api.timeouts import cancelled_by_deadline
+from leads_api.tweens import LRUCache, add_metadata
+
+logger = logging.getLogger(__name__)
+
+# Errors telling the database is unavailable or struggling, `TimeoutError`
+# being raised when no pool connection gets available in time
+DATABASE_ERRORS = (DBAPIError, TimeoutError)
+
+
+class CircuitBreaker:
+    """Stops calling the database once too many of the last `window` calls failed
+    or were slow, so an incident isn't made worse by the load of the requests.
+
+    The circuit opens when at least `min_calls` calls were made and the rate of
+    failed calls reaches `error_rate`, or the rate of calls taking more than
+    `slow_call_seconds` reaches `slow_call_rate`. After `open_seconds` a single
+    call is let through: the circuit closes if it's successful and fast, and
+    opens again otherwise.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(
+        self,
+        window: int = 20,
+        min_calls: int = 10,
+        error_rate: float = 0.5,
+        slow_call_seconds: float = 1.0,
+        slow_call_rate: float = 0.5,
+        open_seconds: float = 10,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.clock = clock
+        # (failed, slow) of the last calls
+        self.calls = deque(maxlen=window)
+        self.state = self.CLOSED
+        self.opened_at = None
+        # Whether the single call of the half-open state is running
+        self.probing = False
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, settings) -> 'CircuitBreaker':
+        return cls(
+            window=int(settings.get('circuit_breaker.window', 20)),
+            min_calls=int(settings.get('circuit_breaker.min_calls', 10)),
+            error_rate=float(settings.get('circuit_breaker.error_rate', 0.5)),
+            slow_call_seconds=float(settings.get('circuit_breaker.slow_call_seconds', 1)),
+            slow_call_rate=float(settings.get('circuit_breaker.slow_call_rate', 0.5)),
+            open_seconds=float(settings.get('circuit_breaker.open_seconds', 10)),
+        )
+
+    def allow(self) -> bool:
+        """Whether a call can be made now. A caller allowed to call must
+        `record` it, whatever its outcome."""
+        with self.lock:
+            if self.state == self.OPEN and self.clock() - self.opened_at >= self.open_seconds:
+                self.state = self.HALF_OPEN
+                self.probing = False
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def record(self, seconds: float, failed: bool = False):
+        slow = seconds >= self.slow_call_seconds
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                self.probing = False
+                if failed or slow:
+                    self._open()
+                else:
+                    self.state = self.CLOSED
+                    self.calls.clear()
+                return
+            self.calls.append((failed, slow))
+            if self.state == self.CLOSED and len(self.calls) >= self.min_calls:
+                failures = sum(failed for failed, _ in self.calls)
+                slow_calls = sum(slow for _, slow in self.calls)
+                if (
+                    failures >= self.error_rate * len(self.calls)
+                    or slow_calls >= self.slow_call_rate * len(self.calls)
+                ):
+                    self._open()
+
+    def release(self):
+        """Ends an allowed call that tells nothing about the database, without
+        recording it"""
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                self.probing = False
+
+    def _open(self):
+        if self.state != self.OPEN:
+            logger.warning('Circuit breaker opened for %ss', self.open_seconds)
+        self.state = self.OPEN
+        self.opened_at = self.clock()
+        self.calls.clear()
+
+    def is_open(self) -> bool:
+        """Whether calls are denied, without letting the half-open call through"""
+        with self.lock:
+            if self.state == self.OPEN:
+                return self.clock() - self.opened_at < self.open_seconds
+            return self.state == self.HALF_OPEN and self.probing
+
+
+class Revalidator:
+    """Refreshes stale keys one at a time in a background thread, started on the
+    first key. Keys already waiting are only refreshed once.
+
+    `refresh(key)` returns False if the key can't be refreshed yet, it's then
+    retried `interval` seconds later.
+    """
+
+    def __init__(self, refresh: Callable[[Hashable], bool], interval: float = 1, max_pending: int = 1000):
+        self.refresh = refresh
+        self.interval = interval
+        self.max_pending = max_pending
+        self.pending = OrderedDict()
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def submit(self, key: Hashable):
+        with self.condition:
+            if key in self.pending or len(self.pending) >= self.max_pending:
+                return
+            self.pending[key] = None
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='revalidator', daemon=True)
+                self.thread.start()
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                key, _ = self.pending.popitem(last=False)
+            try:
+                refreshed = self.refresh(key)
+            except Exception:
+                logger.exception('Cannot revalidate %s', key)
+                refreshed = True
+            if not refreshed:
+                with self.condition:
+                    self.pending[key] = None
+                    self.pending.move_to_end(key, last=False)
+                    self.condition.wait(self.interval)
+
+
+class BreakerRecordingEngine:
+    """Wraps a coverage engine to record its lookups in a circuit breaker.
+
+    It sits under `SingleFlightCoverageEngine` when lookups are coalesced, so a
+    query shared by several requests is recorded once. Queries cancelled because
+    the deadline of the client was too short aren't recorded.
+    """
+
+    def __init__(self, engine, breaker: CircuitBreaker):
+        self.engine = engine
+        self.breaker = breaker
+
+    def lookup(
+        self,
+        request: Request,
+        buyer_tier: str,
+        make: str,
+        zipcode: str,
+        limit: int,
+        dealers: Optional[FrozenSet[str]] = None,
+        after: Optional[Tuple[int, str]] = None,
+    ) -> List[Dict]:
+        start = time.perf_counter()
+        try:
+            rows = self.engine.lookup(
+                request, buyer_tier, make, zipcode, limit, dealers=dealers, after=after,
+            )
+        except DATABASE_ERRORS as error:
+            if cancelled_by_deadline(request, error):
+                self.breaker.release()
+            else:
+                self.breaker.record(time.perf_counter() - start, failed=True)
+            raise
+        except BaseException:
+            self.breaker.record(time.perf_counter() - start)
+            raise
+        self.breaker.record(time.perf_counter() - start)
+        return rows
+
+
+class ResilientCoverageEngine:
+    """Wraps a coverage engine with a circuit breaker, and answers from the rows
+    of the last successful lookups while the database is unavailable.
+
+    Stale rows are served when the circuit is open or when the lookup fails with
+    a database error, the request `metadata` then tells they're stale and how old
+    they are, and they're refreshed in the background as soon as the circuit lets
+    a call through. Without stale rows, an open circuit answers 503 at once and
+    a failed lookup raises its error as before.
+
+    Pre-rendered responses are read through the same breaker, see
+    `read_prerendered`.
+
+    The lookups of the wrapped engine must be recorded in the breaker, see
+    `BreakerRecordingEngine`.
+    """
+
+    def __init__(
+        self,
+        engine,
+        registry: Registry,
+        breaker: CircuitBreaker,
+        cache_size: int = 10000,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.engine = engine
+        self.registry = registry
+        self.breaker = breaker
+        self.clock = clock
+        # key -> (rows, time they were looked up)
+        self.cache = LRUCache(cache_size)
+        # (tier, make, zipcode) -> (pre-rendered data, time it was read)
+        self.prerendered = LRUCache(cache_size)
+        self.revalidator = Revalidator(
+            self.revalidate, interval=min(breaker.open_seconds, 1), max_pending=cache_size,
+        )
+
+    def lookup(
+        self,
+        request: Request,
+        buyer_tier: str,
+        make: str,
+        zipcode: str,
+        limit: int,
+        dealers: Optional[FrozenSet[str]] = None,
+        after: Optional[Tuple[int, str]] = None,
+    ) -> List[Dict]:
+        key = (buyer_tier, make, zipcode, limit, dealers, after)
+        metrics = get_metrics(request)
+        if not self.breaker.allow():
+            metrics.incr('circuit_breaker.rejected')
+            return self.stale(request, key)
+
+        try:
+            rows = self.call(request, key)
+        except DATABASE_ERRORS:
+            if self.cache.get(key) is None:
+                raise
+            logger.warning('Coverage lookup failed, serving stale rows', exc_info=True)
+            return self.stale(request, key)
+        return list(rows)
+
+    def call(self, request, key: Tuple) -> List[Dict]:
+        """Looks up a key, which the breaker must have allowed, and keeps its rows"""
+        buyer_tier, make, zipcode, limit, dealers, after = key
+        rows = self.engine.lookup(
+            request, buyer_tier, make, zipcode, limit, dealers=dealers, after=after,
+        )
+        self.cache.put(key, (list(rows), self.clock()))
+        return rows
+
+    def stale(self, request: Request, key: Tuple) -> List[Dict]:
+        """Rows of the last successful lookup of the key, marked stale and
+        queued for revalidation"""
+        cached = self.cache.get(key)
+        if cached is None:
+            raise exception_response(
+                503,
+                json_body=[{
+                    'exception': 'CircuitOpen',
+                    'message': 'The coverage is temporarily unavailable',
+                }],
+                headers={'Retry-After': str(math.ceil(self.breaker.open_seconds))},
+            )
+        rows, looked_up_at = cached
+        get_metrics(request).incr('circuit_breaker.stale')
+        add_metadata(request, stale=True, stale_seconds=round(self.clock() - looked_up_at, 3))
+        self.revalidator.submit(key)
+        return list(rows)
+
+    def read_prerendered(
+        self,
+        request: Request,
+        key: Tuple[str, str, str],
+        read: Callable[[], Optional[bytes]],
+    ) -> Optional[bytes]:
+        """Reads the pre-rendered response of a (tier, make, zipcode) key with
+        `read`, recording it in the breaker like the lookups.
+
+        While the circuit is open, or if the read fails with a database error,
+        the last response read for the key is served stale. Without one, an open
+        circuit returns None so the request goes on to `lookup`, and a failed
+        read raises its error.
+        """
+        if not self.breaker.allow():
+            if self.prerendered.get(key) is None:
+                return None
+            get_metrics(request).incr('circuit_breaker.rejected')
+            return self.stale_prerendered(request, key)
+
+        start = time.perf_counter()
+        try:
+            data = read()
+        except DATABASE_ERRORS as error:
+            if cancelled_by_deadline(request, error):
+                self.breaker.release()
+            else:
+                self.breaker.record(time.perf_counter() - start, failed=True)
+            if self.prerendered.get(key) is None:
+                raise
+            logger.warning('Pre-rendered response read failed, serving a stale one', exc_info=True)
+            return self.stale_prerendered(request, key)
+        except BaseException:
+            self.breaker.record(time.perf_counter() - start)
+            raise
+        self.breaker.record(time.perf_counter() - start)
+        if data is not None:
+            self.prerendered.put(key, (data, self.clock()))
+        return data
+
+    def stale_prerendered(self, request: Request, key: Tuple[str, str, str]) -> bytes:
+        """Last pre-rendered response read for the key, marked stale. It's
+        refreshed by the next read the breaker lets through"""
+        data, read_at = self.prerendered.get(key)
+        get_metrics(request).incr('circuit_breaker.stale')
+        add_metadata(request, stale=True, stale_seconds=round(self.clock() - read_at, 3))
+        return data
+
+    def revalidate(self, key: Tuple) -> bool:
+        """Looks up a key again with a session of its own, if the breaker lets it"""
+        if not self.breaker.allow():
+            return False
+        dbsession = self.registry['dbsession_factory']()
+        try:
+            self.call(EngineRequest(self.registry, dbsession), key)
+            dbsession.rollback()
+        except DATABASE_ERRORS:
+            logger.warning('Cannot revalidate %s', key, exc_info=True)
+        finally:
+            dbsession.close()
+        self.registry['metrics'].incr('circuit_breaker.revalidations')
+        return True
+
+
+def read_prerendered(
+    request: Request,
+    key: Tuple[str, str, str],
+    read: Callable[[], Optional[bytes]],
+) -> Optional[bytes]:
+    """Reads a pre-rendered response through the circuit breaker of the coverage
+    engine if it's enabled, see `ResilientCoverageEngine.read_prerendered`"""
+    engine = request.registry.get('coverage_engine')
+    if isinstance(engine, ResilientCoverageEngine):
+        return engine.read_prerendered(request, key, read)
+    return read()
+
+
+class RetryBudget:
+    """Token bucket of `per_second` retries, up to `burst` at once"""
+
+    def __init__(self, per_second: float, burst: float, clock: Callable[[], float] = time.monotonic):
+        self.per_second = per_second
+        self.burst = burst
+        self.clock = clock
+        self.tokens = burst
+        self.updated_at = clock()
+        self.lock = threading.Lock()
+
+    def spend(self) -> bool:
+        """Takes a retry from the budget, False if it's exhausted"""
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.per_second)
+            self.updated_at = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+def retry_budget_tween(handler, registry):
+    """Tween wrapper capping the requests retried by `pyramid_retry` to
+    `retry.budget_per_second` per second in the process.
+
+    When a retryable error happens and the budget is exhausted, the attempt is
+    made the last one so the error is returned instead of retried: during a
+    database incident retries would multiply the load.
+    """
+    metrics = registry['metrics']
+    budget = registry['retry_budget']
+
+    def allow_retry(request: Request, error: Exception):
+        if not is_error_retryable(request, error):
+            return
+        if budget.spend():
+            metrics.incr('retry.retries')
+        else:
+            metrics.incr('retry.budget_exhausted')
+            request.environ['retry.attempts'] = request.environ['retry.attempt'] + 1
+
+    def wrapper(request: Request):
+        try:
+            response = handler(request)
+        except Exception as error:
+            allow_retry(request, error)
+            raise
+        # Errors rendered by an exception view are retried too
+        error = getattr(request, 'exception', None)
+        if error is not None:
+            allow_retry(request, error)
+        return response
+    return wrapper
+
+
+def includeme(config):
+    """
+    Protect the database during incidents.
+
+    With ``circuit_breaker.enabled = true`` the coverage lookups go through a
+    circuit breaker, see `CircuitBreaker` for its ``circuit_breaker.*`` settings.
+    While it's open, or when a lookup fails, the rows of the last successful
+    lookup are served, up to ``circuit_breaker.stale_cache_size`` keys.
+
+    With ``retry.budget_per_second`` set, at most that many requests are retried
+    per second, with bursts of ``retry.budget_burst``.
+
+    Activate this setup using ``config.include('leads_api.resilience')``.
+
+    """
+    settings = config.get_settings()
+    registry = config.registry
+
+    if asbool(settings.get('circuit_breaker.enabled', False)):
+        breaker = CircuitBreaker.from_settings(settings)
+        registry['circuit_breaker'] = breaker
+        # The lookups are recorded under the single-flight, once per query
+        engine = registry['coverage_engine']
+        if isinstance(engine, SingleFlightCoverageEngine):
+            engine.engine = BreakerRecordingEngine(engine.engine, breaker)
+        else:
+            engine = BreakerRecordingEngine(engine, breaker)
+        registry['coverage_engine'] = ResilientCoverageEngine(
+            engine,
+            registry,
+            breaker,
+            cache_size=int(settings.get('circuit_breaker.stale_cache_size', 10000)),
+        )
+
+    per_second = settings.get('retry.budget_per_second')
+    if per_second is not None:
+        per_second = float(per_second)
+        registry['retry_budget'] = RetryBudget(
+            per_second,
+            float(settings.get('retry.budget_burst', max(per_second, 1))),
+        )
+        # Over every tween that may fail, the probes don't need a budget
+        config.add_tween(
+            'leads_api.resilience.retry_budget_tween',
+            under='leads_api.health.health_tween',
+            over='leads_api.tweens.compression_tween',
+        )
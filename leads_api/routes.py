@@ -4,3 +4,14 @@ def includeme(config):
         'v1_buyers_tiers_makes_coverage',
         '/v1/buyers_tiers/{buyer_tier_slug}/makes/{make_slug}/coverage',
     )
+    config.add_route(
+        'v1_legacy_buyers_tiers_makes_coverage',
+        '/v1/legacy_buyers_tiers/{legacy_id}/makes/{make_slug}/coverage',
+    )
+    config.add_route(
+        'v1_buyers_tiers_coverage_export',
+        '/v1/buyers_tiers/{buyer_tier_slug}/coverage/export',
+    )
+
+    # Operations
+    config.add_route('metrics', '/metrics')
@@ -0,0 +1,194 @@
+import logging
+import time
+from typing import Dict, Optional
+
+from pyramid.httpexceptions import exception_response
+from pyramid.registry import Registry
+from pyramid.request import Request
+from pyramid.settings import aslist
+from sqlalchemy import event
+from sqlalchemy.exc import DBAPIError
+
+logger = logging.getLogger(__name__)
+
+DEADLINE_KEY = 'leads_api.deadline'
+# (milliseconds, 'route' or 'deadline') of the statement timeout of the request
+STATEMENT_TIMEOUT_KEY = 'leads_api.statement_timeout'
+
+# SQLSTATE of the statements cancelled by `statement_timeout`
+QUERY_CANCELED = '57014'
+
+
+class DeadlineExceeded(Exception):
+    """The deadline sent by the client passed before the request was answered"""
+
+
+def parse_route_timeouts(value: str) -> Dict[str, int]:
+    """Parses the `route_name=milliseconds` lines of `statement_timeout.routes`"""
+    timeouts = {}
+    for line in aslist(value or '', flatten=False):
+        route_name, milliseconds = line.split('=')
+        timeouts[route_name.strip()] = int(milliseconds)
+    return timeouts
+
+
+def parse_deadline(request: Request, header: str) -> Optional[float]:
+    """Monotonic time of the deadline sent by the client in the `header`, in
+    milliseconds from now. Invalid values are ignored."""
+    value = request.headers.get(header)
+    if value is None:
+        return None
+    try:
+        milliseconds = float(value)
+    except ValueError:
+        logger.debug('Ignoring invalid %s header %r', header, value)
+        return None
+    return time.monotonic() + milliseconds / 1000
+
+
+def statement_timeout(request: Request) -> Optional[int]:
+    """Statement timeout of a request in milliseconds: the timeout of its route,
+    shortened to the time left before its deadline. None without either.
+
+    Raises:
+    -------
+    DeadlineExceeded: If the deadline already passed.
+    """
+    registry = request.registry
+    route = getattr(request, 'matched_route', None)
+    milliseconds = registry['route_statement_timeouts'].get(
+        route.name if route is not None else None,
+        registry['default_statement_timeout'],
+    ) or None
+    source = 'route'
+
+    deadline = request.environ.get(DEADLINE_KEY)
+    if deadline is not None:
+        remaining = int((deadline - time.monotonic()) * 1000)
+        if remaining <= 0:
+            raise DeadlineExceeded()
+        if milliseconds is None or remaining < milliseconds:
+            milliseconds, source = remaining, 'deadline'
+
+    if milliseconds is not None:
+        request.environ[STATEMENT_TIMEOUT_KEY] = (milliseconds, source)
+    return milliseconds
+
+
+def set_statement_timeout(connection, milliseconds: Optional[int]):
+    """Sets the timeout of the statements of the current transaction"""
+    if milliseconds is not None:
+        connection.exec_driver_sql(f'SET LOCAL statement_timeout = {int(milliseconds)}')
+
+
+def is_statement_timeout(error: DBAPIError) -> bool:
+    return getattr(error.orig, 'pgcode', None) == QUERY_CANCELED
+
+
+def timeout_source(request: Request) -> str:
+    """What the statement timeout of a request comes from, 'route' or 'deadline'"""
+    _, source = request.environ.get(STATEMENT_TIMEOUT_KEY, (None, 'route'))
+    return source
+
+
+def deadline_shortened(request: Request) -> bool:
+    """Whether the statement timeout of a request is shortened by the deadline
+    of its client. The transaction of the request is begun if needed, the
+    timeout being only known once it's set.
+
+    Raises:
+    -------
+    DeadlineExceeded: If the deadline already passed.
+    """
+    if DEADLINE_KEY not in request.environ:
+        return False
+    if STATEMENT_TIMEOUT_KEY not in request.environ:
+        request.dbsession.connection()
+    return timeout_source(request) == 'deadline'
+
+
+def cancelled_by_deadline(request: Request, error: Exception) -> bool:
+    """Whether an error is a statement cancelled by a timeout shortened by the
+    deadline of the client, which tells nothing about the database"""
+    return (
+        isinstance(error, DBAPIError)
+        and is_statement_timeout(error)
+        and timeout_source(request) == 'deadline'
+    )
+
+
+def timeout_response(request: Request, deadline: bool):
+    metrics = request.registry['metrics']
+    if deadline:
+        metrics.incr('timeouts.deadline')
+        return exception_response(504, json_body=[{
+            'exception': 'DeadlineExceeded',
+            'message': 'The request deadline passed',
+        }])
+    metrics.incr('timeouts.statement')
+    return exception_response(503, json_body=[{
+        'exception': 'StatementTimeout',
+        'message': 'The request took too long',
+    }])
+
+
+def timeout_tween(handler, registry: Registry):
+    """Tween wrapper reading the deadline of the client, and answering the
+    requests whose deadline passed or whose query was cancelled by the statement
+    timeout at once, in the error envelope: 504 for the deadline of the client,
+    503 for the timeout of the route.
+    """
+    header = registry['deadline_header']
+
+    def wrapper(request: Request):
+        deadline = parse_deadline(request, header)
+        if deadline is not None:
+            if deadline <= time.monotonic():
+                return timeout_response(request, deadline=True)
+            request.environ[DEADLINE_KEY] = deadline
+        try:
+            return handler(request)
+        except DeadlineExceeded:
+            return timeout_response(request, deadline=True)
+        except DBAPIError as error:
+            if not is_statement_timeout(error):
+                raise
+            return timeout_response(request, deadline=timeout_source(request) == 'deadline')
+    return wrapper
+
+
+def includeme(config):
+    """
+    Bound the time requests spend in the database.
+
+    Every transaction of a request session starts with ``SET LOCAL
+    statement_timeout``: the timeout of its route in ``statement_timeout.routes``
+    (``route_name=milliseconds`` lines), ``statement_timeout.default`` otherwise,
+    shortened to the time left before the deadline the client may send in the
+    ``deadline.header`` header (``X-Request-Timeout`` by default), in
+    milliseconds. ``0`` disables the timeout.
+
+    Activate this setup using ``config.include('leads_api.timeouts')``.
+
+    """
+    settings = config.get_settings()
+    registry = config.registry
+    registry['default_statement_timeout'] = int(settings.get('statement_timeout.default', 0))
+    registry['route_statement_timeouts'] = parse_route_timeouts(
+        settings.get('statement_timeout.routes'),
+    )
+    registry['deadline_header'] = settings.get('deadline.header', 'X-Request-Timeout')
+
+    def after_begin(session, transaction, connection):
+        request = session.info.get('request')
+        if request is not None:
+            set_statement_timeout(connection, statement_timeout(request))
+    event.listen(registry['dbsession_factory'], 'after_begin', after_begin)
+
+    # Under the response envelope and over the response validation, so timeouts
+    # are answered in the envelope without being documented on every route
+    config.add_tween(
+        'leads_api.timeouts.timeout_tween',
+        under='leads_api.tweens.base_response_tween',
+        over='pyramid_openapi3.tween.response_tween_factory',
+    )
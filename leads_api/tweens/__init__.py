@@ -1,4 +1,35 @@
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+from urllib.parse import urlencode
+
+from pyramid.httpexceptions import HTTPNotModified
 from pyramid.request import Request
+from pyramid.settings import asbool
+from pyramid.tweens import INGRESS
+from webob.etag import AnyETag
+
+from leads_api.prerendered import PrerenderedResponse
+
+try:
+    import brotli
+except ImportError:  # Optional, install the `brotli` extra
+    brotli = None
+
+# Content types worth compressing, the rest is either small or already compressed
+COMPRESSIBLE_TYPES = {'application/json', 'application/x-ndjson', 'text/csv'}
+
+
+# Extra `metadata` of the response envelope set while handling the request
+METADATA_KEY = 'leads_api.metadata'
+
+
+def add_metadata(request: Request, **values):
+    """Adds values to the `metadata` of the response envelope, e.g. to tell
+    the response is stale"""
+    request.environ.setdefault(METADATA_KEY, {}).update(values)
 
 
 def base_response_tween(handler, registry):
@@ -11,15 +42,20 @@ def base_response_tween(handler, registry):
 
         # Handle the request
         response = handler(request)
+        metadata = {
+            'params': dict(request.params),
+            **request.environ.get(METADATA_KEY, {}),
+        }
+
+        # Pre-rendered responses get the same envelope without parsing them
+        if isinstance(response, PrerenderedResponse):
+            response.envelope(metadata)
+            return response
 
         # For any json response add metadata
         if response.content_type == 'application/json':
             former_response = response.json
-            json_response = {
-                'metadata': {
-                    'params': dict(request.params),
-                },
-            }
+            json_response = {'metadata': metadata}
 
             # If the request had an error, we want to return a document specifying
             # the list of errors
@@ -35,5 +71,185 @@ def base_response_tween(handler, registry):
     return wrapper
 
 
+def request_etag(request: Request, version: str) -> str:
+    """ETag of a request for a data version. The same request always gets the
+    same response until the data changes, so they only depend on the request
+    path and params, and the data version."""
+    key = '\x1f'.join([
+        version,
+        request.path,
+        urlencode(sorted(request.GET.items())),
+    ])
+    return hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+
+def http_cache_tween(handler, registry):
+    """Tween wrapper to make successful GET JSON responses cacheable by clients
+    and CDNs. They get an ETag derived from the data version, and requests with
+    a matching `If-None-Match` are answered with a 304 before running the view.
+
+    Nothing is cached while the data version is unknown.
+    """
+    settings = registry.settings
+    if not asbool(settings.get('http_cache.enabled', False)):
+        return handler
+    cache_control = settings.get('http_cache.cache_control', 'public, max-age=60')
+
+    def wrapper(request: Request):
+        data_version = registry['data_version']
+        version, updated_at = data_version.version, data_version.updated_at
+        if request.method not in ('GET', 'HEAD') or version is None:
+            return handler(request)
+
+        etag = request_etag(request, version)
+        headers = {
+            'ETag': f'"{etag}"',
+            'Cache-Control': cache_control,
+        }
+        # `*` matches any representation, which isn't known to exist before the
+        # view runs, so it's left to the view
+        if request.if_none_match is not AnyETag and etag in request.if_none_match:
+            registry['metrics'].incr('http_cache.not_modified')
+            return HTTPNotModified(headers=headers)
+
+        # Handle the request
+        response = handler(request)
+
+        # Stale responses aren't tagged, clients revalidate them as soon as possible
+        stale = request.environ.get(METADATA_KEY, {}).get('stale')
+        if (
+            response.status_code == 200
+            and response.content_type == 'application/json'
+            and not stale
+        ):
+            response.headers.update(headers)
+            response.last_modified = updated_at
+        return response
+    return wrapper
+
+
+def negotiate_encoding(request: Request, encodings: List[str]) -> Optional[str]:
+    """Content coding to use from the request `Accept-Encoding`, preferring the
+    first of `encodings` between equally acceptable ones. Requests without the
+    header are not compressed."""
+    if 'Accept-Encoding' not in request.headers:
+        return None
+    offers = request.accept_encoding.acceptable_offers(encodings)
+    return offers[0][0] if offers else None
+
+
+def compress(body: bytes, encoding: str, level: int) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(body, quality=level)
+    # No timestamp, the same body is always compressed to the same bytes
+    return gzip.compress(body, compresslevel=level, mtime=0)
+
+
+class LRUCache:
+    """Thread-safe dictionary keeping the `size` most recently used items"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.items.get(key)
+            if value is not None:
+                self.items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+
+def compression_tween(handler, registry):
+    """Tween wrapper compressing the final body of large JSON, NDJSON and CSV
+    responses, with brotli or gzip as negotiated from `Accept-Encoding`.
+
+    Responses smaller than `compression.min_size` bytes are sent as they are, the
+    compression wouldn't save a packet. Responses with an ETag from the cache
+    tween always have the same body, so their compressed bytes are kept in an
+    LRU cache of `compression.cache_size` entries, and their ETag gets the
+    encoding appended, as the compressed representation is a different one.
+    Streamed responses, without a known length, are left to their view.
+    """
+    settings = registry.settings
+    if not asbool(settings.get('compression.enabled', False)):
+        return handler
+    min_size = int(settings.get('compression.min_size', 1400))
+    levels = {
+        'br': int(settings.get('compression.brotli_quality', 5)),
+        'gzip': int(settings.get('compression.gzip_level', 6)),
+    }
+    encodings = ['br', 'gzip'] if brotli is not None else ['gzip']
+    cache = LRUCache(int(settings.get('compression.cache_size', 1024)))
+    metrics = registry['metrics']
+
+    def wrapper(request: Request):
+        encoding = negotiate_encoding(request, encodings)
+
+        # The inner tweens only know the ETags without encoding
+        suffix = f'-{encoding}"'
+        if_none_match = request.headers.get('If-None-Match', '')
+        revalidated = encoding is not None and suffix in if_none_match
+        if revalidated:
+            request.headers['If-None-Match'] = if_none_match.replace(suffix, '"')
+
+        # Handle the request
+        response = handler(request)
+
+        if response.status_code == 304:
+            if revalidated and response.etag:
+                response.etag = f'{response.etag}-{encoding}'
+            return response
+        if (
+            response.status_code != 200
+            or response.content_type not in COMPRESSIBLE_TYPES
+            or response.content_encoding is not None
+            or response.content_length is None
+            or response.content_length < min_size
+        ):
+            return response
+
+        response.vary = tuple(response.vary or ()) + ('Accept-Encoding',)
+        if encoding is None:
+            return response
+
+        etag = response.etag
+        body = cache.get((etag, encoding)) if etag else None
+        if body is None:
+            body = compress(response.body, encoding, levels[encoding])
+            if etag:
+                cache.put((etag, encoding), body)
+            metrics.incr(f'compression.{encoding}')
+        else:
+            metrics.incr('compression.cache_hits')
+        metrics.incr('compression.bytes_saved', response.content_length - len(body))
+
+        response.body = body
+        response.content_encoding = encoding
+        if etag:
+            response.etag = f'{etag}-{encoding}'
+        return response
+    return wrapper
+
+
 def includeme(config):
-    config.add_tween('leads_api.tweens.base_response_tween')
+    # The compression and cache tweens are the outermost ones, so the cache one
+    # answers 304s before anything else runs and tags the final body, which is
+    # then compressed
+    config.add_tween('leads_api.tweens.compression_tween', under=INGRESS)
+    config.add_tween(
+        'leads_api.tweens.http_cache_tween',
+        under='leads_api.tweens.compression_tween',
+    )
+    config.add_tween(
+        'leads_api.tweens.base_response_tween',
+        under='leads_api.tweens.http_cache_tween',
+    )
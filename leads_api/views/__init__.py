@@ -15,3 +15,37 @@ def response_wrapper(request: Request):
         },
     }
     return response
+
+
+def includeme(config):
+    """
+    Register the views explicitly, the same as ``config.scan('.views')`` does
+    from their ``view_config`` decorators, without importing every module of the
+    package to look for them.
+
+    Activate this setup using ``config.include('leads_api.views')``.
+
+    """
+    from .coverage import coverage_get, coverage_legacy_get
+    from .export import coverage_export
+    from .metrics import metrics_get
+
+    config.add_view(response_wrapper, name='response_wrapper')
+    config.add_view(
+        coverage_get,
+        route_name='v1_buyers_tiers_makes_coverage',
+        openapi=True,
+        renderer='json',
+    )
+    config.add_view(
+        coverage_legacy_get,
+        route_name='v1_legacy_buyers_tiers_makes_coverage',
+        openapi=True,
+        renderer='json',
+    )
+    config.add_view(
+        coverage_export,
+        route_name='v1_buyers_tiers_coverage_export',
+        openapi=True,
+    )
+    config.add_view(metrics_get, route_name='metrics')
@@ -1,16 +1,14 @@
+from typing import Dict, List, Optional
+
+from pyramid.httpexceptions import exception_response
 from pyramid.request import Request
 from pyramid.view import view_config
 
-from leads_api.models.leads import (
-    Buyer,
-    BuyerDealer,
-    BuyerTier,
-    BuyerTierMake,
-    #BuyerTierMakeYear,
-    BuyerTierDealerCoverage,
-    Make,
-    #Year,
-)
+from leads_api.bloom import might_have_coverage
+from leads_api.catalogue import get_catalogue
+from leads_api.pagination import InvalidCursor, decode_cursor, encode_cursor
+from leads_api.prerendered import PrerenderedResponse, get_prerendered, is_prerendered
+from leads_api.resilience import read_prerendered
 
 
 @view_config(
@@ -20,55 +18,93 @@ from leads_api.models.leads import (
 )
 def coverage_get(request: Request):
     """Gets the dealers coverage for a specific buyer, make within a zipcode"""
+    return coverage(request, request.openapi_validated.parameters.path['buyer_tier_slug'])
+
+
+@view_config(
+    route_name='v1_legacy_buyers_tiers_makes_coverage',
+    openapi=True,
+    renderer='json',
+)
+def coverage_legacy_get(request: Request):
+    """Same as `coverage_get`, for a tier identified by its legacy id"""
+    legacy_id = request.openapi_validated.parameters.path['legacy_id']
+    # Resolved from the catalogue, without querying the `legacy_buyer_tier` table
+    buyer_tier = get_catalogue(request).legacy_tiers.get(legacy_id)
+    if buyer_tier is None:
+        return exception_response(404, json_body=[{
+            'exception': 'UnknownLegacyBuyerTier',
+            'message': f'Unknown legacy buyer tier {legacy_id}',
+        }])
+    return coverage(request, buyer_tier)
+
+
+def coverage(request: Request, buyer_tier: str):
+    """Looks up the dealers coverage of a buyer tier for the make and zipcode of
+    the request"""
     # Get requests params
     params = request.openapi_validated.parameters
     limit = params.query.get('limit', 3)
-    buyer_tier = params.path['buyer_tier_slug']
     make = params.path['make_slug']
     zipcode = params.query['zipcode']
+    year = params.query.get('year')
+    model = params.query.get('model')
+    cursor = params.query.get('cursor')
 
-    # Prepare the query
-    query = (
-        request.dbsession.query(
-            Buyer.name.label('buyer'),
-            BuyerTier.name.label('buyer_tier'),
-            Make.name.label('make'),
-            #Year.name.label('year'),
-            BuyerDealer.code.label('dealer_code'),
-            BuyerDealer.name.label('dealer_name'),
-            BuyerDealer.address.label('dealer_address'),
-            BuyerDealer.city.label('dealer_city'),
-            BuyerDealer.state.label('dealer_state'),
-            BuyerDealer.zipcode.label('dealer_zipcode'),
-            BuyerDealer.phone.label('dealer_phone'),
-            BuyerTierDealerCoverage.distance.label('distance'),
-            BuyerTierDealerCoverage.zipcode.label('zipcode'),
-        )
-        .filter(
-            # Joins
-            BuyerTier.slug == BuyerTierMake.tier_slug,
-            BuyerTier.buyer_slug == Buyer.slug,
-            BuyerDealer.buyer_slug == Buyer.slug,
-            BuyerTierMake.make_slug == Make.slug,
-            #BuyerTierMakeYear.make_slug == Make.slug, # Enable this to add year filtering
-            #BuyerTierMakeYear.year_slug == Year.slug, # Enable this to add year filtering
-            BuyerTierDealerCoverage.buyer_tier_slug == BuyerTier.slug,
-            # Filters
-            BuyerTierMake.make_slug == make,
-            BuyerTierMake.tier_slug == buyer_tier,
-            BuyerTierDealerCoverage.zipcode == zipcode,
+    # Next pages start after the last row of the previous one
+    after = None
+    if cursor is not None:
+        try:
+            after = decode_cursor(cursor)
+        except InvalidCursor as error:
+            return exception_response(400, json_body=[{
+                'exception': 'InvalidCursor',
+                'message': str(error),
+            }])
+
+    # Resolve the dealers that sell the make (and the year and model, if requested)
+    # for this tier. If the tier itself doesn't accept the request, or the coverage
+    # filter knows for sure there's no coverage for the tier in the zipcode, there's
+    # nothing to look up
+    dealers = get_catalogue(request).eligible_dealers(
+        buyer_tier, make, year=year, model=model,
+    )
+    if not dealers or not might_have_coverage(request, buyer_tier, zipcode):
+        return coverage_data([])
+
+    # The most common requests may have their response already rendered. They're
+    # read from the database through the circuit breaker, which serves the last
+    # one read while the database is unavailable
+    if (
+        cursor is None
+        and request.registry.get('prerendered')
+        and is_prerendered(limit, year=year, model=model)
+    ):
+        data = read_prerendered(
+            request,
+            (buyer_tier, make, zipcode),
+            lambda: get_prerendered(request, buyer_tier, make, zipcode),
         )
-        # Order result by distance ascending (we want the closer dealers)
-        .order_by(BuyerTierDealerCoverage.distance)
-        # Return only a limited amount of dealers. Initially, this number will be provided
-        # by the client but later we could handle all the buyers configurations
-        # and store this number in the database
-        .limit(limit)
+        if data is not None:
+            return PrerenderedResponse(data)
+
+    # Fetch the rows with the configured coverage engine
+    # An extra row tells whether there's a next page
+    engine = request.registry['coverage_engine']
+    rows = engine.lookup(
+        request, buyer_tier, make, zipcode, limit + 1, dealers=dealers, after=after,
     )
 
-    # Fetch all rows
-    rows = query.all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['distance'], rows[-1]['dealer_code'])
+    return coverage_data(rows, next_cursor)
+
 
+def coverage_data(rows: List[Dict], next_cursor: Optional[str] = None) -> Dict:
+    """Builds the `data` of a coverage response from the looked up rows, and the
+    cursor of the next page if there's one"""
     # Parse results into the expected dict format:
     # {
     #   'status': status,
@@ -79,19 +115,19 @@ def coverage_get(request: Request):
     #     'coverage': [
     #        { dealer 1 info + coverage },
     #        { dealer 2 info + coverage },
-    #     ]
+    #     ],
+    #     'next_cursor': cursor of the next page or None,
     #   ],
     #   'metadata': request metadata,
     # }
     data = {}
     if len(rows) > 0:
         data['has_coverage'] = True
-        row = rows[0]._asdict()
+        row = rows[0]
         data['buyer'] = row['buyer']
         data['buyer_tier'] = row['buyer_tier']
         data['coverage'] = []
         for row in rows:
-            row = row._asdict()
             coverage = {
                 'dealer_code': row['dealer_code'],
                 'dealer_name': row['dealer_name'],
@@ -106,6 +142,7 @@ def coverage_get(request: Request):
                 #'year': row['year'],
             }
             data['coverage'].append(coverage)
+        data['next_cursor'] = next_cursor
     else:
         data['has_coverage'] = False
 
@@ -0,0 +1,143 @@
+import csv
+import io
+import json
+import zlib
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from pyramid.httpexceptions import exception_response
+from pyramid.request import Request
+from pyramid.response import Response
+from pyramid.view import view_config
+from sqlalchemy import select
+
+from leads_api.models.tables import buyer_dealer, buyer_tier, buyer_tier_dealer_coverage, zipcode
+from leads_api.timeouts import set_statement_timeout, statement_timeout
+from leads_api.tweens import negotiate_encoding
+
+EXPORT_COLUMNS = ('zipcode', 'dealer_code', 'distance')
+
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def ndjson_chunk(rows: List[Tuple]) -> bytes:
+    return ''.join(
+        json.dumps(dict(zip(EXPORT_COLUMNS, row)), separators=(',', ':')) + '\n' for row in rows
+    ).encode()
+
+
+def csv_chunk(rows: List[Tuple]) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue().encode()
+
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """Compresses a stream of chunks as a single gzip member, flushing after every
+    chunk so the client receives data as it's produced"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_chunks(
+    engine,
+    tier_id: int,
+    buyer_slug: str,
+    encode: Callable[[List[Tuple]], bytes],
+    header: bytes = b'',
+    batch_size: int = 10000,
+    timeout: Optional[int] = None,
+) -> Iterator[bytes]:
+    """Streams the (zipcode, dealer code, distance) coverage rows of a tier,
+    encoded in chunks of `batch_size` rows.
+
+    The rows are read with a server-side cursor, in the order of the primary key
+    so no sort is needed, and without joins: the zipcodes and the dealers of the
+    buyer are resolved from dictionaries, which are much smaller than the
+    coverage. The connection is held until the stream is finished or closed, and
+    its statements are cancelled after `timeout` milliseconds if given.
+    """
+    with engine.connect() as connection, connection.begin():
+        set_statement_timeout(connection, timeout)
+        zipcodes: Dict[int, str] = dict(connection.execute(select(zipcode.c.id, zipcode.c.code)))
+        dealers: Dict[int, str] = dict(connection.execute(
+            select(buyer_dealer.c.id, buyer_dealer.c.code)
+            .where(buyer_dealer.c.buyer_slug == buyer_slug)
+        ))
+        result = connection.execution_options(stream_results=True, yield_per=batch_size).execute(
+            select(
+                buyer_tier_dealer_coverage.c.zipcode_id,
+                buyer_tier_dealer_coverage.c.dealer_id,
+                buyer_tier_dealer_coverage.c.distance,
+            )
+            .where(buyer_tier_dealer_coverage.c.buyer_tier_id == tier_id)
+            .order_by(buyer_tier_dealer_coverage.c.zipcode_id, buyer_tier_dealer_coverage.c.dealer_id)
+        )
+        if header:
+            yield header
+        for partition in result.partitions():
+            rows = [
+                (zipcodes.get(zipcode_id), dealers[dealer_id], distance)
+                for zipcode_id, dealer_id, distance in partition
+                # Rows of dealers of other buyers aren't served by the coverage route either
+                if dealer_id in dealers
+            ]
+            if rows:
+                yield encode(rows)
+
+
+@view_config(
+    route_name='v1_buyers_tiers_coverage_export',
+    openapi=True,
+)
+def coverage_export(request: Request):
+    """Streams the whole coverage of a buyer tier as NDJSON or CSV"""
+    params = request.openapi_validated.parameters
+    buyer_tier_slug = params.path['buyer_tier_slug']
+    fmt = params.query.get('format', 'ndjson')
+
+    # The body is streamed, it can't be validated without reading it whole
+    request.environ['pyramid_openapi3.validate_response'] = False
+
+    settings = request.registry.settings
+    engine = request.registry['dbengine']
+    timeout = statement_timeout(request)
+    with engine.connect() as connection, connection.begin():
+        set_statement_timeout(connection, timeout)
+        tier = connection.execute(
+            select(buyer_tier.c.id, buyer_tier.c.buyer_slug)
+            .where(buyer_tier.c.slug == buyer_tier_slug)
+        ).first()
+    if tier is None:
+        return exception_response(404, json_body=[{
+            'exception': 'UnknownBuyerTier',
+            'message': f'Unknown buyer tier {buyer_tier_slug}',
+        }])
+
+    if fmt == 'csv':
+        encode, header = csv_chunk, csv_chunk([EXPORT_COLUMNS])
+    else:
+        encode, header = ndjson_chunk, b''
+    chunks = export_chunks(
+        engine, tier.id, tier.buyer_slug, encode,
+        header=header,
+        batch_size=int(settings.get('export.batch_size', 10000)),
+        timeout=timeout,
+    )
+
+    response = Response(
+        content_type=CONTENT_TYPES[fmt],
+        content_disposition=f'attachment; filename="{buyer_tier_slug}-coverage.{fmt}"',
+        vary='Accept-Encoding',
+    )
+    if negotiate_encoding(request, ['gzip']) is not None:
+        chunks = gzip_chunks(chunks, level=int(settings.get('compression.gzip_level', 6)))
+        response.content_encoding = 'gzip'
+    response.app_iter = chunks
+    return response
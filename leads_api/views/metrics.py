@@ -0,0 +1,15 @@
+from pyramid.request import Request
+from pyramid.response import Response
+from pyramid.view import view_config
+
+from leads_api.metrics import get_metrics
+
+
+@view_config(route_name='metrics')
+def metrics_get(request: Request):
+    """Exposes the process metrics in the Prometheus text format"""
+    lines = [
+        f"leads_api_{name.replace('.', '_')} {value}"
+        for name, value in sorted(get_metrics(request).snapshot().items())
+    ]
+    return Response('\n'.join(lines) + '\n', content_type='text/plain')
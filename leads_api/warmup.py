@@ -0,0 +1,146 @@
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import List, Tuple
+from urllib.parse import quote, urlencode
+
+from pyramid.request import Request
+from pyramid.router import Router
+from pyramid.settings import asbool
+
+from leads_api.engines import EngineRequest
+from leads_api.prefork import add_worker_hook
+
+logger = logging.getLogger(__name__)
+
+COVERAGE_PATH = '/v1/buyers_tiers/{tier}/makes/{make}/coverage'
+
+
+def read_hot_keys(path: Path) -> List[Tuple[str, str, str]]:
+    """Reads the (tier, make, zipcode) keys to warm up, one per line separated by
+    whitespace. Empty lines and lines starting with `#` are skipped."""
+    keys = []
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                tier, make, zipcode = line.split()
+                keys.append((tier, make, zipcode))
+    return keys
+
+
+def open_connections(engine, count: int):
+    """Opens `count` pool connections at once, so they're all ready to be reused"""
+    connections = []
+    try:
+        for _ in range(count):
+            connection = engine.connect()
+            connections.append(connection)
+            connection.exec_driver_sql('SELECT 1')
+    finally:
+        for connection in connections:
+            connection.close()
+
+
+def pool_size(engine) -> int:
+    """Connections kept open by the pool of the engine, 0 for the pools that
+    don't keep any, such as `NullPool`"""
+    size = getattr(engine.pool, 'size', None)
+    return size() if size is not None else 0
+
+
+def compile_coverage_statement(registry, key: Tuple[str, str, str]):
+    """Looks up the coverage engine once, with the same kind of parameters as the
+    view, so the statement is compiled and cached before the first request"""
+    dbsession = registry['dbsession_factory']()
+    try:
+        tier, make, zipcode = key
+        registry['coverage_engine'].lookup(
+            EngineRequest(registry, dbsession), tier, make, zipcode, 3, dealers=frozenset(),
+        )
+        dbsession.rollback()
+    finally:
+        dbsession.close()
+
+
+def warm_up(app: Router) -> bool:
+    """Gets a worker ready before it accepts requests: opens the pool connections,
+    compiles the coverage statement and requests the hot keys.
+
+    The hot keys go through the whole application, so they also prime the
+    catalogue, the OpenAPI validators and the caches of the coverage engine.
+    The worker is only marked as warmed up, see the readiness probe, if it
+    succeeds and every hot key is answered with a status below 400. Errors are
+    logged, and the worker still serves requests.
+
+    Returns:
+    --------
+    True if the worker warmed up.
+    """
+    registry = app.registry
+    settings = registry.settings
+    start = time.perf_counter()
+    engine = registry['dbengine']
+    keys, failed = [], []
+    try:
+        open_connections(engine, int(settings.get('warmup.connections', pool_size(engine))))
+        if settings.get('warmup.keys_file'):
+            keys = read_hot_keys(Path(settings['warmup.keys_file']))
+        compile_coverage_statement(registry, keys[0] if keys else ('-', '-', '-'))
+        for tier, make, zipcode in keys:
+            request = Request.blank(
+                COVERAGE_PATH.format(tier=quote(tier), make=quote(make))
+                + '?' + urlencode({'zipcode': zipcode})
+            )
+            response = request.get_response(app)
+            if response.status_code >= 400:
+                failed.append(f'{tier} {make} {zipcode} ({response.status})')
+    except Exception:
+        logger.exception('Warm-up failed, the worker is not ready yet')
+        registry['metrics'].incr('warmup.failures')
+        return False
+    if failed:
+        logger.error('Warm-up failed, the worker is not ready yet. Hot keys answered '
+                     'with errors: %s', ', '.join(failed))
+        registry['metrics'].incr('warmup.failures')
+        return False
+    registry['warmed_up'] = True
+
+    seconds = time.perf_counter() - start
+    registry['metrics'].set('warmup.seconds', seconds)
+    logger.info('Warmed up with %s hot keys in %.3fs', len(keys), seconds)
+    return True
+
+
+def warm_up_worker(app: Router):
+    """Warms a worker up, retrying every ``warmup.retry_interval`` seconds in the
+    background until it succeeds, so a database unavailable when the worker
+    starts doesn't keep it out of the load balancer for good"""
+    if warm_up(app):
+        return
+    interval = float(app.registry.settings.get('warmup.retry_interval', 5))
+
+    def retry():
+        while True:
+            time.sleep(interval)
+            if warm_up(app):
+                return
+    threading.Thread(target=retry, name='warmup-retry', daemon=True).start()
+
+
+def includeme(config):
+    """
+    Warm every worker up before it accepts requests, enabled with
+    ``warmup.enabled = true``.
+
+    - ``warmup.connections``: Pool connections to open, by default the pool size.
+    - ``warmup.keys_file``: File with the hot (tier, make, zipcode) keys to request.
+    - ``warmup.retry_interval``: Seconds between the attempts of a failed warm-up.
+
+    Activate this setup using ``config.include('leads_api.warmup')``.
+
+    """
+    settings = config.get_settings()
+    if asbool(settings.get('warmup.enabled', False)):
+        add_worker_hook(config, warm_up_worker)
@@ -0,0 +1,773 @@
+"""
+Reloads whole tables without blocking the API.
+
+The data is COPYed into an unlogged shadow table built from the table metadata,
+then the primary key, unique and foreign key constraints and indexes are built,
+the table is analyzed and, once everything is ready, the shadow table takes the
+place of the live one with a couple of renames inside a short transaction.
+Readers always see either the old or the new table, complete and with fresh
+statistics.
+
+    python reload_tables.py development.ini buyer_tier_dealer_coverage=coverage.tsv
+
+Partitioned tables are reloaded by partition instead: a shadow table is built
+for every tier in the file (or only the ones given with `--tier`) and swapped
+in with DETACH/ATTACH PARTITION, so the other tiers are not touched. The rows
+of a tier getting its first partition are moved out of the default partition by
+the swap itself, so the tier never has missing coverage.
+
+    python reload_tables.py development.ini buyer_tier_dealer_coverage=tier.tsv \\
+        --tier buyer-1-blind
+
+Data files use the PostgreSQL COPY `text` format by default (tab separated),
+use `--format csv` for CSV files. Coverage files use the tier slugs, dealer
+codes and zipcodes, which are translated to the integer ids stored in the table.
+"""
+import sys
+import time
+import argparse
+import hashlib
+import logging
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from pyramid.paster import get_appsettings
+from sqlalchemy import (
+    Column,
+    ForeignKeyConstraint,
+    Index,
+    Integer,
+    MetaData,
+    PrimaryKeyConstraint,
+    String,
+    Table,
+    UniqueConstraint,
+    select,
+    text,
+)
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.schema import AddConstraint, CreateIndex, CreateTable
+from sqlalchemy.sql.util import find_tables
+
+from leads_api.data_version import bump_sql
+from leads_api.models import get_engine
+from leads_api.models.tables import (
+    buyer_dealer,
+    buyer_tier,
+    buyer_tier_dealer_coverage,
+    materialized_views,
+    metadata,
+    refresh_views_sql,
+    zipcode,
+)
+
+logger = logging.getLogger(__name__)
+
+SHADOW_SUFFIX = '_shadow'
+OLD_SUFFIX = '_old'
+SOURCE_SUFFIX = '_source'
+
+
+def referenced_tables() -> set:
+    """Names of the tables referenced by a foreign key. These can't be swapped,
+    the foreign keys would keep pointing to the old table."""
+    return {
+        fk.column.table.name
+        for table in metadata.sorted_tables
+        for fk in table.foreign_keys
+    }
+
+
+def view_tables() -> set:
+    """Names of the tables used by a materialized view. These can't be swapped
+    either, the views would keep reading the old table. Partitioned tables can,
+    their partitions are swapped instead."""
+    return {
+        table.name
+        for view in materialized_views
+        for table in find_tables(view.info['query'])
+    }
+
+
+def shadow_table(table: Table, suffix: str = SHADOW_SUFFIX) -> Table:
+    """Creates an unlogged copy of a table, with the same columns but without
+    constraints nor indexes, so they are built once after loading the data."""
+    return Table(
+        table.name + suffix,
+        MetaData(schema=table.schema),
+        *[Column(column.name, column.type, nullable=column.nullable) for column in table.columns],
+        prefixes=['UNLOGGED'],
+    )
+
+
+def source_table(table: Table) -> Optional[Table]:
+    """Unlogged table with the columns of the data files of a table that stores
+    integer ids instead of the public slugs, or None if they are the same.
+
+    The coverage files use the tier slugs, dealer codes and zipcodes, which are
+    translated to their ids while filling the shadow table.
+    """
+    if table.name != buyer_tier_dealer_coverage.name:
+        return None
+    return Table(
+        table.name + SOURCE_SUFFIX,
+        MetaData(schema=table.schema),
+        Column('buyer_tier_slug', String(50)),
+        Column('dealer_code', String(50)),
+        Column('zipcode', String(255)),
+        Column('distance', Integer),
+        prefixes=['UNLOGGED'],
+    )
+
+
+def zipcodes_statement(source: Table) -> str:
+    """Statement giving ids to the new zipcodes of a coverage source table"""
+    return (
+        f'INSERT INTO {zipcode.fullname} (code) '
+        f'SELECT DISTINCT zipcode FROM {source.fullname} '
+        f'ON CONFLICT (code) DO NOTHING'
+    )
+
+
+def encode_statement(source: Table, shadow: Table, tier_id: int = None) -> str:
+    """Statement to fill the coverage shadow table from its source table, with
+    only the rows of a tier if given.
+
+    Rows are inserted sorted by (tier, zipcode, distance), so the rows of a lookup
+    end up together in the same pages, in the order they are returned.
+    """
+    where = '' if tier_id is None else f'WHERE t.id = {int(tier_id)} '
+    return (
+        f'INSERT INTO {shadow.fullname} (buyer_tier_id, zipcode_id, dealer_id, distance) '
+        f'SELECT t.id, z.id, d.id, s.distance '
+        f'FROM {source.fullname} AS s '
+        f'JOIN {buyer_tier.fullname} AS t ON t.slug = s.buyer_tier_slug '
+        f'JOIN {buyer_dealer.fullname} AS d '
+        f'ON d.buyer_slug = t.buyer_slug AND d.code = s.dealer_code '
+        f'JOIN {zipcode.fullname} AS z ON z.code = s.zipcode '
+        f'{where}'
+        f'ORDER BY t.id, z.id, s.distance'
+    )
+
+
+def partition_column(table: Table) -> Optional[str]:
+    """Column a table is partitioned by, e.g. `buyer_tier_id` for
+    `LIST (buyer_tier_id)`, or None if it's not partitioned"""
+    partition_by = table.dialect_options['postgresql']['partition_by']
+    if not partition_by:
+        return None
+    return partition_by.split('(', 1)[1].rstrip(' )')
+
+
+def partition_table(table: Table, key: int) -> Table:
+    """Partition of `table` holding the rows with `key`, with the same columns,
+    primary key and indexes"""
+    partition = Table(
+        f'{table.name}_{key}',
+        MetaData(schema=table.schema),
+        *[
+            Column(column.name, column.type, nullable=column.nullable,
+                   primary_key=column.primary_key)
+            for column in table.columns
+        ],
+    )
+    for index in table.indexes:
+        Index(
+            f'{index.name}_{key}',
+            *[partition.c[column.name] for column in index.columns],
+            unique=index.unique,
+        )
+    return partition
+
+
+def default_partition_name(table: Table) -> str:
+    """Qualified name of the default partition, see `leads_api.models.tables`"""
+    return f'{table.fullname}_default'
+
+
+def bound_name(shadow: Table) -> str:
+    return f'{shadow.name}_bound'
+
+
+def default_bound_name(table: Table, key: int) -> str:
+    """Name of the CHECK constraint keeping the rows with `key` out of the
+    default partition"""
+    return f'{table.name}_default_not_{key}'
+
+
+def pkey_name(table_name: str) -> str:
+    """Default PostgreSQL name of the primary key constraint"""
+    return f'{table_name}_pkey'
+
+
+# PostgreSQL identifiers are truncated to NAMEDATALEN - 1 bytes
+MAX_IDENTIFIER_LENGTH = 63
+
+# Unique and foreign key constraints of a table, with their columns in order and
+# the table they refer to
+CONSTRAINTS_QUERY = """
+SELECT c.conname, c.contype, r.relname AS referred,
+       ARRAY(
+           SELECT a.attname
+           FROM unnest(c.conkey) WITH ORDINALITY AS k(attnum, position)
+           JOIN pg_attribute AS a ON a.attrelid = c.conrelid AND a.attnum = k.attnum
+           ORDER BY k.position
+       ) AS columns
+FROM pg_constraint AS c
+LEFT JOIN pg_class AS r ON r.oid = c.confrelid
+WHERE c.conrelid = CAST(:name AS regclass) AND c.contype IN ('u', 'f')
+"""
+
+
+def table_constraints(table: Table) -> list:
+    """Unique and foreign key constraints of a table, in a stable order"""
+    constraints = [
+        constraint for constraint in table.constraints
+        if isinstance(constraint, (UniqueConstraint, ForeignKeyConstraint))
+    ]
+    return sorted(constraints, key=constraint_key)
+
+
+def unsupported_constraints(table: Table) -> list:
+    """Constraints of a table that can't be rebuilt on its shadow, so the table
+    can't be swapped"""
+    return [
+        constraint for constraint in table.constraints
+        if not isinstance(
+            constraint, (PrimaryKeyConstraint, UniqueConstraint, ForeignKeyConstraint)
+        )
+    ]
+
+
+def constraint_key(constraint) -> Tuple:
+    """(type, columns, referred table) identifying a constraint of a table, the
+    same as the rows of `CONSTRAINTS_QUERY`"""
+    columns = tuple(column.name for column in constraint.columns)
+    if isinstance(constraint, ForeignKeyConstraint):
+        return ('f', columns, constraint.referred_table.name)
+    return ('u', columns, None)
+
+
+def live_constraint_names(connection, table: Table) -> Dict:
+    """Names of the unique and foreign key constraints of a table in the database.
+
+    They were chosen by PostgreSQL, which shortens and numbers them when needed,
+    so they're read rather than guessed.
+
+    Raises:
+    -------
+    ValueError: If the constraints in the database aren't the ones of the table
+        metadata, the shadow couldn't be built the same.
+    """
+    live = {
+        (row.contype, tuple(row.columns), row.referred): row.conname
+        for row in connection.execute(text(CONSTRAINTS_QUERY), {'name': table.fullname})
+    }
+    names = {}
+    for constraint in table_constraints(table):
+        name = live.pop(constraint_key(constraint), None)
+        if name is None:
+            raise ValueError(f'Table `{table.name}` is missing a constraint on {constraint_key(constraint)}')
+        names[constraint] = name
+    if live:
+        raise ValueError(f'Table `{table.name}` has unknown constraints {sorted(live.values())}')
+    return names
+
+
+def suffixed_name(name: str, suffix: str) -> str:
+    """Name of a constraint of a renamed table, kept short enough to not be
+    truncated by PostgreSQL"""
+    if len(name) + len(suffix) <= MAX_IDENTIFIER_LENGTH:
+        return name + suffix
+    digest = hashlib.md5(name.encode()).hexdigest()[:8]
+    return f'{name[:MAX_IDENTIFIER_LENGTH - len(suffix) - 9]}_{digest}{suffix}'
+
+
+def shadow_constraint(constraint, shadow: Table, name: str):
+    """Copy of a unique or foreign key constraint of a table for its shadow"""
+    columns = [shadow.c[column.name] for column in constraint.columns]
+    if isinstance(constraint, UniqueConstraint):
+        return UniqueConstraint(*columns, name=name)
+    return ForeignKeyConstraint(
+        columns,
+        [element.column for element in constraint.elements],
+        name=name,
+        onupdate=constraint.onupdate,
+        ondelete=constraint.ondelete,
+        deferrable=constraint.deferrable,
+        initially=constraint.initially,
+        match=constraint.match,
+    )
+
+
+def index_statements(table: Table, shadow: Table, names: Dict = None) -> List[str]:
+    """Statements to build the primary key, the unique and foreign key
+    constraints and the indexes of the table on its shadow. The constraints get
+    the `names` of the table ones, see `live_constraint_names`, with the suffix
+    of the shadow."""
+    names = names or {}
+    suffix = shadow.name[len(table.name):]
+    pk_columns = ', '.join(column.name for column in table.primary_key.columns)
+    statements = [
+        f'ALTER TABLE {shadow.fullname} '
+        f'ADD CONSTRAINT {pkey_name(shadow.name)} PRIMARY KEY ({pk_columns})'
+    ]
+    # The constraints are built on a copy of the shadow, so the shadow itself
+    # stays without constraints
+    shadow_copy = shadow_table(table, suffix)
+    for constraint in table_constraints(table):
+        name = suffixed_name(names[constraint], suffix)
+        statements.append(str(
+            AddConstraint(shadow_constraint(constraint, shadow_copy, name))
+            .compile(dialect=postgresql.dialect())
+        ))
+    for index in sorted(table.indexes, key=lambda index: index.name):
+        shadow_index = Index(
+            index.name + SHADOW_SUFFIX,
+            *[shadow.c[column.name] for column in index.columns],
+            unique=index.unique,
+        )
+        statements.append(str(CreateIndex(shadow_index).compile(dialect=postgresql.dialect())))
+    return statements
+
+
+def old_table_name(table: Table) -> str:
+    """Qualified name of the table once it's been replaced by its shadow"""
+    schema = f'{table.schema}.' if table.schema else ''
+    return f'{schema}{table.name}{OLD_SUFFIX}'
+
+
+def rename_statements(
+    table: Table,
+    from_suffix: str,
+    to_suffix: str,
+    names: Dict = None,
+) -> List[str]:
+    """Statements to rename a table, its constraints and indexes from their names
+    with `from_suffix` to their names with `to_suffix`"""
+    names = names or {}
+    schema = f'{table.schema}.' if table.schema else ''
+    statements = [
+        f'ALTER TABLE {schema}{table.name}{from_suffix} RENAME TO {table.name}{to_suffix}',
+        f'ALTER TABLE {schema}{table.name}{to_suffix} RENAME CONSTRAINT '
+        f'{pkey_name(table.name + from_suffix)} TO {pkey_name(table.name + to_suffix)}',
+    ]
+    for constraint in table_constraints(table):
+        statements.append(
+            f'ALTER TABLE {schema}{table.name}{to_suffix} RENAME CONSTRAINT '
+            f'{suffixed_name(names[constraint], from_suffix)} '
+            f'TO {suffixed_name(names[constraint], to_suffix)}'
+        )
+    for index in sorted(table.indexes, key=lambda index: index.name):
+        statements.append(
+            f'ALTER INDEX {schema}{index.name}{from_suffix} RENAME TO {index.name}{to_suffix}'
+        )
+    return statements
+
+
+def swap_statements(table: Table, shadow: Table, names: Dict = None) -> List[str]:
+    """Statements to replace a table with its shadow. They only rename objects, so
+    they are fast, but they need an exclusive lock on both tables."""
+    return [
+        f'LOCK TABLE {table.fullname}, {shadow.fullname} IN ACCESS EXCLUSIVE MODE',
+        *rename_statements(table, '', OLD_SUFFIX, names),
+        *rename_statements(table, SHADOW_SUFFIX, '', names),
+    ]
+
+
+def default_partition_statements(table: Table, key: int, default: str) -> List[List[str]]:
+    """Transactions proving the default partition has no rows with `key` before
+    their own partition is attached.
+
+    ATTACH PARTITION scans the default partition for rows of the new partition
+    under an exclusive lock, unless a valid CHECK constraint proves there are
+    none. The constraint is added NOT VALID in a short first transaction, then
+    validated without blocking the readers. Only used when the default partition
+    has no rows with `key`, otherwise the validation fails and the rows are
+    deleted by the swap itself, see `partition_swap_statements`.
+    """
+    column = partition_column(table)
+    name = default_bound_name(table, key)
+    return [
+        [
+            f'ALTER TABLE {default} DROP CONSTRAINT IF EXISTS {name}',
+            f'ALTER TABLE {default} ADD CONSTRAINT {name} CHECK ({column} <> {key}) NOT VALID',
+        ],
+        [f'ALTER TABLE {default} VALIDATE CONSTRAINT {name}'],
+    ]
+
+
+def restore_default_statements(table: Table, key: int, default: str) -> List[str]:
+    """Statements undoing `default_partition_statements` if the swap fails. The
+    rows of the default partition are only deleted inside the swap, so they're
+    left as they were"""
+    return [
+        f'ALTER TABLE {default} DROP CONSTRAINT IF EXISTS {default_bound_name(table, key)}'
+    ]
+
+
+def partition_swap_statements(
+    table: Table,
+    partition: Table,
+    shadow: Table,
+    key: int,
+    exists: bool,
+    default: Optional[str],
+    in_default: bool = False,
+) -> List[str]:
+    """Statements to replace a partition with its shadow, or to attach the shadow
+    as a new partition if it doesn't exist yet.
+
+    The shadow has a CHECK constraint matching the partition bound, so attaching
+    it doesn't scan it. The default partition, if any, has one excluding it, see
+    `default_partition_statements`, unless it still has rows with `key`
+    (`in_default`): those are deleted in the swap, so readers keep seeing them
+    until it commits, and ATTACH has to scan the default partition under the
+    lock. That only happens once per tier, when it gets its first partition. The
+    shadow already has the indexes of the partitioned table, they're attached as
+    they are.
+    """
+    statements = [f'LOCK TABLE {table.fullname}, {shadow.fullname} IN ACCESS EXCLUSIVE MODE']
+    if default is not None and in_default:
+        statements.append(f'DELETE FROM {default} WHERE {partition_column(table)} = {key}')
+    if exists:
+        statements.append(f'ALTER TABLE {table.fullname} DETACH PARTITION {partition.fullname}')
+        statements += rename_statements(partition, '', OLD_SUFFIX)
+    statements += rename_statements(partition, SHADOW_SUFFIX, '')
+    statements += [
+        f'ALTER TABLE {table.fullname} ATTACH PARTITION {partition.fullname} FOR VALUES IN ({key})',
+        f'ALTER TABLE {partition.fullname} DROP CONSTRAINT {bound_name(shadow)}',
+    ]
+    if default is not None and not in_default:
+        statements.append(
+            f'ALTER TABLE {default} DROP CONSTRAINT {default_bound_name(table, key)}'
+        )
+    return statements
+
+
+class Swap(NamedTuple):
+    """Replacement of a table, or partition, by its shadow"""
+    # Statements of the swap, run with the other swaps in a single transaction
+    statements: List[str]
+    # Qualified name of the replaced table to drop, if any
+    old_name: Optional[str]
+    # Transactions preparing the swap, and statements undoing them if it fails
+    prepare: List[List[str]] = []
+    restore: List[str] = []
+
+
+@contextmanager
+def timed(timings: Dict, name: str):
+    """Measures the time spent inside the block and stores it in `timings`"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0) + time.perf_counter() - start
+
+
+def create_tables(engine, *tables: Table):
+    with engine.begin() as connection:
+        for table in tables:
+            connection.execute(text(f'DROP TABLE IF EXISTS {table.fullname}'))
+            connection.execute(CreateTable(table))
+
+
+def copy_file(engine, target: Table, path: Path, fmt: str):
+    columns = ', '.join(column.name for column in target.columns)
+    raw_connection = engine.raw_connection()
+    try:
+        with raw_connection.cursor() as cursor, open(path, 'r') as f:
+            cursor.copy_expert(
+                f'COPY {target.fullname} ({columns}) FROM STDIN WITH (FORMAT {fmt})', f
+            )
+        raw_connection.commit()
+    finally:
+        raw_connection.close()
+
+
+def prepare_shadow(
+    engine,
+    table: Table,
+    shadow: Table,
+    timings: Dict,
+    step: str,
+    names: Dict = None,
+):
+    """Builds the constraints and indexes of a loaded shadow table, and makes it
+    ready to be swapped"""
+    with engine.begin() as connection:
+        with timed(timings, f'{step}.indexes'):
+            for statement in index_statements(table, shadow, names):
+                connection.execute(text(statement))
+        # The table has to be logged before it goes live, or it would be truncated
+        # after a crash and wouldn't be replicated
+        with timed(timings, f'{step}.set_logged'):
+            connection.execute(text(f'ALTER TABLE {shadow.fullname} SET LOGGED'))
+
+    # ANALYZE runs outside of the transaction so the statistics are ready
+    # before the swap and the first queries get good plans
+    with timed(timings, f'{step}.analyze'):
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            connection.execute(text(f'ANALYZE {shadow.fullname}'))
+
+
+def load_shadow(
+    engine,
+    table: Table,
+    path: Path,
+    fmt: str,
+    timings: Dict,
+    names: Dict = None,
+) -> Table:
+    """Creates the shadow table, loads the data and makes it ready to be swapped"""
+    shadow = shadow_table(table)
+    # The data is COPYed straight into the shadow table, unless it needs to be encoded
+    source = source_table(table)
+    create_tables(engine, *([shadow] if source is None else [shadow, source]))
+
+    with timed(timings, f'{table.name}.copy'):
+        copy_file(engine, shadow if source is None else source, path, fmt)
+
+    if source is not None:
+        with timed(timings, f'{table.name}.encode'):
+            with engine.begin() as connection:
+                connection.execute(text(zipcodes_statement(source)))
+                connection.execute(text(encode_statement(source, shadow)))
+                connection.execute(text(f'DROP TABLE {source.fullname}'))
+
+    prepare_shadow(engine, table, shadow, timings, table.name, names)
+    return shadow
+
+
+def load_partitions(
+    engine,
+    table: Table,
+    path: Path,
+    fmt: str,
+    timings: Dict,
+    tiers: List[str] = None,
+) -> List[Swap]:
+    """Loads the data file of a table partitioned by tier into a shadow table per
+    tier, ready to replace their partitions.
+
+    Returns:
+    --------
+    The swap of each partition.
+    """
+    source = source_table(table)
+    create_tables(engine, source)
+    with timed(timings, f'{table.name}.copy'):
+        copy_file(engine, source, path, fmt)
+
+    with engine.begin() as connection:
+        connection.execute(text(zipcodes_statement(source)))
+        query = select(buyer_tier.c.id).distinct().select_from(
+            source.join(buyer_tier, buyer_tier.c.slug == source.c.buyer_tier_slug)
+        )
+        if tiers:
+            query = query.where(buyer_tier.c.slug.in_(tiers))
+        keys = sorted(connection.execute(query).scalars())
+        default = connection.execute(
+            text('SELECT to_regclass(:name)'), {'name': default_partition_name(table)}
+        ).scalar()
+
+    swaps = []
+    for key in keys:
+        partition = partition_table(table, key)
+        shadow = shadow_table(partition)
+        step = partition.name
+        create_tables(engine, shadow)
+        with timed(timings, f'{step}.encode'):
+            with engine.begin() as connection:
+                connection.execute(text(encode_statement(source, shadow, key)))
+                connection.execute(text(
+                    f'ALTER TABLE {shadow.fullname} ADD CONSTRAINT {bound_name(shadow)} '
+                    f'CHECK ({partition_column(table)} = {key})'
+                ))
+        prepare_shadow(engine, partition, shadow, timings, step)
+
+        with engine.connect() as connection:
+            exists = connection.execute(
+                text('SELECT to_regclass(:name)'), {'name': partition.fullname}
+            ).scalar() is not None
+        default_name = default_partition_name(table) if default is not None else None
+        in_default = False
+        if default_name is not None:
+            with engine.connect() as connection:
+                in_default = connection.execute(text(
+                    f'SELECT EXISTS (SELECT FROM {default_name} '
+                    f'WHERE {partition_column(table)} = {key})'
+                )).scalar()
+        statements = partition_swap_statements(
+            table, partition, shadow, key, exists, default_name, in_default
+        )
+        prepared = default_name is not None and not in_default
+        swaps.append(Swap(
+            statements,
+            old_table_name(partition) if exists else None,
+            prepare=default_partition_statements(table, key, default_name) if prepared else [],
+            restore=restore_default_statements(table, key, default_name) if prepared else [],
+        ))
+
+    with engine.begin() as connection:
+        connection.execute(text(f'DROP TABLE {source.fullname}'))
+    return swaps
+
+
+def run_locked(engine, statements: List[str], lock_timeout: str, attempts: int) -> Tuple[float, int]:
+    """Runs statements in a single transaction waiting at most `lock_timeout` for
+    the locks, so it never queues for long behind a slow reader (and blocks every
+    other reader behind it). If the locks can't be taken, it's retried up to
+    `attempts` times.
+
+    Returns:
+    --------
+    The seconds from the first statement until the commit, and the attempt.
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            with engine.begin() as connection:
+                connection.execute(text(f"SET LOCAL lock_timeout = '{lock_timeout}'"))
+                start = time.perf_counter()
+                for statement in statements:
+                    connection.execute(text(statement))
+            return time.perf_counter() - start, attempt
+        except OperationalError as e:
+            logger.warning('Attempt %s/%s failed: %s', attempt, attempts, e.orig)
+            if attempt == attempts:
+                raise
+            time.sleep(attempt)
+
+
+def swap(engine, statements: List[str], lock_timeout: str, attempts: int, timings: Dict):
+    """Swaps all the tables with their shadows in a single transaction, see
+    `run_locked`"""
+    # The API workers are notified once the new tables are visible
+    seconds, attempt = run_locked(engine, [*statements, bump_sql()], lock_timeout, attempts)
+    # Locks are held since the first LOCK TABLE until the commit
+    timings['swap.lock'] = seconds
+    timings['swap.attempts'] = attempt
+
+
+def main(config_uri: str, sources: List[Tuple[str, Path]], fmt: str = 'text',
+         lock_timeout: str = '2s', attempts: int = 5, tiers: List[str] = None) -> Dict:
+    """Reloads the tables from the data files.
+
+    Args:
+    -----
+    * config_uri (str): The ini file with the database settings.
+    * sources (list): List of (table name, data file path) to reload.
+    * fmt (str): COPY format of the data files, `text` or `csv`.
+    * lock_timeout (str): Max time to wait for the locks needed by the swap.
+    * attempts (int): Max attempts to swap the tables.
+    * tiers (list): Tier slugs to reload on tables partitioned by tier. By default
+        every tier in the data file.
+
+    Returns:
+    --------
+    A dictionary with the seconds spent on each step.
+    """
+    tables = {table.name: table for table in metadata.sorted_tables}
+    referenced = referenced_tables()
+    viewed = view_tables()
+    for name, _ in sources:
+        if name not in tables:
+            raise ValueError(f'Unknown table `{name}`')
+        if partition_column(tables[name]) is not None:
+            continue
+        if name in referenced:
+            raise ValueError(f'Table `{name}` is referenced by foreign keys and cannot be swapped')
+        if name in viewed:
+            raise ValueError(f'Table `{name}` is used by a materialized view and cannot be swapped')
+        if unsupported_constraints(tables[name]):
+            raise ValueError(
+                f'Table `{name}` has constraints that cannot be rebuilt and cannot be swapped'
+            )
+
+    engine = get_engine(get_appsettings(config_uri))
+    timings = {}
+    # Swap statements and old tables to drop
+    swaps = []
+    for name, path in sources:
+        logger.info('Loading `%s` from %s', name, path)
+        table = tables[name]
+        if partition_column(table) is not None:
+            swaps += load_partitions(engine, table, path, fmt, timings, tiers=tiers)
+        else:
+            with engine.connect() as connection:
+                names = live_constraint_names(connection, table)
+            shadow = load_shadow(engine, table, path, fmt, timings, names)
+            swaps.append(Swap(swap_statements(table, shadow, names), old_table_name(table)))
+
+    logger.info('Swapping %s', ', '.join(name for name, _ in sources))
+    try:
+        # Outside of the swap, e.g. the CHECK constraints of the default partition
+        # are validated without locking its readers
+        with timed(timings, 'prepare'):
+            for item in swaps:
+                for statements in item.prepare:
+                    run_locked(engine, statements, lock_timeout, attempts)
+        swap(engine, [statement for item in swaps for statement in item.statements],
+             lock_timeout, attempts, timings)
+    except Exception:
+        logger.error('Swap failed, restoring the prepared tables')
+        restore = [statement for item in swaps for statement in item.restore]
+        if restore:
+            run_locked(engine, restore, lock_timeout, attempts)
+        raise
+
+    # The views are refreshed without blocking their readers, and the API workers
+    # are notified again once they are up to date
+    with timed(timings, 'refresh_views'):
+        with engine.begin() as connection:
+            connection.execute(text(refresh_views_sql()))
+            connection.execute(text(bump_sql()))
+
+    # The old tables are not visible anymore, drop them outside of the swap
+    with timed(timings, 'drop_old'):
+        with engine.begin() as connection:
+            for item in swaps:
+                if item.old_name is not None:
+                    connection.execute(text(f'DROP TABLE IF EXISTS {item.old_name}'))
+    return timings
+
+
+def parse_source(value: str) -> Tuple[str, Path]:
+    name, _, path = value.partition('=')
+    if not path:
+        raise argparse.ArgumentTypeError('Expected TABLE=PATH')
+    return name, Path(path)
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument('config_uri')
+    ap.add_argument('sources', type=parse_source, nargs='+', metavar='TABLE=PATH')
+    ap.add_argument('--format', choices=['text', 'csv'], default='text')
+    ap.add_argument('--lock-timeout', default='2s')
+    ap.add_argument('--attempts', type=int, default=5)
+    ap.add_argument(
+        '--tier', action='append', dest='tiers',
+        help='Only reload the partitions of this tier, can be repeated',
+    )
+    args = ap.parse_args()
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    timings = main(
+        args.config_uri,
+        args.sources,
+        fmt=args.format,
+        lock_timeout=args.lock_timeout,
+        attempts=args.attempts,
+        tiers=args.tiers,
+    )
+
+    # Report how long each step took, most importantly how long the tables were locked
+    for step, value in timings.items():
+        if step == 'swap.attempts':
+            print(f'{step:<40} {value}')
+        else:
+            print(f'{step:<40} {value * 1000:10.1f} ms')
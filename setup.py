@@ -14,7 +14,8 @@ requires = [
     'pyramid',
     'pyramid_jinja2',
     'pyramid_debugtoolbar',
-    'pyramid_openapi3',
+    # `leads_api.openapi` registers the spec the same way as this version
+    'pyramid_openapi3>=0.16,<0.17',
     'pyramid_retry',
     'pyramid_tm',
     'psycopg2',
@@ -30,6 +31,7 @@ tests_require = [
     'pytest',
     'pytest-cov',
     'factory_boy',
+    'numpy',
     'parameterized',
 ]
 
@@ -48,11 +50,15 @@ setup(
     author_email='',
     url='',
     keywords='web pyramid pylons',
-    packages=find_packages(exclude=['tests']),
+    packages=find_packages(exclude=['tests', 'benchmarks']),
     include_package_data=True,
     zip_safe=False,
     extras_require={
         'testing': tests_require,
+        'prefork': ['gunicorn'],
+        'brotli': ['brotli'],
+        # generate_coverage.py
+        'generate': ['numpy'],
     },
     install_requires=requires,
     entry_points={
@@ -15,6 +15,9 @@ from leads_api.models.leads import (
     Make,
     BuyerMake,
     BuyerTierMake,
+    BuyerDealerMake,
+    LegacyBuyerTier,
+    Zipcode,
 )
 
 
@@ -87,18 +90,47 @@ class BuyerTierMakeFactory(factory.alchemy.SQLAlchemyModelFactory):
     make_slug = factory.Iterator(['honda', 'mercedes-benz', 'toyota', 'ford'])
 
 
+class BuyerDealerMakeFactory(factory.alchemy.SQLAlchemyModelFactory):
+    class Meta:
+        model = BuyerDealerMake
+
+    # TODO: use factory.SubFactory
+    buyer_slug = factory.Sequence(lambda n: f'buyer-{n}')
+    dealer_code = factory.Sequence(lambda n: f'dealer-{n}')
+    make_slug = factory.Iterator(['honda', 'mercedes-benz', 'toyota', 'ford'])
+
+
+class ZipcodeFactory(factory.alchemy.SQLAlchemyModelFactory):
+    class Meta:
+        model = Zipcode
+
+    code = factory.Faker('postcode')
+
+
 class BuyerTierDealerCoverageFactory(factory.alchemy.SQLAlchemyModelFactory):
     class Meta:
         model = BuyerTierDealerCoverage
 
     # TODO: use factory.SubFactory
-    buyer_tier_slug = factory.Sequence(lambda n: f'buyer-tier-{n}')
-    dealer_code = factory.Sequence(lambda n: f'dealer-{n}')
+    buyer_tier_id = factory.Sequence(lambda n: n)
+    zipcode_id = factory.Sequence(lambda n: n)
+    dealer_id = factory.Sequence(lambda n: n)
 
-    zipcode = factory.Faker('postcode')
     distance = factory.Faker('random_int', min=1, max=100)
 
 
+class LegacyBuyerTierFactory(factory.alchemy.SQLAlchemyModelFactory):
+    class Meta:
+        model = LegacyBuyerTier
+
+    # TODO: use factory.SubFactory
+    buyer_slug = factory.Sequence(lambda n: f'buyer-{n}')
+    buyer_tier_slug = factory.Sequence(lambda n: f'buyer-tier-{n}')
+
+    legacy_id = factory.Sequence(lambda n: 1000 + n)
+    legacy_name = factory.Sequence(lambda n: f'legacy-tier-{n}')
+
+
 def set_session(dbsession):
     """Associates all the factories models to the current testing db session.
     This way the factories can generate dummy data for testing in the same
@@ -110,6 +142,9 @@ def set_session(dbsession):
         MakeFactory,
         BuyerMakeFactory,
         BuyerTierMakeFactory,
+        BuyerDealerMakeFactory,
+        ZipcodeFactory,
         BuyerTierDealerCoverageFactory,
+        LegacyBuyerTierFactory,
     ]:
         cls._meta.sqlalchemy_session_factory = lambda: dbsession
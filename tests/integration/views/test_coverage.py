@@ -10,11 +10,13 @@ class CoverageGetTests(BaseIntegrationTest):
         from tests.integration.factories import (
             BuyerFactory,
             BuyerDealerFactory,
+            BuyerDealerMakeFactory,
             BuyerMakeFactory,
             MakeFactory,
             BuyerTierFactory,
             BuyerTierDealerCoverageFactory,
             BuyerTierMakeFactory,
+            ZipcodeFactory,
             set_session,
         )
 
@@ -39,10 +41,21 @@ class CoverageGetTests(BaseIntegrationTest):
             tier_slug=self.buyer_tier.slug,
             make_slug=self.make.slug,
         )
+        self.buyer_dealer_make = BuyerDealerMakeFactory(
+            buyer_slug=self.buyer.slug,
+            dealer_code=self.buyer_dealer.code,
+            make_slug=self.make.slug,
+        )
+        self.zipcode = ZipcodeFactory()
+        # Flush to get the ids the coverage refers to
+        self.dbsession.flush()
         self.dealer_coverage = BuyerTierDealerCoverageFactory(
-            buyer_tier_slug=self.buyer_tier.slug,
-            dealer_code=self.buyer_dealer.code
+            buyer_tier_id=self.buyer_tier.id,
+            zipcode_id=self.zipcode.id,
+            dealer_id=self.buyer_dealer.id,
         )
+        # Make the data visible for queries that don't autoflush the session
+        self.dbsession.flush()
 
     def test_ok(self):
         """Test base coverage example"""
@@ -52,7 +65,7 @@ class CoverageGetTests(BaseIntegrationTest):
 
         # Sets requested params
         params = {
-            'zipcode': self.dealer_coverage.zipcode,
+            'zipcode': self.zipcode.code,
         }
 
         # Performs the request for coverage
@@ -90,7 +103,81 @@ class CoverageGetTests(BaseIntegrationTest):
         self.assertEqual(row.get('dealer_zipcode'), self.buyer_dealer.zipcode)
         self.assertEqual(row.get('dealer_phone'), self.buyer_dealer.phone)
         self.assertEqual(row.get('distance'), self.dealer_coverage.distance)
-        self.assertEqual(row.get('zipcode'), self.dealer_coverage.zipcode)
+        self.assertEqual(row.get('zipcode'), self.zipcode.code)
+
+    def test_view_engine(self):
+        """Test the same coverage read from the materialized view"""
+        from sqlalchemy import text
+        from leads_api.engines.view import ViewCoverageEngine
+        from leads_api.models.tables import refresh_views_sql
+
+        self.make_one()
+        self.dbsession.execute(text(refresh_views_sql(concurrently=False)))
+        registry = self.testapp.app.registry
+        engine = registry['coverage_engine']
+        registry['coverage_engine'] = ViewCoverageEngine()
+        self.addCleanup(registry.__setitem__, 'coverage_engine', engine)
+
+        response = self.testapp.get(
+            f'/v1/buyers_tiers/{self.buyer_tier.slug}/makes/{self.make.slug}/coverage',
+            params={'zipcode': self.zipcode.code},
+        )
+
+        # Should return the same row as the coverage table
+        self.assertEqual(response.status_code, 200)
+        coverage = response.json['data']['coverage']
+        self.assertEqual(len(coverage), 1)
+        self.assertEqual(coverage[0].get('dealer_code'), self.buyer_dealer.code)
+        self.assertEqual(coverage[0].get('dealer_phone'), self.buyer_dealer.phone)
+        self.assertEqual(coverage[0].get('distance'), self.dealer_coverage.distance)
+
+    def test_prerendered(self):
+        """Test the same coverage served from the pre-rendered responses"""
+        from sqlalchemy import text
+        from leads_api.models.tables import refresh_views_sql
+
+        self.make_one()
+        path = f'/v1/buyers_tiers/{self.buyer_tier.slug}/makes/{self.make.slug}/coverage'
+        params = {'zipcode': self.zipcode.code}
+        dynamic = self.testapp.get(path, params=params)
+
+        self.dbsession.execute(text(refresh_views_sql(concurrently=False)))
+        registry = self.testapp.app.registry
+        registry['prerendered'] = True
+        self.addCleanup(registry.__setitem__, 'prerendered', False)
+        prerendered = self.testapp.get(path, params=params)
+
+        # Should return the same document, from the view
+        self.assertEqual(prerendered.status_code, 200)
+        self.assertEqual(prerendered.json, dynamic.json)
+        self.assertEqual(registry['metrics'].snapshot().get('prerendered.hits'), 1)
+
+    @parameterized.expand([
+        ('year', {'year': '1999'}),
+        ('model', {'model': 'unknown'}),
+    ])
+    def test_not_accepted(self, _, extra_params):
+        """Test tiers that don't accept the requested year or model"""
+
+        # Creates dummy data
+        self.make_one()
+
+        # Sets requested params
+        params = {
+            'zipcode': self.zipcode.code,
+            **extra_params,
+        }
+
+        # Performs the request for coverage
+        response = self.testapp.get(
+            f'/v1/buyers_tiers/{self.buyer_tier.slug}/makes/{self.make.slug}/coverage',
+            params=params
+        )
+
+        # Should return OK status, without coverage
+        self.assertEqual(response.status_code, 200)
+        data = response.json.get('data')
+        self.assertFalse(data.get('has_coverage'))
 
     @parameterized.expand(['zipcode'])
     def test_missing_params(self, remove_key):
@@ -99,7 +186,7 @@ class CoverageGetTests(BaseIntegrationTest):
 
         # Sets requested params
         params = {
-            'zipcode': self.dealer_coverage.zipcode,
+            'zipcode': self.zipcode.code,
         }
         params.pop(remove_key)
 
@@ -120,3 +207,86 @@ class CoverageGetTests(BaseIntegrationTest):
         # The error should be a MissingRequiredParameter and field should be the one we removed
         self.assertEqual(error.get('exception'), 'MissingRequiredParameter')
         self.assertEqual(error.get('field'), remove_key)
+
+    def test_pages(self):
+        """Test paging through the dealers with the cursors"""
+        from tests.integration.factories import (
+            BuyerDealerFactory,
+            BuyerDealerMakeFactory,
+            BuyerTierDealerCoverageFactory,
+        )
+
+        self.make_one()
+        # A second dealer, further away
+        dealer = BuyerDealerFactory(buyer_slug=self.buyer.slug)
+        BuyerDealerMakeFactory(
+            buyer_slug=self.buyer.slug,
+            dealer_code=dealer.code,
+            make_slug=self.make.slug,
+        )
+        self.dbsession.flush()
+        BuyerTierDealerCoverageFactory(
+            buyer_tier_id=self.buyer_tier.id,
+            zipcode_id=self.zipcode.id,
+            dealer_id=dealer.id,
+            distance=self.dealer_coverage.distance + 1,
+        )
+        self.dbsession.flush()
+
+        url = f'/v1/buyers_tiers/{self.buyer_tier.slug}/makes/{self.make.slug}/coverage'
+        first = self.testapp.get(url, params={'zipcode': self.zipcode.code, 'limit': 1})
+        data = first.json['data']
+        self.assertEqual([row['dealer_code'] for row in data['coverage']], [self.buyer_dealer.code])
+        self.assertIsNotNone(data['next_cursor'])
+
+        # The next page should start after the first dealer, and be the last one
+        second = self.testapp.get(url, params={
+            'zipcode': self.zipcode.code, 'limit': 1, 'cursor': data['next_cursor'],
+        })
+        data = second.json['data']
+        self.assertEqual([row['dealer_code'] for row in data['coverage']], [dealer.code])
+        self.assertIsNone(data['next_cursor'])
+
+    def test_legacy_id(self):
+        """Test the coverage of a tier identified by its legacy id"""
+        from tests.integration.factories import LegacyBuyerTierFactory
+
+        self.make_one()
+        legacy_tier = LegacyBuyerTierFactory(
+            buyer_slug=self.buyer.slug,
+            buyer_tier_slug=self.buyer_tier.slug,
+        )
+        self.dbsession.flush()
+
+        params = {'zipcode': self.zipcode.code}
+        response = self.testapp.get(
+            f'/v1/buyers_tiers/{self.buyer_tier.slug}/makes/{self.make.slug}/coverage',
+            params=params,
+        )
+        legacy_response = self.testapp.get(
+            f'/v1/legacy_buyers_tiers/{legacy_tier.legacy_id}/makes/{self.make.slug}/coverage',
+            params=params,
+        )
+
+        # Should answer the same as the tier slug
+        self.assertEqual(legacy_response.status_code, 200)
+        self.assertEqual(legacy_response.json, response.json)
+
+        response = self.testapp.get(
+            f'/v1/legacy_buyers_tiers/{legacy_tier.legacy_id + 1}/makes/{self.make.slug}/coverage',
+            params=params,
+            expect_errors=True,
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json['errors'][0]['exception'], 'UnknownLegacyBuyerTier')
+
+    def test_limit_maximum(self):
+        """Test the limit can't be above the maximum"""
+        self.make_one()
+
+        response = self.testapp.get(
+            f'/v1/buyers_tiers/{self.buyer_tier.slug}/makes/{self.make.slug}/coverage',
+            params={'zipcode': self.zipcode.code, 'limit': 10000},
+            expect_errors=True,
+        )
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,83 @@
+from tests.integration import BaseIntegrationTest
+
+
+class CoverageExportTests(BaseIntegrationTest):
+
+    def make_one(self):
+        """Creates and commits the needed data, the export reads it with its own
+        connection"""
+        from tests.integration.factories import (
+            BuyerFactory,
+            BuyerDealerFactory,
+            BuyerTierFactory,
+            BuyerTierDealerCoverageFactory,
+            ZipcodeFactory,
+            set_session,
+        )
+
+        dbsession = self.testapp.app.registry['dbsession_factory']()
+        self.addCleanup(dbsession.close)
+        set_session(dbsession)
+
+        self.buyer = BuyerFactory()
+        dbsession.flush()
+        self.buyer_dealer = BuyerDealerFactory(buyer_slug=self.buyer.slug)
+        self.buyer_tier = BuyerTierFactory(buyer_slug=self.buyer.slug)
+        self.zipcodes = [ZipcodeFactory(), ZipcodeFactory()]
+        dbsession.flush()
+        self.coverage = [
+            BuyerTierDealerCoverageFactory(
+                buyer_tier_id=self.buyer_tier.id,
+                zipcode_id=zipcode.id,
+                dealer_id=self.buyer_dealer.id,
+            )
+            for zipcode in self.zipcodes
+        ]
+        dbsession.commit()
+
+    def test_ndjson(self):
+        """Test the export of every coverage row of the tier"""
+        import json
+
+        self.make_one()
+
+        response = self.testapp.get(f'/v1/buyers_tiers/{self.buyer_tier.slug}/coverage/export')
+
+        # Should stream a line per coverage row, ordered by zipcode
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content_type, 'application/x-ndjson')
+        self.assertEqual(
+            [json.loads(line) for line in response.text.splitlines()],
+            [
+                {
+                    'zipcode': zipcode.code,
+                    'dealer_code': self.buyer_dealer.code,
+                    'distance': coverage.distance,
+                }
+                for zipcode, coverage in zip(self.zipcodes, self.coverage)
+            ],
+        )
+
+    def test_csv_gzip(self):
+        """Test the CSV export compressed on the fly"""
+        import gzip
+
+        self.make_one()
+
+        response = self.testapp.get(
+            f'/v1/buyers_tiers/{self.buyer_tier.slug}/coverage/export',
+            params={'format': 'csv'},
+            headers={'Accept-Encoding': 'gzip'},
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content_encoding, 'gzip')
+        lines = gzip.decompress(response.body).decode().splitlines()
+        self.assertEqual(lines[0], 'zipcode,dealer_code,distance')
+        self.assertEqual(len(lines), 3)
+
+    def test_unknown_tier(self):
+        """Test the export of a tier that doesn't exist"""
+        response = self.testapp.get('/v1/buyers_tiers/unknown/coverage/export', status=404)
+
+        self.assertEqual(response.json['errors'][0]['exception'], 'UnknownBuyerTier')
@@ -0,0 +1,132 @@
+import os
+import tempfile
+import unittest
+
+
+class CoverageIndexTests(unittest.TestCase):
+    """Unit tests for the memory mapped coverage index"""
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.path = os.path.join(tmp_dir.name, 'coverage.idx')
+
+    def write(self, coverage=None):
+        from leads_api.engines.index import write_index
+
+        return write_index(
+            self.path,
+            tiers=[
+                ('b1-blind', 'b1', 'Buyer 1', 'Blind'),
+                ('b2-blind', 'b2', 'Buyer 2', 'Blind'),
+            ],
+            tier_makes=[('b1-blind', 'honda', 'Honda'), ('b2-blind', 'honda', 'Honda')],
+            dealers=[
+                ('b1', 'dealer-a', 'Dealer A', '1 Main St', 'New York', 'NY', '10010', None),
+                ('b1', 'dealer-b', 'Dealer B', '2 Main St', 'Brooklyn', 'NY', '11201', '555'),
+                ('b2', 'dealer-a', 'Other A', '3 Main St', 'Newark', 'NJ', '07102', None),
+            ],
+            coverage=coverage or [
+                ('b1-blind', 'dealer-b', '10010', 3),
+                ('b1-blind', 'dealer-a', '10010', 0),
+                ('b1-blind', 'dealer-a', '11201', 3),
+                ('b2-blind', 'dealer-a', '10010', 10),
+                # Unknown dealer for the buyer
+                ('b2-blind', 'dealer-b', '10010', 5),
+            ],
+        )
+
+    def test_lookup(self):
+        from leads_api.engines.index import CoverageIndex
+
+        self.assertEqual(self.write(), 4)
+        index = CoverageIndex(self.path)
+
+        # Should return the dealers closer first, with their details
+        rows = index.lookup('b1-blind', 'honda', '10010', limit=3)
+        self.assertEqual([row['dealer_code'] for row in rows], ['dealer-a', 'dealer-b'])
+        self.assertEqual(rows[0], {
+            'buyer': 'Buyer 1',
+            'buyer_tier': 'Blind',
+            'make': 'Honda',
+            'dealer_code': 'dealer-a',
+            'dealer_name': 'Dealer A',
+            'dealer_address': '1 Main St',
+            'dealer_city': 'New York',
+            'dealer_state': 'NY',
+            'dealer_zipcode': '10010',
+            'dealer_phone': None,
+            'distance': 0,
+            'zipcode': '10010',
+        })
+        self.assertEqual(rows[1]['dealer_phone'], '555')
+
+        # Dealers are resolved within the buyer of the tier
+        rows = index.lookup('b2-blind', 'honda', '10010', limit=3)
+        self.assertEqual([row['dealer_name'] for row in rows], ['Other A'])
+
+        # Limit and eligible dealers
+        rows = index.lookup('b1-blind', 'honda', '10010', limit=1)
+        self.assertEqual([row['dealer_code'] for row in rows], ['dealer-a'])
+        rows = index.lookup('b1-blind', 'honda', '10010', limit=3, dealers=frozenset(['dealer-b']))
+        self.assertEqual([row['dealer_code'] for row in rows], ['dealer-b'])
+
+    def test_pages(self):
+        from leads_api.engines.index import CoverageIndex
+
+        self.write(coverage=[
+            ('b1-blind', 'dealer-b', '10010', 3),
+            ('b1-blind', 'dealer-a', '10010', 3),
+        ])
+        index = CoverageIndex(self.path)
+
+        # Dealers at the same distance should be sorted by code
+        rows = index.lookup('b1-blind', 'honda', '10010', limit=3)
+        self.assertEqual([row['dealer_code'] for row in rows], ['dealer-a', 'dealer-b'])
+
+        # Next pages start after the last row of the previous one
+        rows = index.lookup('b1-blind', 'honda', '10010', limit=3, after=(3, 'dealer-a'))
+        self.assertEqual([row['dealer_code'] for row in rows], ['dealer-b'])
+        rows = index.lookup('b1-blind', 'honda', '10010', limit=3, after=(3, 'dealer-b'))
+        self.assertEqual(rows, [])
+
+    def test_unsorted(self):
+        # The coverage is packed as it's read, so it has to be sorted
+        with self.assertRaises(ValueError):
+            self.write(coverage=[
+                ('b1-blind', 'dealer-a', '11201', 3),
+                ('b1-blind', 'dealer-a', '10010', 0),
+            ])
+
+    def test_no_coverage(self):
+        from leads_api.engines.index import CoverageIndex
+
+        self.write()
+        index = CoverageIndex(self.path)
+
+        # Unknown tier, make not configured for the tier, or zipcode without coverage
+        self.assertEqual(index.lookup('unknown', 'honda', '10010', limit=3), [])
+        self.assertEqual(index.lookup('b1-blind', 'ford', '10010', limit=3), [])
+        self.assertEqual(index.lookup('b1-blind', 'honda', '90001', limit=3), [])
+        self.assertEqual(index.lookup('b2-blind', 'honda', '11201', limit=3), [])
+
+    def test_reopen(self):
+        from leads_api.engines.index import IndexCoverageEngine
+
+        self.write()
+        engine = IndexCoverageEngine(self.path, check_interval=0)
+        rows = engine.lookup(None, 'b1-blind', 'honda', '11201', limit=3)
+        self.assertEqual([row['distance'] for row in rows], [3])
+
+        # Should pick up the replaced file
+        self.write([('b1-blind', 'dealer-a', '11201', 4)])
+        rows = engine.lookup(None, 'b1-blind', 'honda', '11201', limit=3)
+        self.assertEqual([row['distance'] for row in rows], [4])
+
+    def test_invalid_file(self):
+        from leads_api.engines.index import CoverageIndex
+
+        with open(self.path, 'wb') as f:
+            f.write(b'\0' * 1024)
+        with self.assertRaises(ValueError):
+            CoverageIndex(self.path)
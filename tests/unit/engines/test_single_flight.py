@@ -0,0 +1,142 @@
+import threading
+import time
+import unittest
+
+from pyramid import testing
+
+
+class SlowEngine:
+    """Coverage engine blocking its lookups until released"""
+
+    def __init__(self):
+        self.queries = 0
+        self.release = threading.Event()
+
+    def lookup(self, request, buyer_tier, make, zipcode, limit, dealers=None, after=None):
+        self.queries += 1
+        self.release.wait(5)
+        if zipcode == 'error':
+            raise RuntimeError('Database error')
+        return [{'dealer_code': 'dealer-a', 'zipcode': zipcode}]
+
+
+class SingleFlightCoverageEngineTests(unittest.TestCase):
+    """Unit tests for the coalescing of identical lookups"""
+
+    def setUp(self):
+        self.config = testing.setUp()
+        self.config.include('leads_api.metrics')
+        self.addCleanup(testing.tearDown)
+
+    def lookup_concurrently(self, engine, zipcode, threads, slow=None):
+        """Runs identical lookups in `threads` threads, releasing the query of
+        the `slow` engine, the wrapped one by default, once they are all waiting
+        for it"""
+        results, errors = [], []
+
+        def lookup():
+            # The threads don't see the current registry of the test
+            request = testing.DummyRequest()
+            request.registry = self.config.registry
+            try:
+                results.append(engine.lookup(request, 'b1-blind', 'honda', zipcode, 3))
+            except RuntimeError as error:
+                errors.append(error)
+
+        workers = [threading.Thread(target=lookup) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            calls = list(engine.flight.calls.values())
+            if calls and calls[0].waiters == threads - 1:
+                break
+            time.sleep(0.001)
+        (slow or engine.engine).release.set()
+        for worker in workers:
+            worker.join()
+        return results, errors
+
+    def test_coalesced(self):
+        from leads_api.engines.single_flight import SingleFlightCoverageEngine
+
+        engine = SingleFlightCoverageEngine(SlowEngine())
+        results, errors = self.lookup_concurrently(engine, '10010', threads=8)
+
+        # A single query should have answered every lookup
+        self.assertEqual(engine.engine.queries, 1)
+        self.assertEqual(errors, [])
+        self.assertEqual(len(results), 8)
+        self.assertTrue(all(rows == results[0] for rows in results))
+        # Every caller gets its own list
+        self.assertEqual(len({id(rows) for rows in results}), 8)
+
+        metrics = self.config.registry['metrics'].snapshot()
+        self.assertEqual(metrics['single_flight.lookups'], 1)
+        self.assertEqual(metrics['single_flight.coalesced'], 7)
+
+        # Once done, the next lookup should query again
+        engine.lookup(testing.DummyRequest(), 'b1-blind', 'honda', '10010', 3)
+        self.assertEqual(engine.engine.queries, 2)
+
+    def test_error(self):
+        from leads_api.engines.single_flight import SingleFlightCoverageEngine
+
+        engine = SingleFlightCoverageEngine(SlowEngine())
+        results, errors = self.lookup_concurrently(engine, 'error', threads=4)
+
+        # Every waiting caller should get the error of the query, each its own
+        # copy caused by the original
+        self.assertEqual(engine.engine.queries, 1)
+        self.assertEqual(results, [])
+        self.assertEqual(len(errors), 4)
+        self.assertEqual(len({id(error) for error in errors}), 4)
+        original = [error for error in errors if error.__cause__ is None]
+        self.assertEqual(len(original), 1)
+        self.assertTrue(all(
+            error.__cause__ is original[0] and error.args == ('Database error',)
+            for error in errors if error is not original[0]
+        ))
+        self.assertEqual(engine.flight.calls, {})
+
+    def test_different_keys(self):
+        from leads_api.engines.single_flight import SingleFlightCoverageEngine
+
+        engine = SingleFlightCoverageEngine(SlowEngine())
+        engine.engine.release.set()
+
+        # Other parameters are other lookups
+        request = testing.DummyRequest()
+        engine.lookup(request, 'b1-blind', 'honda', '10010', 3)
+        engine.lookup(request, 'b1-blind', 'honda', '10010', 4)
+        engine.lookup(request, 'b1-blind', 'honda', '10010', 3, after=(3, 'dealer-a'))
+        self.assertEqual(engine.engine.queries, 3)
+
+    def test_deadline(self):
+        from leads_api.engines.single_flight import SingleFlightCoverageEngine
+        from leads_api.timeouts import DEADLINE_KEY, STATEMENT_TIMEOUT_KEY
+
+        engine = SingleFlightCoverageEngine(SlowEngine())
+        engine.engine.release.set()
+
+        # Lookups cancelled at the deadline of a client shouldn't be shared
+        request = testing.DummyRequest()
+        request.environ[DEADLINE_KEY] = time.monotonic() + 1
+        request.environ[STATEMENT_TIMEOUT_KEY] = (1000, 'deadline')
+        engine.flight = None
+        engine.lookup(request, 'b1-blind', 'honda', '10010', 3)
+        self.assertEqual(engine.engine.queries, 1)
+        metrics = self.config.registry['metrics'].snapshot()
+        self.assertEqual(metrics['single_flight.deadline'], 1)
+
+    def test_breaker(self):
+        from leads_api.engines.single_flight import SingleFlightCoverageEngine
+        from leads_api.resilience import BreakerRecordingEngine, CircuitBreaker
+
+        # A coalesced query should be recorded once in the circuit breaker
+        breaker = CircuitBreaker()
+        slow = SlowEngine()
+        engine = SingleFlightCoverageEngine(BreakerRecordingEngine(slow, breaker))
+        results, errors = self.lookup_concurrently(engine, '10010', threads=4, slow=slow)
+        self.assertEqual(len(results), 4)
+        self.assertEqual(len(breaker.calls), 1)
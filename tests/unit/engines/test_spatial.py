@@ -0,0 +1,62 @@
+import unittest
+
+
+class SpatialCoverageTests(unittest.TestCase):
+    """Unit tests for the in-memory spatial coverage"""
+
+    def make_one(self):
+        from leads_api.engines.spatial import GridIndex, SpatialCoverage, TierInfo
+
+        # Dealers in Manhattan, Brooklyn and Philadelphia
+        dealers = GridIndex(cell_size=0.25)
+        for code, lat, lon in [
+            ('dealer-a', 40.7390, -73.9826),
+            ('dealer-b', 40.6944, -73.9905),
+            ('dealer-c', 39.9522, -75.1734),
+        ]:
+            dealers.add(lat, lon, {'dealer_code': code})
+
+        return SpatialCoverage(
+            tiers={
+                'b1-blind': TierInfo('b1', 'Buyer 1', 'Blind', radius=10),
+                'b1-wide': TierInfo('b1', 'Buyer 1', 'Wide', radius=100),
+            },
+            tier_makes={('b1-blind', 'honda'): 'Honda', ('b1-wide', 'honda'): 'Honda'},
+            dealers={'b1': dealers},
+            zipcodes={'10010': (40.7390, -73.9826)},
+        )
+
+    def test_nearest_within_radius(self):
+        coverage = self.make_one()
+
+        # Should only return the dealers within the tier radius, closer first
+        rows = coverage.lookup('b1-blind', 'honda', '10010', limit=3)
+        self.assertEqual([row['dealer_code'] for row in rows], ['dealer-a', 'dealer-b'])
+        self.assertEqual([row['distance'] for row in rows], [0, 3])
+        self.assertEqual(rows[0]['buyer'], 'Buyer 1')
+        self.assertEqual(rows[0]['buyer_tier'], 'Blind')
+        self.assertEqual(rows[0]['make'], 'Honda')
+        self.assertEqual(rows[0]['zipcode'], '10010')
+
+        # A wider radius reaches Philadelphia, but the limit still applies
+        rows = coverage.lookup('b1-wide', 'honda', '10010', limit=3)
+        self.assertEqual([row['dealer_code'] for row in rows], ['dealer-a', 'dealer-b', 'dealer-c'])
+        rows = coverage.lookup('b1-wide', 'honda', '10010', limit=1)
+        self.assertEqual([row['dealer_code'] for row in rows], ['dealer-a'])
+
+    def test_pages(self):
+        coverage = self.make_one()
+
+        # Next pages start after the (distance, dealer code) of the previous one
+        rows = coverage.lookup('b1-wide', 'honda', '10010', limit=3, after=(0, 'dealer-a'))
+        self.assertEqual([row['dealer_code'] for row in rows], ['dealer-b', 'dealer-c'])
+        rows = coverage.lookup('b1-wide', 'honda', '10010', limit=3, after=(3, 'dealer-b'))
+        self.assertEqual([row['dealer_code'] for row in rows], ['dealer-c'])
+
+    def test_no_coverage(self):
+        coverage = self.make_one()
+
+        # Unknown tier, make not configured for the tier, or unknown zipcode
+        self.assertEqual(coverage.lookup('unknown', 'honda', '10010', limit=3), [])
+        self.assertEqual(coverage.lookup('b1-blind', 'ford', '10010', limit=3), [])
+        self.assertEqual(coverage.lookup('b1-blind', 'honda', '99999', limit=3), [])
@@ -0,0 +1,62 @@
+import unittest
+
+
+class ViewCoverageEngineTests(unittest.TestCase):
+    """Unit tests for the materialized view coverage engine"""
+
+    def lookup(self, **kwargs):
+        from sqlalchemy.dialects import postgresql
+        from leads_api.engines.view import ViewCoverageEngine
+
+        statements = []
+
+        class DummySession:
+            def execute(self, statement):
+                statements.append(statement)
+                return []
+
+        class DummyRequest:
+            dbsession = DummySession()
+
+        rows = ViewCoverageEngine().lookup(
+            DummyRequest(), 'buyer-1-blind', 'honda', '10010', 3, **kwargs
+        )
+        self.assertEqual(rows, [])
+        return str(statements[0].compile(dialect=postgresql.dialect()))
+
+    def test_single_table(self):
+        sql = self.lookup()
+
+        # Should read the view alone, in the order of its key
+        self.assertIn('FROM public.coverage_lookup \n', sql)
+        self.assertNotIn('JOIN', sql)
+        self.assertIn(
+            'ORDER BY public.coverage_lookup.distance, public.coverage_lookup.dealer_code', sql
+        )
+
+    def test_view_key(self):
+        from leads_api.models.tables import coverage_lookup
+
+        # Lookups should be a range scan of the unique key
+        (index,) = coverage_lookup.indexes
+        self.assertTrue(index.unique)
+        self.assertEqual(
+            [column.name for column in index.columns],
+            ['tier_slug', 'make_slug', 'zipcode', 'distance', 'dealer_code'],
+        )
+
+    def test_dealers(self):
+        sql = self.lookup(dealers=frozenset({'dealer-a'}))
+
+        # Should filter the eligible dealers with a single array parameter
+        self.assertIn('public.coverage_lookup.dealer_code = ANY (%(dealers)s', sql)
+
+    def test_after(self):
+        sql = self.lookup(after=(12, 'dealer-a'))
+
+        # Next pages should start the range scan after the previous page
+        self.assertIn(
+            '(public.coverage_lookup.distance, public.coverage_lookup.dealer_code) > '
+            '(%(param_1)s::INTEGER, %(param_2)s::VARCHAR)',
+            sql,
+        )
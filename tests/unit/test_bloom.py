@@ -0,0 +1,111 @@
+import unittest
+
+from pyramid import testing
+
+
+class BloomFilterTests(unittest.TestCase):
+    """Unit tests for the Bloom filter"""
+
+    def test_no_false_negatives(self):
+        from leads_api.bloom import BloomFilter
+
+        bloom = BloomFilter(1000, false_positive_rate=0.01)
+        keys = [f'tier-{i % 10}\x1f{i:05d}' for i in range(1000)]
+        for key in keys:
+            bloom.add(key)
+
+        # Every added key should be found
+        self.assertTrue(all(key in bloom for key in keys))
+
+        # Keys never added should rarely be found
+        false_positives = sum(f'other\x1f{i:05d}' in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_max_bytes(self):
+        from leads_api.bloom import BloomFilter
+
+        bloom = BloomFilter(100000, false_positive_rate=0.001, max_bytes=1024)
+
+        # Should respect the memory budget, at the cost of more false positives
+        self.assertEqual(len(bloom.bits), 1024)
+        self.assertGreater(bloom.false_positive_rate, 0.001)
+
+
+class DummyResult:
+    """Result of a query on an empty coverage table"""
+
+    def scalar(self):
+        return 0
+
+    def __iter__(self):
+        return iter([])
+
+
+class MightHaveCoverageTests(unittest.TestCase):
+    """Unit tests for the coverage filter check"""
+
+    def setUp(self):
+        self.config = testing.setUp()
+        self.config.include('leads_api.metrics')
+        self.addCleanup(testing.tearDown)
+
+    def test_check(self):
+        from leads_api.bloom import BloomFilter, coverage_key, might_have_coverage
+
+        request = testing.DummyRequest()
+
+        # Without filter, all the requests go to the database
+        self.assertTrue(might_have_coverage(request, 'b1-blind', '10010'))
+
+        bloom = BloomFilter(10)
+        bloom.add(coverage_key('b1-blind', '10010'))
+        self.config.registry['coverage_filter'] = bloom
+        self.assertTrue(might_have_coverage(request, 'b1-blind', '10010'))
+        self.assertFalse(might_have_coverage(request, 'b1-blind', '90001'))
+
+        # Should count the database calls avoided
+        metrics = self.config.registry['metrics'].snapshot()
+        self.assertEqual(metrics['bloom.passed'], 1)
+        self.assertEqual(metrics['bloom.avoided'], 1)
+
+
+class CoverageFilterSetupTests(unittest.TestCase):
+    """Unit tests for the coverage filter setup"""
+
+    def setUp(self):
+        self.config = testing.setUp(settings={'bloom.enabled': 'true'})
+        self.config.include('leads_api.metrics')
+        self.config.include('leads_api.data_version')
+        self.addCleanup(testing.tearDown)
+
+    def test_engine(self):
+        from pyramid.exceptions import ConfigurationError
+
+        # The filter would hide the coverage of the engines not reading the table
+        self.config.registry.settings['coverage.engine'] = 'spatial'
+        with self.assertRaises(ConfigurationError):
+            self.config.include('leads_api.bloom')
+
+    def test_reset(self):
+        from leads_api.bloom import BloomFilter
+
+        registry = self.config.registry
+        seen = []
+
+        class DummySession:
+            def __init__(self):
+                seen.append(registry['coverage_filter'])
+
+            def execute(self, statement, execution_options=None):
+                return DummyResult()
+
+            def close(self):
+                pass
+        registry['dbsession_factory'] = DummySession
+        self.config.include('leads_api.bloom')
+        bloom = registry['coverage_filter'] = BloomFilter(10)
+
+        # The database should answer while the filter of the new version is built
+        registry['data_version'].update('2')
+        self.assertEqual(seen, [None])
+        self.assertIsNot(registry['coverage_filter'], bloom)
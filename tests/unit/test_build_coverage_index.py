@@ -0,0 +1,39 @@
+import os
+import tempfile
+import unittest
+
+
+class BuildCoverageIndexTests(unittest.TestCase):
+    """Unit tests for the coverage index built from files"""
+
+    def test_from_files(self):
+        import yaml
+        from benchmarks.import_data_jobs import make_data
+        from build_coverage_index import main
+        from leads_api.engines.index import CoverageIndex
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            source = os.path.join(tmp_dir, 'data.yaml')
+            coverage = os.path.join(tmp_dir, 'coverage.tsv')
+            output = os.path.join(tmp_dir, 'coverage.idx')
+            with open(source, 'w') as f:
+                yaml.safe_dump(make_data(buyers=2, tiers=1, dealers=3, makes=1), f)
+            with open(coverage, 'w') as f:
+                f.write('buyer-0-tier-0\tbuyer-0-dealer-1\t10010\t7\n')
+                f.write('buyer-0-tier-0\tbuyer-0-dealer-0\t10010\t2\n')
+
+            self.assertEqual(main(output, source=source, coverage=coverage), 2)
+            rows = CoverageIndex(output).lookup('buyer-0-tier-0', 'make-0', '10010', limit=3)
+            self.assertEqual(
+                [(row['dealer_code'], row['distance']) for row in rows],
+                [('buyer-0-dealer-0', 2), ('buyer-0-dealer-1', 7)],
+            )
+            self.assertEqual(rows[0]['buyer'], 'Buyer 0')
+            self.assertEqual(rows[0]['make'], 'Make-0')
+
+    def test_copy_unescape(self):
+        from build_coverage_index import copy_unescape
+
+        self.assertIsNone(copy_unescape('\\N'))
+        self.assertEqual(copy_unescape('a\\tb\\\\c'), 'a\tb\\c')
+        self.assertEqual(copy_unescape('a\\\\tb'), 'a\\tb')
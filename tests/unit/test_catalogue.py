@@ -0,0 +1,165 @@
+import unittest
+
+
+class DummyDBSession:
+    """Dummy SQLAlchemy Session returning fixed rows for each table"""
+
+    def __init__(self, rows_by_table):
+        self.rows_by_table = rows_by_table
+
+    def execute(self, statement):
+        table = statement.get_final_froms()[0]
+        return iter(self.rows_by_table.get(table.name, []))
+
+    def close(self):
+        pass
+
+
+class CatalogueTests(unittest.TestCase):
+    """Unit tests for the in-memory buyers configuration"""
+
+    def make_one(self):
+        from leads_api.catalogue import Catalogue
+
+        return Catalogue.load(DummyDBSession({
+            'year': [('2022',), ('2023',)],
+            'buyer_tier': [('b1', 'b1-blind'), ('b1', 'b1-strict')],
+            'legacy_buyer_tier': [(101, 'b1-blind'), (102, 'b1-strict')],
+            'buyer_tier_make': [('b1-blind', 'honda'), ('b1-strict', 'honda')],
+            'buyer_tier_make_year': [
+                ('b1-blind', 'honda', '2022'),
+                ('b1-blind', 'honda', '2023'),
+                ('b1-strict', 'honda', '2023'),
+            ],
+            'buyer_tier_make_model': [('b1-blind', 'honda', 'civic')],
+            'buyer_tier_make_model_year': [('b1-blind', 'honda', 'civic', '2023')],
+            'buyer_dealer_make': [
+                ('b1', 'dealer-a', 'honda'),
+                ('b1', 'dealer-b', 'honda'),
+                ('b1', 'dealer-c', 'ford'),
+            ],
+            'buyer_dealer_make_year': [
+                ('b1', 'dealer-a', 'honda', '2022'),
+                ('b1', 'dealer-a', 'honda', '2023'),
+                ('b1', 'dealer-b', 'honda', '2023'),
+            ],
+            'buyer_dealer_make_model': [('b1', 'dealer-a', 'honda', 'civic')],
+            'buyer_dealer_make_model_year': [('b1', 'dealer-a', 'honda', 'civic', '2022')],
+        }))
+
+    def test_make(self):
+        catalogue = self.make_one()
+
+        # Only the dealers selling the make
+        self.assertEqual(
+            catalogue.eligible_dealers('b1-blind', 'honda'), {'dealer-a', 'dealer-b'}
+        )
+        # Tiers not configured for the make, or unknown, don't accept the request
+        self.assertIsNone(catalogue.eligible_dealers('b1-blind', 'ford'))
+        self.assertIsNone(catalogue.eligible_dealers('unknown', 'honda'))
+
+    def test_year(self):
+        catalogue = self.make_one()
+
+        self.assertEqual(
+            catalogue.eligible_dealers('b1-blind', 'honda', year='2022'), {'dealer-a'}
+        )
+        self.assertEqual(
+            catalogue.eligible_dealers('b1-strict', 'honda', year='2023'),
+            {'dealer-a', 'dealer-b'},
+        )
+        # The tier doesn't accept the year, or the year doesn't exist
+        self.assertIsNone(catalogue.eligible_dealers('b1-strict', 'honda', year='2022'))
+        self.assertIsNone(catalogue.eligible_dealers('b1-blind', 'honda', year='1999'))
+
+    def test_model(self):
+        catalogue = self.make_one()
+
+        self.assertEqual(
+            catalogue.eligible_dealers('b1-blind', 'honda', model='civic'), {'dealer-a'}
+        )
+        self.assertIsNone(catalogue.eligible_dealers('b1-strict', 'honda', model='civic'))
+
+        # The tier accepts the civic on 2023, but the only dealer selling it only
+        # has 2022 models
+        self.assertEqual(
+            catalogue.eligible_dealers('b1-blind', 'honda', year='2023', model='civic'),
+            frozenset(),
+        )
+        self.assertIsNone(
+            catalogue.eligible_dealers('b1-blind', 'honda', year='2022', model='civic')
+        )
+
+
+    def test_memo(self):
+        catalogue = self.make_one()
+
+        # Only the requests the configuration accepts should be memoized
+        catalogue.eligible_dealers('b1-blind', 'honda', year='2023')
+        for number in range(100):
+            self.assertIsNone(catalogue.eligible_dealers('b1-blind', f'make-{number}'))
+            self.assertIsNone(catalogue.eligible_dealers('b1-blind', 'honda', year=str(number)))
+        self.assertEqual(list(catalogue._eligible), [('b1-blind', 'honda', '2023', None)])
+
+    def test_legacy_tiers(self):
+        catalogue = self.make_one()
+
+        self.assertEqual(catalogue.legacy_tiers, {101: 'b1-blind', 102: 'b1-strict'})
+
+
+class CatalogueRefreshTests(unittest.TestCase):
+    """Unit tests for the catalogue refresh on data version changes"""
+
+    def test_refresh(self):
+        from pyramid import testing
+
+        config = testing.setUp()
+        self.addCleanup(testing.tearDown)
+        rows_by_table = {
+            'buyer_tier': [('b1', 'b1-blind')],
+            'buyer_tier_make': [('b1-blind', 'honda')],
+        }
+        config.registry['dbsession_factory'] = lambda: DummyDBSession(rows_by_table)
+        config.include('leads_api.data_version')
+        config.include('leads_api.catalogue')
+
+        # Should load a new catalogue when the data version changes
+        config.registry['data_version'].update('1')
+        catalogue = config.registry['catalogue']
+        self.assertEqual(catalogue.eligible_dealers('b1-blind', 'honda'), frozenset())
+        self.assertIsNone(catalogue.eligible_dealers('b1-blind', 'ford'))
+
+        rows_by_table['buyer_tier_make'].append(('b1-blind', 'ford'))
+        config.registry['data_version'].update('2')
+        self.assertIsNot(config.registry['catalogue'], catalogue)
+        self.assertEqual(
+            config.registry['catalogue'].eligible_dealers('b1-blind', 'ford'), frozenset()
+        )
+
+    def test_reload_after_fork(self):
+        from pyramid import testing
+        from leads_api.prefork import post_fork
+
+        config = testing.setUp(settings={'prefork': 'true', 'catalogue.load_on_startup': 'true'})
+        self.addCleanup(testing.tearDown)
+        rows_by_table = {'data_version': [(1,)], 'buyer_tier': [('b1', 'b1-blind')]}
+
+        class DummyEngine:
+            def dispose(self, close=True):
+                pass
+        config.registry['dbengine'] = DummyEngine()
+        config.registry['dbsession_factory'] = lambda: DummyDBSession(rows_by_table)
+        config.include('leads_api.data_version')
+        config.include('leads_api.catalogue')
+        app = config.make_wsgi_app()
+        catalogue = app.registry['catalogue']
+        self.assertEqual(catalogue.version, '1')
+
+        # A worker forked before the next import should keep the catalogue
+        post_fork(app)
+        self.assertIs(app.registry['catalogue'], catalogue)
+
+        # And the ones forked after should reload it
+        rows_by_table['data_version'] = [(2,)]
+        post_fork(app)
+        self.assertEqual(app.registry['catalogue'].version, '2')
@@ -0,0 +1,162 @@
+import unittest
+
+
+class DataVersionTests(unittest.TestCase):
+    """Unit tests for the data version tracking"""
+
+    def test_update(self):
+        from leads_api.data_version import DataVersion
+
+        data_version = DataVersion()
+        notified = []
+        data_version.subscribe(notified.append)
+
+        # Should notify only when the version changes
+        self.assertTrue(data_version.update('1'))
+        self.assertFalse(data_version.update('1'))
+        self.assertTrue(data_version.update('2'))
+        self.assertEqual(notified, ['1', '2'])
+        self.assertEqual(data_version.version, '2')
+
+    def test_published_after_refresh(self):
+        from leads_api.data_version import DataVersion
+
+        data_version = DataVersion('1')
+        seen = []
+        data_version.subscribe(lambda version: seen.append(data_version.version))
+
+        # The new version should only be visible once the caches refreshed
+        data_version.update('2')
+        self.assertEqual(seen, ['1'])
+        self.assertEqual(data_version.version, '2')
+
+    def test_concurrent_update(self):
+        import threading
+        from leads_api.data_version import DataVersion
+
+        data_version = DataVersion('1')
+        refreshing, release = threading.Event(), threading.Event()
+
+        def slow(version):
+            if version == '2':
+                refreshing.set()
+                release.wait(5)
+        data_version.subscribe(slow)
+        thread = threading.Thread(target=data_version.update, args=('2',))
+        thread.start()
+        self.assertTrue(refreshing.wait(5))
+
+        # A newer version shouldn't wait for the slow refresh, nor be replaced
+        # by the older one once it finishes
+        self.assertTrue(data_version.update('3'))
+        self.assertEqual(data_version.version, '3')
+        release.set()
+        thread.join(5)
+        self.assertEqual(data_version.version, '3')
+
+    def test_failing_subscriber(self):
+        from leads_api.data_version import DataVersion
+
+        data_version = DataVersion()
+        notified = []
+
+        def fail(version):
+            raise RuntimeError('Cannot refresh')
+        data_version.subscribe(fail)
+        data_version.subscribe(notified.append)
+
+        # Other subscribers should still be notified
+        with self.assertLogs('leads_api.data_version', level='ERROR'):
+            data_version.update('1')
+        self.assertEqual(notified, ['1'])
+
+    def test_update_without_notify(self):
+        from datetime import datetime, timezone
+        from leads_api.data_version import DataVersion
+
+        data_version = DataVersion()
+        notified = []
+        data_version.subscribe(notified.append)
+        updated_at = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+        # The initial version shouldn't refresh caches just loaded
+        self.assertTrue(data_version.update('1', updated_at, notify=False))
+        self.assertEqual(notified, [])
+        self.assertEqual(data_version.updated_at, updated_at)
+
+
+class DummyCursor:
+    def __init__(self, row):
+        self.row = row
+        self.statements = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, statement):
+        self.statements.append(statement)
+
+    def fetchone(self):
+        return self.row
+
+
+class DummyConnection:
+    def __init__(self, row):
+        self.cursor_ = DummyCursor(row)
+
+    def cursor(self):
+        return self.cursor_
+
+
+class DataVersionWatcherTests(unittest.TestCase):
+    """Unit tests for the data version watcher"""
+
+    def test_parse_notification(self):
+        from datetime import datetime, timezone
+        from leads_api.data_version import parse_notification
+
+        version, updated_at = parse_notification('42 1704067200.250000')
+        self.assertEqual(version, '42')
+        self.assertEqual(updated_at, datetime(2024, 1, 1, 0, 0, 0, 250000, timezone.utc))
+
+    def test_bump_sql(self):
+        from leads_api.data_version import bump_sql
+
+        sql = bump_sql()
+        self.assertIn('INSERT INTO public.data_version', sql)
+        self.assertIn("pg_notify('data_version'", sql)
+
+    def test_poll(self):
+        from datetime import datetime, timedelta, timezone
+        from leads_api.data_version import DataVersion, DataVersionWatcher
+        from leads_api.metrics import Metrics
+
+        data_version = DataVersion()
+        notified = []
+        data_version.subscribe(notified.append)
+        metrics = Metrics()
+        watcher = DataVersionWatcher(data_version, engine=None, metrics=metrics)
+        updated_at = datetime.now(timezone.utc) - timedelta(seconds=2)
+
+        watcher.poll(DummyConnection((7, updated_at)))
+        watcher.poll(DummyConnection((7, updated_at)))
+
+        # Should notify once, and measure how long it took since the bump
+        self.assertEqual(notified, ['7'])
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['data_version.updates'], 1)
+        self.assertEqual(snapshot['data_version.version'], 7)
+        self.assertGreaterEqual(snapshot['data_version.propagation_seconds'], 2)
+
+    def test_poll_empty(self):
+        from leads_api.data_version import DataVersion, DataVersionWatcher
+
+        data_version = DataVersion()
+        watcher = DataVersionWatcher(data_version, engine=None)
+
+        # Nothing imported yet
+        watcher.poll(DummyConnection(None))
+        self.assertIsNone(data_version.version)
@@ -0,0 +1,64 @@
+import unittest
+
+
+class GenerateCoverageTests(unittest.TestCase):
+    """Unit tests for the coverage computed from coordinates"""
+
+    def make_zipcodes(self):
+        from generate_coverage import Zipcodes
+
+        # Manhattan, Brooklyn, Philadelphia and Los Angeles
+        return Zipcodes(
+            ['10010', '11201', '19103', '90001'],
+            [40.7390, 40.6944, 39.9522, 33.9731],
+            [-73.9826, -73.9905, -75.1734, -118.2487],
+        )
+
+    def test_haversine(self):
+        from generate_coverage import haversine
+
+        # New York to Los Angeles is roughly 2450 miles
+        distance = haversine(40.7390, -73.9826, 33.9731, -118.2487)
+        self.assertAlmostEqual(float(distance), 2450, delta=25)
+
+    def test_generate_coverage(self):
+        from generate_coverage import generate_coverage
+
+        tiers = [
+            {'buyer_slug': 'b1', 'slug': 'b1-blind'},
+            {'buyer_slug': 'b1', 'slug': 'b1-wide'},
+            {'buyer_slug': 'b1', 'slug': 'b1-no-radius'},
+        ]
+        dealers = [
+            {'buyer_slug': 'b1', 'code': 'dealer-a', 'zipcode': '10010'},
+            {'buyer_slug': 'b1', 'code': 'dealer-b', 'zipcode': None},
+        ]
+        rows = list(generate_coverage(
+            tiers,
+            dealers,
+            self.make_zipcodes(),
+            {'b1-blind': 10, 'b1-wide': 100},
+            # dealer-b is located in Los Angeles with explicit coordinates
+            coordinates={('b1', 'dealer-b'): (34.05, -118.25)},
+            chunk_size=1,
+        ))
+
+        # Should cover Manhattan and Brooklyn with a 10 miles radius
+        blind = sorted(row for row in rows if row[0] == 'b1-blind')
+        self.assertEqual(
+            [row[:3] for row in blind],
+            [
+                ('b1-blind', 'dealer-a', '10010'),
+                ('b1-blind', 'dealer-a', '11201'),
+                ('b1-blind', 'dealer-b', '90001'),
+            ],
+        )
+        self.assertEqual(blind[0][3], 0)
+        self.assertEqual(blind[1][3], 3)
+
+        # Should also cover Philadelphia with a 100 miles radius
+        wide = {row[2] for row in rows if row[0] == 'b1-wide' and row[1] == 'dealer-a'}
+        self.assertEqual(wide, {'10010', '11201', '19103'})
+
+        # Tiers without radius are skipped
+        self.assertFalse([row for row in rows if row[0] == 'b1-no-radius'])
@@ -0,0 +1,123 @@
+import unittest
+
+from pyramid import testing
+
+
+class CachedProbeTests(unittest.TestCase):
+    """Unit tests for the cached health probes"""
+
+    def test_ttl(self):
+        from leads_api.health import CachedProbe
+
+        calls = []
+
+        def probe():
+            calls.append(1)
+            return {'ok': True, 'calls': len(calls)}
+        cached = CachedProbe(probe, ttl=60)
+
+        # Should probe once within the ttl
+        self.assertEqual(cached(), {'ok': True, 'calls': 1})
+        self.assertEqual(cached(), {'ok': True, 'calls': 1})
+
+        cached.ttl = 0
+        self.assertEqual(cached(), {'ok': True, 'calls': 2})
+
+    def test_concurrent_probe(self):
+        import threading
+        from leads_api.health import CachedProbe
+
+        started, release = threading.Event(), threading.Event()
+        results = iter([{'ok': True}, {'ok': False}])
+
+        def probe():
+            result = next(results)
+            if not result['ok']:
+                started.set()
+                release.wait(5)
+            return result
+        cached = CachedProbe(probe, ttl=0)
+        cached()
+
+        thread = threading.Thread(target=cached)
+        thread.start()
+        started.wait(5)
+        try:
+            # Should get the previous result while another caller probes
+            self.assertEqual(cached(), {'ok': True})
+        finally:
+            release.set()
+            thread.join()
+        self.assertEqual(cached.result, {'ok': False})
+
+
+class DummyHandler:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, request):
+        from pyramid.response import Response
+
+        self.calls.append(request)
+        return Response()
+
+
+class HealthTweenTests(unittest.TestCase):
+    """Unit tests for the health checks tween"""
+
+    def setUp(self):
+        self.config = testing.setUp(settings={'catalogue.load_on_startup': 'true'})
+        self.config.include('leads_api.metrics')
+        self.config.include('leads_api.data_version')
+        self.addCleanup(testing.tearDown)
+        self.database = {'ok': True}
+        self.config.registry['health_database_probe'] = lambda: self.database
+        self.handler = DummyHandler()
+
+    def get(self, path):
+        from pyramid.request import Request
+        from leads_api.health import health_tween
+
+        return health_tween(self.handler, self.config.registry)(Request.blank(path))
+
+    def test_liveness(self):
+        response = self.get('/healthz')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json, {'status': 'ok'})
+        self.assertEqual(self.handler.calls, [])
+
+    def test_readiness(self):
+        registry = self.config.registry
+
+        # Should not be ready until the catalogue is loaded
+        response = self.get('/readyz')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json['checks'], {'database': True, 'catalogue': False})
+
+        registry['catalogue'] = object()
+        registry['data_version'].update('7')
+        response = self.get('/readyz')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json['ready'])
+        self.assertEqual(response.json['data_version'], '7')
+        self.assertEqual(response.cache_control.no_store, True)
+
+        self.database = {'ok': False, 'error': 'OperationalError'}
+        self.assertEqual(self.get('/readyz').status_code, 503)
+        self.assertEqual(self.handler.calls, [])
+        self.assertEqual(registry['metrics'].snapshot()['health.readiness_checks'], 3)
+
+    def test_other_paths(self):
+        self.get('/v1/buyers_tiers/buyer-1-blind/makes/ford/coverage')
+        self.assertEqual(len(self.handler.calls), 1)
+
+    def test_outermost_tween(self):
+        from pyramid.interfaces import ITweens
+        from pyramid.paster import get_appsettings
+        from leads_api import main
+
+        app = main({}, **get_appsettings('testing.ini'))
+        tweens = app.registry.queryUtility(ITweens).implicit()
+
+        # Should run before every other tween, including the transaction manager
+        self.assertEqual(tweens[0][0], 'leads_api.health.health_tween')
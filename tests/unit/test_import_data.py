@@ -0,0 +1,133 @@
+import unittest
+
+
+def make_data():
+    """Small catalogue with a few independent buyers"""
+    data = {
+        'years': {'2023': {'slug': '2023', 'name': '2023'}},
+        'makes': {'honda': {'slug': 'honda', 'name': 'Honda', 'years': ['2023']}},
+        'buyers': {},
+    }
+    for b in range(5):
+        buyer = f'buyer-{b}'
+        data['buyers'][buyer] = {
+            'slug': buyer,
+            'name': f'Buyer {b}',
+            'makes': {'honda': {'years': ['2023']}},
+            'tiers': {
+                f'{buyer}-blind': {
+                    'slug': f'{buyer}-blind',
+                    'name': 'Blind',
+                    'makes': {'honda': {'make_slug': 'honda'}},
+                },
+            },
+            'dealers': {
+                f'{buyer}-dealer-{d}': {
+                    'code': f'{buyer}-dealer-{d}',
+                    'name': f'Dealer {d}',
+                    'zipcode': '10010',
+                }
+                for d in range(3)
+            },
+        }
+    return data
+
+
+class GenerateSQLTests(unittest.TestCase):
+    """Unit tests for import_data SQL generation"""
+
+    def test_parallel_output_is_deterministic(self):
+        from import_data import generate_sql
+
+        data = make_data()
+        serial = generate_sql(data, jobs=1)
+
+        # Should generate rows for the buyers subtree tables
+        self.assertIn('COPY buyer_dealer ', serial)
+        self.assertIn("'buyer-4-dealer-2'", serial)
+
+        # Should generate exactly the same output regardless of the workers
+        for jobs in (2, 3):
+            self.assertEqual(generate_sql(data, jobs=jobs), serial)
+
+
+class GenerateDiffSQLTests(unittest.TestCase):
+    """Unit tests for differential imports"""
+
+    def fingerprints(self, data):
+        from import_data import collect_tables, extract_all, table_fingerprints
+
+        return {
+            table.name: table_fingerprints(table, columns, rows)
+            for table, columns, rows in collect_tables(extract_all(data)).values()
+        }
+
+    def test_only_changes(self):
+        from import_data import extract_all, generate_diff_sql
+
+        previous = self.fingerprints(make_data())
+
+        # Change a dealer, remove another one and add a new one
+        data = make_data()
+        dealers = data['buyers']['buyer-0']['dealers']
+        dealers['buyer-0-dealer-0']['name'] = "Dealer O'Neil"
+        dealers.pop('buyer-0-dealer-1')
+        dealers['buyer-0-dealer-9'] = {'code': 'buyer-0-dealer-9', 'name': 'Dealer 9'}
+
+        sql, fingerprints = generate_diff_sql(extract_all(data), previous)
+
+        # Should only touch the changed dealers, escaping the values
+        self.assertEqual(sql.count('INSERT INTO buyer_dealer '), 1)
+        self.assertEqual(sql.count('DELETE FROM buyer_dealer '), 1)
+        self.assertIn("DELETE FROM buyer_dealer WHERE (buyer_slug, code) IN (\n"
+                      "('buyer-0', 'buyer-0-dealer-1')\n);", sql)
+        self.assertIn("'Dealer O''Neil'", sql)
+        self.assertIn("'buyer-0-dealer-9'", sql)
+        self.assertNotIn("'buyer-1-dealer-0'", sql)
+
+        # Should refresh the views and let the API workers know the data changed
+        self.assertIn('REFRESH MATERIALIZED VIEW CONCURRENTLY public.coverage_lookup;', sql)
+        self.assertIn("pg_notify('data_version'", sql)
+
+        # The new fingerprints should match the new data
+        self.assertEqual(fingerprints, self.fingerprints(data))
+
+    def test_no_changes(self):
+        from import_data import extract_all, generate_diff_sql
+
+        data = make_data()
+        sql, _ = generate_diff_sql(extract_all(data), self.fingerprints(data))
+        self.assertEqual(sql, 'BEGIN;\n\nCOMMIT;\n')
+
+    def test_existing_coverage(self):
+        from import_data import extract_all, generate_diff_sql
+
+        previous = self.fingerprints(make_data())
+
+        # Rename a tier and a dealer, and remove another dealer
+        data = make_data()
+        buyer = data['buyers']['buyer-0']
+        buyer['tiers']['buyer-0-blind']['name'] = 'Blind 2'
+        buyer['dealers']['buyer-0-dealer-0']['name'] = 'Dealer Zero'
+        buyer['dealers'].pop('buyer-0-dealer-1')
+
+        sql, _ = generate_diff_sql(extract_all(data), previous)
+
+        # Changed rows should be updated in place on their natural key, keeping
+        # the ids referenced by the coverage rows
+        self.assertNotIn('DELETE FROM buyer_tier ', sql)
+        self.assertIn('INSERT INTO buyer_tier (buyer_slug, slug, name) VALUES\n'
+                      "('buyer-0', 'buyer-0-blind', 'Blind 2')\n"
+                      'ON CONFLICT (buyer_slug, slug) DO UPDATE SET name = EXCLUDED.name;', sql)
+        self.assertIn('ON CONFLICT (buyer_slug, code) DO UPDATE SET name = EXCLUDED.name', sql)
+
+        # The coverage of the removed dealer should be deleted before the dealer
+        coverage = sql.index(
+            'DELETE FROM buyer_tier_dealer_coverage WHERE dealer_id IN '
+            '(SELECT id FROM buyer_dealer WHERE (buyer_slug, code) IN (\n'
+            "('buyer-0', 'buyer-0-dealer-1')\n));"
+        )
+        self.assertLess(coverage, sql.index('DELETE FROM buyer_dealer '))
+
+        # Should fail the transaction if coverage rows were left dangling anyway
+        self.assertIn("RAISE EXCEPTION 'Coverage rows reference missing `buyer_dealer` rows'", sql)
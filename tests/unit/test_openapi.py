@@ -0,0 +1,58 @@
+import os
+import tempfile
+import unittest
+
+from pyramid import testing
+
+
+class SpecCacheTests(unittest.TestCase):
+    """Unit tests for the cached OpenAPI spec"""
+
+    def test_cache(self):
+        from leads_api.openapi import load_spec_dict
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            spec_dict = load_spec_dict('openapi.yaml', cache_dir)
+            (cached,) = os.listdir(cache_dir)
+            self.assertTrue(cached.startswith('openapi-'))
+
+            # Should be read from the cache the next time
+            self.assertEqual(load_spec_dict('openapi.yaml', cache_dir), spec_dict)
+            with open(os.path.join(cache_dir, cached), 'w') as f:
+                f.write('{"cached": true}')
+            self.assertEqual(load_spec_dict('openapi.yaml', cache_dir), {'cached': True})
+
+    def test_cache_key(self):
+        from leads_api.openapi import spec_cache_path
+
+        # A changed spec should never be read from the previous cache
+        self.assertNotEqual(
+            spec_cache_path('/tmp', b'openapi: 3.0.0\n'),
+            spec_cache_path('/tmp', b'openapi: 3.0.1\n'),
+        )
+
+
+class ViewsRegistrationTests(unittest.TestCase):
+    """Unit tests for the explicit views registration"""
+
+    def views(self, register):
+        config = testing.setUp()
+        self.addCleanup(testing.tearDown)
+        config.include('pyramid_openapi3')
+        config.include('leads_api.routes')
+        register(config)
+        config.commit()
+        views = [item['introspectable'] for item in config.registry.introspector.get_category('views')]
+        return sorted(
+            (view['route_name'] or '', view['name'], view['callable'].__name__, view['phash'])
+            for view in views
+            if view['callable'].__module__.startswith('leads_api.')
+        )
+
+    def test_same_as_scan(self):
+        scanned = self.views(lambda config: config.scan('leads_api.views'))
+        included = self.views(lambda config: config.include('leads_api.views'))
+
+        # Should register the same views as the `view_config` decorators
+        self.assertEqual(included, scanned)
+        self.assertEqual(len(included), 5)
@@ -0,0 +1,34 @@
+import unittest
+
+
+class CursorTests(unittest.TestCase):
+    """Unit tests for the coverage pages cursors"""
+
+    def test_round_trip(self):
+        from leads_api.pagination import decode_cursor, encode_cursor
+
+        for key in [(0, 'dealer-a'), (120, 'dealer ñ/+?&')]:
+            cursor = encode_cursor(*key)
+            # Should be safe in a query string without escaping
+            self.assertRegex(cursor, r'^[A-Za-z0-9_-]+$')
+            self.assertEqual(decode_cursor(cursor), key)
+
+    def test_invalid(self):
+        import base64
+        from leads_api.pagination import InvalidCursor, decode_cursor
+
+        for cursor in ['', 'abc', '!!!', base64.urlsafe_b64encode(b'{"a": 1}').decode(),
+                       base64.urlsafe_b64encode(b'["3", "dealer-a"]').decode()]:
+            with self.assertRaises(InvalidCursor):
+                decode_cursor(cursor)
+
+    def test_postgres_cursor(self):
+        import base64
+        from leads_api.pagination import decode_cursor
+
+        # Postgres pads the base64 and wraps it every 76 characters, `cursor_sql`
+        # translates it to the URL safe alphabet and strips the padding
+        data = '[12, "{}"]'.format('dealer-' * 10).encode()
+        encoded = base64.encodebytes(data).decode()
+        cursor = encoded.translate(str.maketrans('+/', '-_', '\n')).rstrip('=')
+        self.assertEqual(decode_cursor(cursor), (12, 'dealer-' * 10))
@@ -0,0 +1,172 @@
+import unittest
+
+from pyramid import testing
+
+
+class DummyEngine:
+    def __init__(self):
+        self.disposed = []
+
+    def dispose(self, close=True):
+        self.disposed.append(close)
+
+
+class PreforkTests(unittest.TestCase):
+    """Unit tests for the pre-fork server hooks"""
+
+    def make_app(self, settings):
+        config = testing.setUp(settings=settings)
+        self.addCleanup(testing.tearDown)
+        config.registry['dbengine'] = DummyEngine()
+        return config
+
+    def test_hook_on_application_created(self):
+        from leads_api.prefork import add_worker_hook
+
+        config = self.make_app({})
+        called = []
+        add_worker_hook(config, called.append)
+        app = config.make_wsgi_app()
+
+        # Without a pre-fork server the hook should run when the app is created
+        self.assertEqual(called, [app])
+
+    def test_hook_after_fork(self):
+        from leads_api.prefork import add_worker_hook, post_fork
+
+        config = self.make_app({'prefork': 'true'})
+        called = []
+        add_worker_hook(config, called.append)
+        app = config.make_wsgi_app()
+        self.assertEqual(called, [])
+
+        # The hook should run in the worker, once the master's connections are left
+        post_fork(app)
+        self.assertEqual(called, [app])
+        self.assertEqual(app.registry['dbengine'].disposed, [False])
+
+
+class WarmupTests(unittest.TestCase):
+    """Unit tests for the worker warm-up"""
+
+    def test_read_hot_keys(self):
+        import os
+        import tempfile
+        from leads_api.warmup import read_hot_keys
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'keys.txt')
+            with open(path, 'w') as f:
+                f.write('# tier make zipcode\nbuyer-1-blind ford 10001\n\nbuyer-2-gold fiat  90210\n')
+            self.assertEqual(read_hot_keys(path), [
+                ('buyer-1-blind', 'ford', '10001'),
+                ('buyer-2-gold', 'fiat', '90210'),
+            ])
+
+    def test_warm_up(self):
+        import os
+        import tempfile
+        from pyramid.response import Response
+        from leads_api.metrics import Metrics
+        from leads_api.warmup import warm_up
+
+        class Pool:
+            def size(self):
+                return 2
+
+        class Connection:
+            def __init__(self, opened):
+                self.opened = opened
+
+            def exec_driver_sql(self, sql):
+                self.opened.append(sql)
+
+            def close(self):
+                self.opened.remove('SELECT 1')
+
+        class Engine:
+            pool = Pool()
+
+            def __init__(self):
+                self.opened = []
+                self.max_opened = 0
+
+            def connect(self):
+                self.max_opened = max(self.max_opened, len(self.opened) + 1)
+                return Connection(self.opened)
+
+        class DummySession:
+            def rollback(self):
+                pass
+
+            def close(self):
+                pass
+
+        class CoverageEngine:
+            def __init__(self):
+                self.lookups = []
+
+            def lookup(self, request, tier, make, zipcode, limit, dealers=None):
+                self.lookups.append((tier, make, zipcode))
+                return []
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'keys.txt')
+            with open(path, 'w') as f:
+                f.write('buyer-1-blind ford 10001\n')
+            config = testing.setUp(settings={'warmup.keys_file': path})
+            self.addCleanup(testing.tearDown)
+            registry = config.registry
+            registry['dbengine'] = Engine()
+            registry['dbsession_factory'] = DummySession
+            registry['coverage_engine'] = CoverageEngine()
+            registry['metrics'] = Metrics()
+
+            requested = []
+            statuses = [503, 200]
+
+            def coverage(request):
+                requested.append((request.path, request.GET['zipcode']))
+                return Response(status=statuses.pop(0))
+            config.add_route('coverage', '/v1/buyers_tiers/{tier}/makes/{make}/coverage')
+            config.add_view(coverage, route_name='coverage')
+            app = config.make_wsgi_app()
+
+            # Hot keys answered with errors shouldn't count as warmed up
+            with self.assertLogs('leads_api.warmup', level='ERROR'):
+                self.assertFalse(warm_up(app))
+            self.assertNotIn('warmed_up', registry)
+            self.assertTrue(warm_up(app))
+
+        # Every pool connection should be opened at the same time
+        self.assertEqual(registry['dbengine'].max_opened, 2)
+        self.assertEqual(registry['coverage_engine'].lookups[-1], ('buyer-1-blind', 'ford', '10001'))
+        self.assertEqual(requested[-1], ('/v1/buyers_tiers/buyer-1-blind/makes/ford/coverage', '10001'))
+        self.assertIn('warmup.seconds', registry['metrics'].snapshot())
+        self.assertTrue(registry['warmed_up'])
+
+    def test_warm_up_failed(self):
+        from leads_api.metrics import Metrics
+        from leads_api.warmup import pool_size, warm_up
+
+        class Pool:
+            """Pool without a size, like `NullPool`"""
+
+        class Engine:
+            pool = Pool()
+
+            def connect(self):
+                raise ConnectionError('Database unavailable')
+
+        config = testing.setUp()
+        self.addCleanup(testing.tearDown)
+        registry = config.registry
+        registry['dbengine'] = Engine()
+        registry['metrics'] = Metrics()
+        self.assertEqual(pool_size(registry['dbengine']), 0)
+
+        # A worker that couldn't warm up shouldn't be reported ready
+        with self.assertLogs('leads_api.warmup', level='ERROR'):
+            self.assertFalse(warm_up(config.make_wsgi_app()))
+        self.assertNotIn('warmed_up', registry)
+        self.assertEqual(registry['metrics'].snapshot()['warmup.failures'], 1)
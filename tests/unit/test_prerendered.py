@@ -0,0 +1,58 @@
+import unittest
+
+from pyramid import testing
+
+
+class PrerenderedTests(unittest.TestCase):
+    """Unit tests for the pre-rendered coverage responses"""
+
+    def setUp(self):
+        self.config = testing.setUp()
+        self.config.include('leads_api.metrics')
+        self.addCleanup(testing.tearDown)
+
+    def test_is_prerendered(self):
+        from leads_api.prerendered import is_prerendered
+
+        # Only the requests without filters and with the default limit
+        self.assertTrue(is_prerendered(3))
+        self.assertFalse(is_prerendered(5))
+        self.assertFalse(is_prerendered(3, year='2020'))
+        self.assertFalse(is_prerendered(3, model='civic'))
+
+    def test_disabled(self):
+        from leads_api.prerendered import get_prerendered
+
+        self.config.include('leads_api.prerendered')
+        request = testing.DummyRequest()
+        request.dbsession = None
+
+        # Should not query the database
+        self.assertIsNone(get_prerendered(request, 'buyer-1-blind', 'honda', '10010'))
+
+    def test_lookup(self):
+        from leads_api.prerendered import get_prerendered
+
+        self.config.registry.settings['coverage.prerendered'] = 'true'
+        self.config.include('leads_api.prerendered')
+        results = iter([memoryview(b'{"has_coverage":true}'), None])
+
+        class DummyResult:
+            def scalar(self):
+                return next(results)
+
+        class DummySession:
+            def execute(self, statement):
+                return DummyResult()
+
+        request = testing.DummyRequest()
+        request.dbsession = DummySession()
+
+        # Should return the stored bytes, and count hits and misses
+        self.assertEqual(
+            get_prerendered(request, 'buyer-1-blind', 'honda', '10010'), b'{"has_coverage":true}'
+        )
+        self.assertIsNone(get_prerendered(request, 'buyer-1-blind', 'honda', '99999'))
+        metrics = self.config.registry['metrics'].snapshot()
+        self.assertEqual(metrics['prerendered.hits'], 1)
+        self.assertEqual(metrics['prerendered.misses'], 1)
@@ -0,0 +1,262 @@
+import unittest
+
+
+class ReloadTablesTests(unittest.TestCase):
+    """Unit tests for the statements used by the shadow tables reload"""
+
+    def test_shadow_table(self):
+        from sqlalchemy.dialects import postgresql
+        from sqlalchemy.schema import CreateTable
+        from reload_tables import shadow_table
+        from leads_api.models.tables import buyer_tier_dealer_coverage
+
+        shadow = shadow_table(buyer_tier_dealer_coverage)
+        ddl = str(CreateTable(shadow).compile(dialect=postgresql.dialect()))
+
+        # Should be an unlogged table with the same columns but no primary key
+        self.assertIn('CREATE UNLOGGED TABLE public.buyer_tier_dealer_coverage_shadow', ddl)
+        self.assertEqual(
+            [column.name for column in shadow.columns],
+            [column.name for column in buyer_tier_dealer_coverage.columns],
+        )
+        self.assertNotIn('PRIMARY KEY', ddl)
+
+    def test_swap_statements(self):
+        from reload_tables import shadow_table, swap_statements
+        from leads_api.models.tables import buyer_tier_dealer_coverage
+
+        statements = swap_statements(
+            buyer_tier_dealer_coverage, shadow_table(buyer_tier_dealer_coverage)
+        )
+
+        # Should lock both tables first, and then only rename them and their keys
+        self.assertTrue(statements[0].startswith('LOCK TABLE'))
+        self.assertIn(
+            'ALTER TABLE public.buyer_tier_dealer_coverage_shadow '
+            'RENAME TO buyer_tier_dealer_coverage',
+            statements,
+        )
+        self.assertIn(
+            'ALTER TABLE public.buyer_tier_dealer_coverage RENAME CONSTRAINT '
+            'buyer_tier_dealer_coverage_shadow_pkey TO buyer_tier_dealer_coverage_pkey',
+            statements,
+        )
+        for statement in statements[1:]:
+            self.assertTrue(statement.startswith(('ALTER TABLE', 'ALTER INDEX')))
+
+    def test_shadow_constraints(self):
+        from sqlalchemy.dialects import postgresql
+        from sqlalchemy.schema import CreateTable
+        from reload_tables import (
+            index_statements,
+            partition_column,
+            referenced_tables,
+            shadow_table,
+            table_constraints,
+            unsupported_constraints,
+            view_tables,
+        )
+        from leads_api.models.tables import metadata
+
+        def lines(table):
+            ddl = str(CreateTable(table).compile(dialect=postgresql.dialect()))
+            return sorted(
+                line.strip().rstrip(',') for line in ddl.splitlines()[2:-2]
+                if not line.strip().startswith('PRIMARY KEY')
+            )
+
+        swappable = [
+            table for table in metadata.sorted_tables
+            if table.name not in referenced_tables() | view_tables()
+            and partition_column(table) is None
+        ]
+        self.assertIn('legacy_buyer_tier', [table.name for table in swappable])
+        for table in swappable:
+            self.assertEqual(unsupported_constraints(table), [])
+            names = {
+                constraint: f'{table.name}_{number}_key'
+                for number, constraint in enumerate(table_constraints(table))
+            }
+            shadow = shadow_table(table)
+            statements = index_statements(table, shadow, names)
+
+            # The shadow with its constraints should be the same as the table
+            constraints = [
+                statement.split(' ', 6)[-1] for statement in statements
+                if statement.startswith(f'ALTER TABLE {shadow.fullname} ADD CONSTRAINT')
+            ]
+            self.assertEqual(constraints[0].split(' ', 1)[0], 'PRIMARY')
+            self.assertEqual(sorted(lines(shadow) + constraints[1:]), lines(table))
+
+    def test_constraint_names(self):
+        from reload_tables import shadow_table, suffixed_name, swap_statements, table_constraints
+        from leads_api.models.tables import legacy_buyer_tier
+
+        names = {
+            constraint: f'legacy_buyer_tier_{number}_key'
+            for number, constraint in enumerate(table_constraints(legacy_buyer_tier))
+        }
+        self.assertEqual(len(names), 3)
+        statements = swap_statements(legacy_buyer_tier, shadow_table(legacy_buyer_tier), names)
+
+        # The constraints of the shadow should end up with the names of the table ones
+        self.assertIn(
+            'ALTER TABLE public.legacy_buyer_tier RENAME CONSTRAINT '
+            'legacy_buyer_tier_0_key_shadow TO legacy_buyer_tier_0_key',
+            statements,
+        )
+        self.assertIn(
+            'ALTER TABLE public.legacy_buyer_tier_old RENAME CONSTRAINT '
+            'legacy_buyer_tier_2_key TO legacy_buyer_tier_2_key_old',
+            statements,
+        )
+
+        # Long names should be shortened without colliding
+        long_names = ['a' * 60 + '_fkey', 'a' * 60 + '_fkey1']
+        shadow_names = [suffixed_name(name, '_shadow') for name in long_names]
+        self.assertTrue(all(len(name) <= 63 for name in shadow_names))
+        self.assertNotEqual(*shadow_names)
+        self.assertTrue(shadow_names[0].endswith('_shadow'))
+
+    def test_referenced_tables(self):
+        from reload_tables import referenced_tables
+
+        referenced = referenced_tables()
+        self.assertIn('buyer', referenced)
+        self.assertNotIn('buyer_tier_dealer_coverage', referenced)
+
+    def test_encode_statements(self):
+        from reload_tables import (
+            encode_statement,
+            shadow_table,
+            source_table,
+            zipcodes_statement,
+        )
+        from leads_api.models.tables import buyer_dealer, buyer_tier_dealer_coverage
+
+        # Only the coverage files need to be encoded
+        self.assertIsNone(source_table(buyer_dealer))
+
+        source = source_table(buyer_tier_dealer_coverage)
+        self.assertEqual(
+            [column.name for column in source.columns],
+            ['buyer_tier_slug', 'dealer_code', 'zipcode', 'distance'],
+        )
+        self.assertTrue(zipcodes_statement(source).startswith('INSERT INTO public.zipcode (code)'))
+
+        # Should translate the slugs to ids, sorted so the rows of a lookup are together
+        statement = encode_statement(source, shadow_table(buyer_tier_dealer_coverage))
+        self.assertIn(
+            'INSERT INTO public.buyer_tier_dealer_coverage_shadow '
+            '(buyer_tier_id, zipcode_id, dealer_id, distance)',
+            statement,
+        )
+        self.assertIn('FROM public.buyer_tier_dealer_coverage_source AS s', statement)
+        self.assertNotIn('WHERE', statement)
+        self.assertTrue(statement.endswith('ORDER BY t.id, z.id, s.distance'))
+
+        # Or only the rows of a tier
+        statement = encode_statement(source, shadow_table(buyer_tier_dealer_coverage), 7)
+        self.assertIn('WHERE t.id = 7 ORDER BY', statement)
+
+    def test_partition_table(self):
+        from reload_tables import index_statements, partition_column, partition_table, shadow_table
+        from leads_api.models.tables import buyer_dealer, buyer_tier_dealer_coverage
+
+        self.assertIsNone(partition_column(buyer_dealer))
+        self.assertEqual(partition_column(buyer_tier_dealer_coverage), 'buyer_tier_id')
+
+        partition = partition_table(buyer_tier_dealer_coverage, 7)
+        self.assertEqual(partition.fullname, 'public.buyer_tier_dealer_coverage_7')
+        self.assertEqual(
+            [column.name for column in partition.primary_key.columns],
+            [column.name for column in buyer_tier_dealer_coverage.primary_key.columns],
+        )
+        self.assertEqual(
+            index_statements(partition, shadow_table(partition))[0],
+            'ALTER TABLE public.buyer_tier_dealer_coverage_7_shadow ADD CONSTRAINT '
+            'buyer_tier_dealer_coverage_7_shadow_pkey '
+            'PRIMARY KEY (buyer_tier_id, zipcode_id, dealer_id)',
+        )
+
+        # The index the partition is clustered on is built before it's attached
+        self.assertIn(
+            'CREATE INDEX buyer_tier_dealer_coverage_zipcode_distance_idx_7_shadow '
+            'ON public.buyer_tier_dealer_coverage_7_shadow (zipcode_id, distance)',
+            index_statements(partition, shadow_table(partition)),
+        )
+
+    def test_partition_swap_statements(self):
+        from reload_tables import partition_swap_statements, partition_table, shadow_table
+        from leads_api.models.tables import buyer_tier_dealer_coverage as coverage
+
+        partition = partition_table(coverage, 7)
+        shadow = shadow_table(partition)
+
+        # Should detach and rename the current partition, then attach the shadow
+        statements = partition_swap_statements(coverage, partition, shadow, 7, True, None)
+        self.assertTrue(statements[0].startswith('LOCK TABLE public.buyer_tier_dealer_coverage,'))
+        self.assertEqual(
+            statements[1],
+            'ALTER TABLE public.buyer_tier_dealer_coverage '
+            'DETACH PARTITION public.buyer_tier_dealer_coverage_7',
+        )
+        self.assertIn(
+            'ALTER TABLE public.buyer_tier_dealer_coverage_7 RENAME TO buyer_tier_dealer_coverage_7_old',
+            statements,
+        )
+        self.assertIn(
+            'ALTER TABLE public.buyer_tier_dealer_coverage_7_shadow '
+            'RENAME TO buyer_tier_dealer_coverage_7',
+            statements,
+        )
+        self.assertEqual(statements[-2:], [
+            'ALTER TABLE public.buyer_tier_dealer_coverage '
+            'ATTACH PARTITION public.buyer_tier_dealer_coverage_7 FOR VALUES IN (7)',
+            'ALTER TABLE public.buyer_tier_dealer_coverage_7 '
+            'DROP CONSTRAINT buyer_tier_dealer_coverage_7_shadow_bound',
+        ])
+
+        # The CHECK constraint excluding the tier from the default partition is
+        # dropped once the partition is attached
+        default = 'public.buyer_tier_dealer_coverage_default'
+        statements = partition_swap_statements(coverage, partition, shadow, 7, False, default)
+        self.assertFalse(any('DETACH' in statement for statement in statements))
+        self.assertFalse(any('DELETE' in statement for statement in statements))
+        self.assertEqual(
+            statements[-1],
+            f'ALTER TABLE {default} DROP CONSTRAINT buyer_tier_dealer_coverage_default_not_7',
+        )
+
+        # The rows of the tier still in the default partition are deleted by the
+        # swap itself, under the lock
+        statements = partition_swap_statements(
+            coverage, partition, shadow, 7, False, default, in_default=True
+        )
+        self.assertEqual(statements[1], f'DELETE FROM {default} WHERE buyer_tier_id = 7')
+        self.assertFalse(any('default_not_7' in statement for statement in statements))
+
+    def test_default_partition_statements(self):
+        from reload_tables import default_partition_statements, restore_default_statements
+        from leads_api.models.tables import buyer_tier_dealer_coverage as coverage
+
+        default = 'public.buyer_tier_dealer_coverage_default'
+        add, validate = default_partition_statements(coverage, 7, default)
+
+        # A valid CHECK constraint lets ATTACH skip the scan of the default
+        # partition, nothing is deleted before the swap
+        self.assertFalse(any('DELETE' in statement for statement in add + validate))
+        self.assertEqual(
+            add[-1],
+            f'ALTER TABLE {default} ADD CONSTRAINT buyer_tier_dealer_coverage_default_not_7 '
+            'CHECK (buyer_tier_id <> 7) NOT VALID',
+        )
+        self.assertEqual(validate, [
+            f'ALTER TABLE {default} VALIDATE CONSTRAINT buyer_tier_dealer_coverage_default_not_7',
+        ])
+
+        # If the swap fails only the constraint is dropped
+        self.assertEqual(restore_default_statements(coverage, 7, default), [
+            f'ALTER TABLE {default} DROP CONSTRAINT IF EXISTS '
+            'buyer_tier_dealer_coverage_default_not_7',
+        ])
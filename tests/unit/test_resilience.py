@@ -0,0 +1,286 @@
+import time
+import unittest
+
+from pyramid import testing
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class CoverageEngine:
+    def __init__(self):
+        self.queries = 0
+
+    def lookup(self, request, buyer_tier, make, zipcode, limit, dealers=None, after=None):
+        self.queries += 1
+        return [{'dealer_code': 'dealer-a', 'zipcode': zipcode, 'query': self.queries}]
+
+
+class DummySession:
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class CircuitBreakerTests(unittest.TestCase):
+    """Unit tests for the transitions of the circuit breaker"""
+
+    def make_breaker(self, **kwargs):
+        from leads_api.resilience import CircuitBreaker
+
+        clock = Clock()
+        options = dict(window=4, min_calls=4, error_rate=0.5, slow_call_seconds=1,
+                       slow_call_rate=0.75, open_seconds=10, clock=clock)
+        options.update(kwargs)
+        return CircuitBreaker(**options), clock
+
+    def test_error_rate(self):
+        breaker, clock = self.make_breaker()
+        for failed in (False, True, False):
+            self.assertTrue(breaker.allow())
+            breaker.record(0.01, failed=failed)
+        # Not enough calls yet
+        self.assertEqual(breaker.state, breaker.CLOSED)
+        breaker.record(0.01, failed=True)
+        self.assertEqual(breaker.state, breaker.OPEN)
+        self.assertFalse(breaker.allow())
+        self.assertTrue(breaker.is_open())
+
+    def test_slow_calls(self):
+        breaker, clock = self.make_breaker()
+        for seconds in (2, 2, 0.01, 2):
+            breaker.record(seconds)
+        self.assertEqual(breaker.state, breaker.OPEN)
+
+    def test_half_open(self):
+        breaker, clock = self.make_breaker()
+        for _ in range(4):
+            breaker.record(0.01, failed=True)
+        self.assertFalse(breaker.allow())
+
+        # A single call should be let through once open long enough
+        clock.now = 10
+        self.assertFalse(breaker.is_open())
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        self.assertTrue(breaker.is_open())
+
+        # Opens again if it fails
+        breaker.record(0.01, failed=True)
+        self.assertEqual(breaker.state, breaker.OPEN)
+        self.assertFalse(breaker.allow())
+
+        # Closes if it succeeds
+        clock.now = 20
+        self.assertTrue(breaker.allow())
+        breaker.record(0.01)
+        self.assertEqual(breaker.state, breaker.CLOSED)
+        self.assertTrue(breaker.allow())
+        self.assertTrue(breaker.allow())
+
+
+class ResilientCoverageEngineTests(unittest.TestCase):
+    """Unit tests for serving stale rows when the database fails"""
+
+    def setUp(self):
+        self.config = testing.setUp()
+        self.config.include('leads_api.metrics')
+        self.registry = self.config.registry
+        self.registry['dbsession_factory'] = DummySession
+        self.addCleanup(testing.tearDown)
+
+    def make_engine(self):
+        from leads_api.engines.faults import FaultInjectingCoverageEngine
+        from leads_api.resilience import (
+            BreakerRecordingEngine,
+            CircuitBreaker,
+            ResilientCoverageEngine,
+        )
+
+        self.clock = Clock()
+        breaker = CircuitBreaker(window=4, min_calls=4, open_seconds=10, clock=self.clock)
+        self.faults = FaultInjectingCoverageEngine(CoverageEngine(), seed=0)
+        return ResilientCoverageEngine(
+            BreakerRecordingEngine(self.faults, breaker), self.registry, breaker, clock=self.clock,
+        )
+
+    def test_stale(self):
+        from leads_api.tweens import METADATA_KEY
+
+        engine = self.make_engine()
+        request = testing.DummyRequest()
+        rows = engine.lookup(request, 'b1-blind', 'honda', '10010', 3)
+        self.assertEqual(rows[0]['query'], 1)
+        self.assertNotIn(METADATA_KEY, request.environ)
+
+        # Failed lookups should be answered with the previous rows
+        self.faults.error_rate = 1
+        self.clock.now = 5
+        request = testing.DummyRequest()
+        rows = engine.lookup(request, 'b1-blind', 'honda', '10010', 3)
+        self.assertEqual(rows[0]['query'], 1)
+        self.assertEqual(request.environ[METADATA_KEY], {'stale': True, 'stale_seconds': 5})
+
+        # Other keys still get the error
+        from sqlalchemy.exc import OperationalError
+        with self.assertRaises(OperationalError):
+            engine.lookup(testing.DummyRequest(), 'b1-blind', 'honda', '10011', 3)
+
+    def test_open(self):
+        from pyramid.httpexceptions import HTTPServiceUnavailable
+
+        engine = self.make_engine()
+        engine.revalidator.submit = lambda key: None
+        engine.lookup(testing.DummyRequest(), 'b1-blind', 'honda', '10010', 3)
+        self.faults.error_rate = 1
+        for _ in range(3):
+            engine.lookup(testing.DummyRequest(), 'b1-blind', 'honda', '10010', 3)
+        self.assertEqual(engine.breaker.state, engine.breaker.OPEN)
+
+        # While open the database shouldn't be called at all
+        self.faults.error_rate = 0
+        queries = self.faults.engine.queries
+        rows = engine.lookup(testing.DummyRequest(), 'b1-blind', 'honda', '10010', 3)
+        self.assertEqual(rows[0]['query'], 1)
+        with self.assertRaises(HTTPServiceUnavailable) as raised:
+            engine.lookup(testing.DummyRequest(), 'b1-blind', 'honda', '10011', 3)
+        self.assertEqual(raised.exception.json_body[0]['exception'], 'CircuitOpen')
+        self.assertEqual(raised.exception.headers['Retry-After'], '10')
+        self.assertEqual(self.faults.engine.queries, queries)
+
+        metrics = self.registry['metrics'].snapshot()
+        self.assertEqual(metrics['circuit_breaker.rejected'], 2)
+        self.assertEqual(metrics['circuit_breaker.stale'], 4)
+
+    def test_revalidate(self):
+        engine = self.make_engine()
+        submitted = []
+        submit, engine.revalidator.submit = engine.revalidator.submit, submitted.append
+        key = ('b1-blind', 'honda', '10010', 3, None, None)
+        engine.lookup(testing.DummyRequest(), *key[:4])
+        self.faults.error_rate = 1
+        engine.lookup(testing.DummyRequest(), *key[:4])
+        self.assertEqual(submitted, [key])
+
+        # The stale rows should be refreshed in the background once it recovers
+        self.faults.error_rate = 0
+        submit(key)
+        deadline = time.monotonic() + 5
+        while engine.cache.get(key)[0][0]['query'] == 1 and time.monotonic() < deadline:
+            time.sleep(0.001)
+        rows, _ = engine.cache.get(key)
+        self.assertEqual(rows[0]['query'], 2)
+
+
+    def test_prerendered(self):
+        from sqlalchemy.exc import OperationalError
+        from leads_api.tweens import METADATA_KEY
+
+        engine = self.make_engine()
+        key = ('b1-blind', 'honda', '10010')
+
+        def fail():
+            raise OperationalError('coverage_response', {}, Exception('Database error'))
+
+        # Reads should be recorded in the breaker like the lookups
+        request = testing.DummyRequest()
+        self.assertEqual(engine.read_prerendered(request, key, lambda: b'{}'), b'{}')
+        self.assertEqual(list(engine.breaker.calls), [(False, False)])
+        self.assertNotIn(METADATA_KEY, request.environ)
+
+        # Failed reads should be answered with the previous response
+        self.clock.now = 5
+        request = testing.DummyRequest()
+        self.assertEqual(engine.read_prerendered(request, key, fail), b'{}')
+        self.assertEqual(request.environ[METADATA_KEY], {'stale': True, 'stale_seconds': 5})
+        with self.assertRaises(OperationalError):
+            engine.read_prerendered(testing.DummyRequest(), ('b1-blind', 'honda', '10011'), fail)
+
+        # Failures should open the circuit, then the database isn't read at all
+        engine.read_prerendered(testing.DummyRequest(), key, fail)
+        self.assertEqual(engine.breaker.state, engine.breaker.OPEN)
+        self.assertEqual(engine.read_prerendered(testing.DummyRequest(), key, fail), b'{}')
+        self.assertIsNone(
+            engine.read_prerendered(testing.DummyRequest(), ('b1-blind', 'honda', '10011'), fail)
+        )
+
+
+class BreakerRecordingEngineTests(unittest.TestCase):
+    """Unit tests for the lookups recorded in the circuit breaker"""
+
+    def test_deadline(self):
+        from sqlalchemy.exc import OperationalError
+        from leads_api.resilience import BreakerRecordingEngine, CircuitBreaker
+        from leads_api.timeouts import STATEMENT_TIMEOUT_KEY
+
+        class Canceled(Exception):
+            pgcode = '57014'
+
+        class CanceledEngine:
+            def lookup(self, request, *args, **kwargs):
+                raise OperationalError('coverage lookup', {}, Canceled())
+
+        breaker = CircuitBreaker()
+        engine = BreakerRecordingEngine(CanceledEngine(), breaker)
+
+        # Queries cancelled at the deadline of the client aren't failures
+        request = testing.DummyRequest()
+        request.environ[STATEMENT_TIMEOUT_KEY] = (100, 'deadline')
+        with self.assertRaises(OperationalError):
+            engine.lookup(request, 'b1-blind', 'honda', '10010', 3)
+        self.assertEqual(len(breaker.calls), 0)
+
+        # While the ones cancelled by the timeout of the route are
+        request.environ[STATEMENT_TIMEOUT_KEY] = (100, 'route')
+        with self.assertRaises(OperationalError):
+            engine.lookup(request, 'b1-blind', 'honda', '10010', 3)
+        self.assertEqual(list(breaker.calls), [(True, False)])
+
+
+class RetryBudgetTweenTests(unittest.TestCase):
+    """Unit tests for the cap of the retried requests"""
+
+    def setUp(self):
+        from leads_api.resilience import RetryBudget
+
+        self.config = testing.setUp()
+        self.config.include('leads_api.metrics')
+        self.clock = Clock()
+        self.config.registry['retry_budget'] = RetryBudget(1, 2, clock=self.clock)
+        self.addCleanup(testing.tearDown)
+
+    def failing_request(self, tween):
+        from pyramid_retry import RetryableException
+
+        request = testing.DummyRequest(environ={'retry.attempt': 0, 'retry.attempts': 3})
+        with self.assertRaises(RetryableException):
+            tween(request)
+        return request
+
+    def test_budget(self):
+        from pyramid_retry import RetryableException, is_last_attempt
+        from leads_api.resilience import retry_budget_tween
+
+        def handler(request):
+            raise RetryableException()
+        tween = retry_budget_tween(handler, self.config.registry)
+
+        # The burst should be retried, then requests fail at once
+        self.assertFalse(is_last_attempt(self.failing_request(tween)))
+        self.assertFalse(is_last_attempt(self.failing_request(tween)))
+        self.assertTrue(is_last_attempt(self.failing_request(tween)))
+
+        # The budget refills over time
+        self.clock.now = 1
+        self.assertFalse(is_last_attempt(self.failing_request(tween)))
+
+        metrics = self.config.registry['metrics'].snapshot()
+        self.assertEqual(metrics['retry.retries'], 3)
+        self.assertEqual(metrics['retry.budget_exhausted'], 1)
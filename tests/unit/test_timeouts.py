@@ -0,0 +1,131 @@
+import time
+import unittest
+
+from pyramid import testing
+
+
+class QueryCanceled(Exception):
+    pgcode = '57014'
+
+
+class StatementTimeoutTests(unittest.TestCase):
+    """Unit tests for the statement timeout of the requests"""
+
+    def setUp(self):
+        from leads_api.timeouts import parse_route_timeouts
+
+        self.config = testing.setUp()
+        self.addCleanup(testing.tearDown)
+        registry = self.config.registry
+        registry['default_statement_timeout'] = 0
+        registry['route_statement_timeouts'] = parse_route_timeouts(
+            'v1_buyers_tiers_makes_coverage=2000\nv1_buyers_tiers_coverage_export = 0'
+        )
+
+    def request(self, route_name, deadline=None):
+        from leads_api.timeouts import DEADLINE_KEY
+
+        request = testing.DummyRequest()
+        request.matched_route = testing.DummyResource(name=route_name)
+        if deadline is not None:
+            request.environ[DEADLINE_KEY] = time.monotonic() + deadline
+        return request
+
+    def test_route(self):
+        from leads_api.timeouts import STATEMENT_TIMEOUT_KEY, statement_timeout
+
+        request = self.request('v1_buyers_tiers_makes_coverage')
+        self.assertEqual(statement_timeout(request), 2000)
+        self.assertEqual(request.environ[STATEMENT_TIMEOUT_KEY], (2000, 'route'))
+
+        # Without timeout
+        self.assertIsNone(statement_timeout(self.request('v1_buyers_tiers_coverage_export')))
+        self.assertIsNone(statement_timeout(self.request('metrics')))
+        self.config.registry['default_statement_timeout'] = 500
+        self.assertEqual(statement_timeout(self.request('metrics')), 500)
+
+    def test_deadline(self):
+        from leads_api.timeouts import STATEMENT_TIMEOUT_KEY, DeadlineExceeded, statement_timeout
+
+        # The deadline should shorten the timeout of the route, never extend it
+        request = self.request('v1_buyers_tiers_makes_coverage', deadline=0.5)
+        self.assertTrue(0 < statement_timeout(request) <= 500)
+        self.assertEqual(request.environ[STATEMENT_TIMEOUT_KEY][1], 'deadline')
+        request = self.request('v1_buyers_tiers_makes_coverage', deadline=5)
+        self.assertEqual(statement_timeout(request), 2000)
+        request = self.request('v1_buyers_tiers_coverage_export', deadline=5)
+        self.assertTrue(4000 < statement_timeout(request) <= 5000)
+
+        with self.assertRaises(DeadlineExceeded):
+            statement_timeout(self.request('v1_buyers_tiers_makes_coverage', deadline=-1))
+
+
+class TimeoutTweenTests(unittest.TestCase):
+    """Unit tests for the answers of the requests that timed out"""
+
+    def setUp(self):
+        self.config = testing.setUp()
+        self.config.include('leads_api.metrics')
+        self.config.registry['deadline_header'] = 'X-Request-Timeout'
+        self.addCleanup(testing.tearDown)
+
+    def get(self, handler, headers=None):
+        from pyramid.request import Request
+        from leads_api.timeouts import timeout_tween
+
+        request = Request.blank('/', headers=headers or {})
+        request.registry = self.config.registry
+        return timeout_tween(handler, self.config.registry)(request)
+
+    def test_deadline_passed(self):
+        calls = []
+        response = self.get(calls.append, {'X-Request-Timeout': '0'})
+
+        # Should be answered without handling it
+        self.assertEqual(calls, [])
+        self.assertEqual(response.status_code, 504)
+        self.assertEqual(response.json[0]['exception'], 'DeadlineExceeded')
+        self.assertEqual(self.config.registry['metrics'].snapshot()['timeouts.deadline'], 1)
+
+    def test_statement_timeout(self):
+        from sqlalchemy.exc import OperationalError
+        from leads_api.timeouts import DEADLINE_KEY, STATEMENT_TIMEOUT_KEY
+
+        def handler(request):
+            source = 'deadline' if DEADLINE_KEY in request.environ else 'route'
+            request.environ[STATEMENT_TIMEOUT_KEY] = (100, source)
+            raise OperationalError('SELECT', {}, QueryCanceled())
+
+        response = self.get(handler)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json[0]['exception'], 'StatementTimeout')
+
+        # Cancelled by the deadline of the client
+        response = self.get(handler, {'X-Request-Timeout': '100'})
+        self.assertEqual(response.status_code, 504)
+
+        metrics = self.config.registry['metrics'].snapshot()
+        self.assertEqual(metrics['timeouts.statement'], 1)
+        self.assertEqual(metrics['timeouts.deadline'], 1)
+
+    def test_other_errors(self):
+        from sqlalchemy.exc import OperationalError
+
+        def handler(request):
+            raise OperationalError('SELECT', {}, Exception('Connection refused'))
+
+        with self.assertRaises(OperationalError):
+            self.get(handler, {'X-Request-Timeout': 'soon'})
+
+    def test_tween_order(self):
+        from pyramid.interfaces import ITweens
+        from pyramid.paster import get_appsettings
+        from leads_api import main
+
+        app = main({}, **get_appsettings('testing.ini'))
+        names = [name for name, _ in app.registry.queryUtility(ITweens).implicit()]
+
+        # In the envelope, out of the response validation
+        index = names.index('leads_api.timeouts.timeout_tween')
+        self.assertEqual(names[index - 1], 'leads_api.tweens.base_response_tween')
+        self.assertEqual(names[index + 1], 'pyramid_openapi3.tween.response_tween_factory')
@@ -0,0 +1,223 @@
+import unittest
+
+from pyramid import testing
+
+
+class HTTPCacheTweenTests(unittest.TestCase):
+    """Unit tests for the conditional requests tween"""
+
+    def setUp(self):
+        self.config = testing.setUp(settings={'http_cache.enabled': 'true'})
+        self.config.include('leads_api.metrics')
+        self.config.include('leads_api.data_version')
+        self.addCleanup(testing.tearDown)
+        self.calls = []
+
+    def handler(self, request):
+        from pyramid.response import Response
+
+        self.calls.append(request)
+        return Response(json={'ok': True})
+
+    def tween(self):
+        from leads_api.tweens import http_cache_tween
+        return http_cache_tween(self.handler, self.config.registry)
+
+    def request(self, path='/v1/coverage?zipcode=10010&make=ford', **kwargs):
+        from pyramid.request import Request
+        return Request.blank(path, **kwargs)
+
+    def test_disabled(self):
+        from leads_api.tweens import http_cache_tween
+
+        self.config.registry.settings['http_cache.enabled'] = 'false'
+
+        # Should not wrap the handler
+        self.assertEqual(http_cache_tween(self.handler, self.config.registry), self.handler)
+
+    def test_unknown_version(self):
+        response = self.tween()(self.request())
+
+        # Nothing can be cached without data version
+        self.assertIsNone(response.etag)
+        self.assertIsNone(response.cache_control.max_age)
+
+    def test_not_modified(self):
+        self.config.registry['data_version'].update('1')
+        tween = self.tween()
+
+        response = tween(self.request())
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(response.etag)
+        self.assertIsNotNone(response.last_modified)
+        self.assertEqual(response.cache_control.max_age, 60)
+
+        # Params order should not change the ETag
+        response = tween(self.request(
+            '/v1/coverage?make=ford&zipcode=10010',
+            headers={'If-None-Match': f'"{response.etag}"'},
+        ))
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(
+            self.config.registry['metrics'].snapshot()['http_cache.not_modified'], 1
+        )
+
+    def test_any_etag(self):
+        self.config.registry['data_version'].update('1')
+
+        # The wildcard shouldn't answer 304 for representations that may not exist
+        response = self.tween()(self.request(headers={'If-None-Match': '*'}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.calls), 1)
+
+    def test_version_change(self):
+        self.config.registry['data_version'].update('1')
+        tween = self.tween()
+        etag = tween(self.request()).etag
+
+        # A new data version invalidates the previous ETags
+        self.config.registry['data_version'].update('2')
+        response = tween(self.request(headers={'If-None-Match': f'"{etag}"'}))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.etag, etag)
+
+    def test_other_params(self):
+        self.config.registry['data_version'].update('1')
+        tween = self.tween()
+        etag = tween(self.request()).etag
+
+        response = tween(self.request(
+            '/v1/coverage?zipcode=90001&make=ford',
+            headers={'If-None-Match': f'"{etag}"'},
+        ))
+        self.assertEqual(response.status_code, 200)
+
+
+class BaseResponseTweenTests(unittest.TestCase):
+    """Unit tests for the response envelope tween"""
+
+    def request(self):
+        from pyramid.request import Request
+        return Request.blank('/v1/coverage?zipcode=10010')
+
+    def test_prerendered(self):
+        from pyramid.response import Response
+        from leads_api.prerendered import PrerenderedResponse
+        from leads_api.tweens import base_response_tween
+
+        data = {'has_coverage': True, 'buyer': 'Buyer 1', 'coverage': [{'distance': 3}]}
+        dynamic = base_response_tween(lambda request: Response(json=data), None)(self.request())
+        prerendered = base_response_tween(
+            lambda request: PrerenderedResponse(b'{"has_coverage":true,"buyer":"Buyer 1",'
+                                                b'"coverage":[{"distance":3}]}'),
+            None,
+        )(self.request())
+
+        # Should splice the pre-rendered data into the same envelope
+        self.assertEqual(prerendered.body, dynamic.body)
+        self.assertEqual(prerendered.content_type, 'application/json')
+
+    def test_prerendered_metadata(self):
+        import json
+        from leads_api.prerendered import PrerenderedResponse
+        from leads_api.tweens import add_metadata, base_response_tween
+
+        def handler(request):
+            add_metadata(request, stale=True, stale_seconds=5)
+            return PrerenderedResponse(b'{"has_coverage":false}')
+        response = base_response_tween(handler, None)(self.request())
+
+        # The metadata added while handling the request should be kept
+        self.assertEqual(json.loads(response.body)['metadata'], {
+            'params': {'zipcode': '10010'},
+            'stale': True,
+            'stale_seconds': 5,
+        })
+
+
+class CompressionTweenTests(unittest.TestCase):
+    """Unit tests for the response compression tween"""
+
+    def setUp(self):
+        self.config = testing.setUp(settings={
+            'compression.enabled': 'true',
+            'compression.min_size': '100',
+            'http_cache.enabled': 'true',
+        })
+        self.config.include('leads_api.metrics')
+        self.config.include('leads_api.data_version')
+        self.addCleanup(testing.tearDown)
+        self.data = {'coverage': [{'dealer_name': 'Dealer', 'dealer_city': 'New York'}] * 20}
+        self.calls = []
+
+    def handler(self, request):
+        from pyramid.response import Response
+
+        self.calls.append(request)
+        return Response(json=self.data)
+
+    def tween(self):
+        from leads_api.tweens import compression_tween, http_cache_tween
+        registry = self.config.registry
+        return compression_tween(http_cache_tween(self.handler, registry), registry)
+
+    def request(self, **headers):
+        from pyramid.request import Request
+        return Request.blank('/v1/coverage?zipcode=10010', headers=headers)
+
+    def test_disabled(self):
+        from leads_api.tweens import compression_tween
+
+        self.config.registry.settings['compression.enabled'] = 'false'
+
+        # Should not wrap the handler
+        self.assertEqual(compression_tween(self.handler, self.config.registry), self.handler)
+
+    def test_gzip(self):
+        import gzip
+        import json
+
+        response = self.tween()(self.request(**{'Accept-Encoding': 'gzip, deflate'}))
+        self.assertEqual(response.content_encoding, 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(response.body)), self.data)
+        self.assertIn('Accept-Encoding', response.vary)
+        self.assertLess(response.content_length, len(json.dumps(self.data)))
+
+    def test_not_accepted(self):
+        # Without the header, or refusing gzip, the body should be sent as it is
+        for headers in ({}, {'Accept-Encoding': 'gzip;q=0, identity'}):
+            response = self.tween()(self.request(**headers))
+            self.assertIsNone(response.content_encoding)
+            self.assertEqual(response.json, self.data)
+            self.assertIn('Accept-Encoding', response.vary)
+
+    def test_small_response(self):
+        self.data = {'has_coverage': False}
+        response = self.tween()(self.request(**{'Accept-Encoding': 'gzip'}))
+        self.assertIsNone(response.content_encoding)
+        self.assertIsNone(response.vary)
+
+    def test_cached(self):
+        self.config.registry['data_version'].update('1')
+        tween = self.tween()
+
+        first = tween(self.request(**{'Accept-Encoding': 'gzip'}))
+        self.assertTrue(first.etag.endswith('-gzip'))
+
+        # Should reuse the compressed bytes of the same ETag
+        second = tween(self.request(**{'Accept-Encoding': 'gzip'}))
+        self.assertEqual(second.body, first.body)
+        self.assertEqual(self.config.registry['metrics'].snapshot()['compression.cache_hits'], 1)
+
+        # The identity representation has another ETag
+        identity = tween(self.request())
+        self.assertNotEqual(identity.etag, first.etag)
+
+        # And the compressed ETag should be revalidated
+        response = tween(self.request(**{
+            'Accept-Encoding': 'gzip', 'If-None-Match': f'"{first.etag}"',
+        }))
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.etag, first.etag)
+        self.assertEqual(len(self.calls), 3)
@@ -7,6 +7,21 @@ from pyramid import testing
 class CoverageGetTests(unittest.TestCase):
     """Unit test for coverage view"""
 
+    def setUp(self):
+        # Registry with the default coverage engine
+        self.config = testing.setUp()
+        self.config.include('leads_api.data_version')
+        self.config.include('leads_api.engines')
+        self.addCleanup(testing.tearDown)
+
+        # Catalogue where the tier sells honda through a single dealer
+        from leads_api.catalogue import Catalogue
+        catalogue = Catalogue()
+        catalogue.tier_buyer['test-buyer-tier'] = 'b1'
+        catalogue.tier_makes.add(('test-buyer-tier', 'honda'))
+        catalogue.make_dealers['b1', 'honda'].add('b1-dealer-a')
+        self.config.registry['catalogue'] = catalogue
+
     def test_ok(self):
         from leads_api.views.coverage import coverage_get
 
@@ -78,6 +93,73 @@ class CoverageGetTests(unittest.TestCase):
         ):
             self.assertEqual(row.get(key), query_row[key])
 
+    def test_not_accepted(self):
+        from leads_api.views.coverage import coverage_get
+
+        # The tier is not configured for the make
+        parameters = DummyParameters(
+            query={
+                'zipcode': '10010',
+            },
+            path={
+                'buyer_tier_slug': 'test-buyer-tier',
+                'make_slug': 'ford',
+            },
+        )
+        request = testing.DummyRequest(
+            params=parameters.query,
+            openapi_validated=DummyValidated(parameters),
+            dbsession=None,
+        )
+
+        # Should answer without coverage, and without using the database
+        data = coverage_get(request)
+        self.assertEqual(data, {'has_coverage': False})
+
+
+    def test_pages(self):
+        from leads_api.pagination import decode_cursor
+        from leads_api.views.coverage import coverage_get
+
+        parameters = DummyParameters(
+            query={'zipcode': '10010', 'limit': 1},
+            path={'buyer_tier_slug': 'test-buyer-tier', 'make_slug': 'honda'},
+        )
+        rows = [
+            {'buyer': 'b1', 'buyer_tier': 'b1-blind', 'dealer_code': code, 'dealer_name': None,
+             'dealer_address': None, 'dealer_city': None, 'dealer_state': None,
+             'dealer_zipcode': None, 'dealer_phone': None, 'distance': distance,
+             'zipcode': '10010', 'make': 'honda'}
+            for code, distance in [('b1-dealer-a', 3), ('b1-dealer-b', 5)]
+        ]
+        request = testing.DummyRequest(
+            params=parameters.query,
+            openapi_validated=DummyValidated(parameters),
+            dbsession=DummyDBSession([DummyRow(row) for row in rows]),
+        )
+
+        # The extra row should only tell there's a next page
+        data = coverage_get(request)
+        self.assertEqual([row['dealer_code'] for row in data['coverage']], ['b1-dealer-a'])
+        self.assertEqual(decode_cursor(data['next_cursor']), (3, 'b1-dealer-a'))
+
+    def test_invalid_cursor(self):
+        from leads_api.views.coverage import coverage_get
+
+        parameters = DummyParameters(
+            query={'zipcode': '10010', 'cursor': 'not-a-cursor'},
+            path={'buyer_tier_slug': 'test-buyer-tier', 'make_slug': 'honda'},
+        )
+        request = testing.DummyRequest(
+            params=parameters.query,
+            openapi_validated=DummyValidated(parameters),
+            dbsession=None,
+        )
+
+        response = coverage_get(request)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json[0]['exception'], 'InvalidCursor')
+
 
 class DummyDBSession:
     """Dummy SQLAlchemy Session for testing"""
@@ -0,0 +1,44 @@
+import unittest
+
+
+class ExportEncodingTests(unittest.TestCase):
+    """Unit tests for the coverage export chunks"""
+
+    rows = [('10001', 'dealer-a', 3), ('10001', 'dealer-b, "north"', 12)]
+
+    def test_ndjson(self):
+        import json
+        from leads_api.views.export import ndjson_chunk
+
+        lines = ndjson_chunk(self.rows).decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [
+            {'zipcode': '10001', 'dealer_code': 'dealer-a', 'distance': 3},
+            {'zipcode': '10001', 'dealer_code': 'dealer-b, "north"', 'distance': 12},
+        ])
+
+    def test_csv(self):
+        import csv
+        import io
+        from leads_api.views.export import EXPORT_COLUMNS, csv_chunk
+
+        body = csv_chunk([EXPORT_COLUMNS]) + csv_chunk(self.rows)
+        self.assertEqual(list(csv.reader(io.StringIO(body.decode()))), [
+            ['zipcode', 'dealer_code', 'distance'],
+            ['10001', 'dealer-a', '3'],
+            ['10001', 'dealer-b, "north"', '12'],
+        ])
+
+    def test_gzip_chunks(self):
+        import gzip
+        import zlib
+        from leads_api.views.export import gzip_chunks
+
+        chunks = [b'{"a":1}\n' * 100, b'{"b":2}\n' * 100]
+        compressed = gzip_chunks(iter(chunks))
+
+        # Every chunk should be decodable as soon as it's received
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.assertEqual(decompressor.decompress(next(compressed)), chunks[0])
+
+        body = b''.join(gzip_chunks(iter(chunks)))
+        self.assertEqual(gzip.decompress(body), b''.join(chunks))
@@ -0,0 +1,28 @@
+import unittest
+
+from pyramid import testing
+
+
+class MetricsGetTests(unittest.TestCase):
+    """Unit test for metrics view"""
+
+    def setUp(self):
+        self.config = testing.setUp()
+        self.config.include('leads_api.metrics')
+        self.addCleanup(testing.tearDown)
+
+    def test_ok(self):
+        from leads_api.views.metrics import metrics_get
+
+        metrics = self.config.registry['metrics']
+        metrics.incr('bloom.avoided', 3)
+        metrics.set('bloom.bytes', 1024)
+
+        response = metrics_get(testing.DummyRequest())
+
+        # Should expose all the metrics as plain text
+        self.assertEqual(response.content_type, 'text/plain')
+        self.assertEqual(
+            response.text,
+            'leads_api_bloom_avoided 3\nleads_api_bloom_bytes 1024\n',
+        )